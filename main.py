@@ -7,19 +7,23 @@ import asyncio
 import random
 import time
 import logging
+import signal
 import aiohttp
+import numpy as np
 from multiprocessing import Process
 from discord import app_commands
 from discord.ext import commands
 from discord.ui import Button, View
 from src.config import GUILD_ID, TOKEN, GIVEAWAY_CHANNEL_ID
-from src.config import TOKEN_play2earn, ADMIN_IDs
+from src.config import TOKEN_play2earn, ADMIN_IDs, OCR_MIN_CONCURRENCY, OCR_MAX_CONCURRENCY, OCR_MAX_ETA_SECONDS
 from src.config import sample_image_urls, creativeMapPlayerTimeURL, LOGGING_LEVEL #, LEADERBOARD_MESSAGE_ID
 from src.db_handler import db_pool, DB_DIR, initialize_key, load_user_data, restore_user_from_db, init_pg, save_dm_link_to_database
-from src.db_handler import save_image_proof_decision
-from src.queues import RateLimitQueue, CpuIntensiveQueue
-from src.ai import check_image
+from src.db_handler import save_image_proof_decision, pg_queue, object_storage_queue, shutdown_db_queues, user_store
+from src.db_handler import get_user_rank, leaderboard_index, aggregates, ensure_users_loaded
+from src.queues import RateLimitQueue, CpuIntensiveQueue, QueueOverflow, UserRateLimited, TaskSuperseded
+from src.ai import check_image, fetch_image_bytes, screen_image_attachment, OcrEngine, ocr_cache, ocr_governor
 from src.play2earn_bot import play2earn_bot
+from src.proof_generator import PRESETS, generate_proof
 
 
 
@@ -42,17 +46,26 @@ intents.message_content = True
 intents.reactions = True
 intents.members = True
 intents.guilds = True
-bot = commands.Bot(command_prefix="!", intents=intents)
-
-
-
 rate_limiter = RateLimitQueue(50)
 logger.info("✅ created RateLimitQueue(50) succesfully!")
 
-cpu_limiter = CpuIntensiveQueue(max_workers=1)
+# http_trace: the rate limiter learns the per-route buckets from Discord's X-RateLimit-* response headers
+bot = commands.Bot(command_prefix="!", intents=intents, http_trace=rate_limiter.trace_config)
+
+ocr_engine = OcrEngine()  # worker processes are spawned in on_ready()
+# Adaptive number of concurrent OCR jobs (OCR_MIN_CONCURRENCY..OCR_MAX_CONCURRENCY, at most one per OCR process)
+cpu_limiter = CpuIntensiveQueue(max_workers=min(OCR_MAX_CONCURRENCY, ocr_engine.num_workers), min_workers=OCR_MIN_CONCURRENCY)
 logger.info("✅ created CpuIntensiveQueue() succesfully!")
 
 
+def format_queue_position(admission):
+    """Suffix of the wait message like "Du bist #37 in der Warteschlange (~2 Min.)", empty if the proof starts right away."""
+    if admission["position"] + cpu_limiter.in_flight <= cpu_limiter.limit:
+        return ""
+    eta = f" (~{max(1, round(admission['eta'] / 60))} Min.)" if admission["eta"] is not None else ""
+    return f"\nDu bist **#{admission['position']}** in der Warteschlange{eta}."
+
+
 @bot.event
 async def on_message(message):
     if message.author.bot:
@@ -60,6 +73,7 @@ async def on_message(message):
 
 
     if isinstance(message.channel, discord.DMChannel):
+        await ensure_users_loaded(message.author.id)  # a user the startup restore didn't reach yet
         initialize_key(message.author.id)
         user_data = load_user_data(message.author.id)
 
@@ -68,20 +82,56 @@ async def on_message(message):
 
             attachment = message.attachments[0]  # Nur das erste Bild verarbeiten
             for file_type in allowed_file_types:
-                if file_type in attachment.content_type:
+                if attachment.content_type and file_type in attachment.content_type:
                     if file_type == "image":
                         image_url = attachment.url
 
-                        # ✅ Defer-Wait-Nachricht senden
+                        # ✅ Zulassung: Arbeit, die nicht rechtzeitig fertig wird, gar nicht erst annehmen
+                        # (ein neues Bild ersetzt die noch wartenden Bilder desselben Users)
+                        admission = cpu_limiter.estimate_admission(message.author.id, replace=True)
+                        if admission["retry_after"]:
+                            await rate_limiter.add_request(message.channel.send, (),
+                                {"content": f"⌛ Du hast gerade sehr viele Bilder gesendet. Bitte warte noch {admission['retry_after']:.0f} Sekunden."})
+                            return
+                        if not admission["admitted"] or (admission["eta"] or 0) > OCR_MAX_ETA_SECONDS:
+                            logger.warning(f"⚠️ Proof of {message.author.id} refused: {admission}")
+                            await rate_limiter.add_request(message.channel.send, (),
+                                {"content": "⌛ Gerade werden sehr viele Nachweise geprüft. Bitte sende dein Bild in ein paar Minuten erneut."})
+                            return
+
+                        # ✅ Defer-Wait-Nachricht senden (mit Position in der Warteschlange)
                         await rate_limiter.add_request(message.channel.send, (), 
-                            {"content": "⏳ Dein Nachweis wird geprüft, bitte habe einen Moment Geduld..."})
+                            {"content": "⏳ Dein Nachweis wird geprüft, bitte habe einen Moment Geduld..." + format_queue_position(admission)})
+
+                        # ✅ Vor dem Download prüfen (Größe/Auflösung aus den Discord Metadaten), große Bilder verkleinert laden
+                        download_url, screening_error = screen_image_attachment(attachment.url, attachment.proxy_url,
+                                                                                attachment.size, attachment.width, attachment.height)
+                        image_bytes = None
+                        if screening_error:
+                            decision = {"error": screening_error}
+                        else:
+                            # ✅ Bild nur einmal laden (gestreamt, mit Größenlimit): derselbe Buffer geht an OCR, lokale Speicherung und Object Storage
+                            image_bytes = await fetch_image_bytes(download_url)
 
-                        # ✅ Bildprüfung mit cpu_limiter (asynchron)
-                        decision_future = await cpu_limiter.add_task(check_image, image_url)
-                        decision = await decision_future  # ✅ Await the Future to get the actual dictionary result
+                            # ✅ Bildprüfung mit cpu_limiter (asynchron, OCR läuft in den OcrEngine Prozessen)
+                            if image_bytes is None:
+                                decision = {"error": "Image could not be processed"}
+                            else:
+                                try:
+                                    decision = await check_image(download_url, cpu_queue=cpu_limiter, image_bytes=image_bytes,
+                                                                 user_id=message.author.id, replace=True)
+                                except (QueueOverflow, UserRateLimited):
+                                    decision = {"error": "Too many proofs in the queue, please try again later"}
+                                except TaskSuperseded:
+                                    await rate_limiter.add_request(message.channel.send, (),
+                                        {"content": "ℹ️ Dieses Bild wurde durch dein neueres Bild ersetzt, es wird nur das neueste geprüft."})
+                                    return
                         
-                        # ✅ Entscheidung speichern
-                        await save_image_proof_decision(message.author.id, image_url, decision)
+                        first_proof = user_data["played_minutes"] == 0  # inital played_minutes = 0 (taken before the decision is saved)
+
+                        # ✅ Entscheidung speichern (ein vom Media Proxy verkleinertes Bild wird nicht gespeichert, sondern das Original geladen)
+                        original_bytes = image_bytes if download_url == image_url else None
+                        await save_image_proof_decision(message.author.id, image_url, decision, image_bytes=original_bytes)
 
                         if "error" in decision:
                             embed = discord.Embed(
@@ -96,8 +146,8 @@ async def on_message(message):
                             # ✅ Antwort an den Benutzer basierend auf der Entscheidung
                             if decision["valid_hash"]:
                                 giveaway_channel = bot.get_channel(GIVEAWAY_CHANNEL_ID)
-                                if user_data["played_minutes"] == 0: # inital played_minutes = 0 so only change permission the first time
-                                    await rate_limiter.add_request(giveaway_channel.set_permissions, (message.author,), {"read_messages": True})
+                                if first_proof: # only change permission the first time
+                                    await rate_limiter.add_request(giveaway_channel.set_permissions, (message.author,), {"read_messages": True}, priority="bulk")
 
                                 time_x = 1 + decision['played_time'] / 60
                                 invites_x = user_data["invite"]["total_invites"]
@@ -156,6 +206,16 @@ async def on_message(message):
 
 
 
+async def shutdown():
+    """Graceful shutdown: drains the queues (OCR -> Discord replies and DB writes -> Discord API), then closes the bot."""
+    logger.info("🛑 Shutting down, draining queues...")
+    await cpu_limiter.drain()
+    ocr_engine.shutdown()
+    await shutdown_db_queues()
+    await rate_limiter.drain()
+    await bot.close()
+
+
 @bot.event
 async def on_ready():
     logger.info(f"✅ Logged in as {bot.user}")
@@ -166,11 +226,15 @@ async def on_ready():
     logger.info(f"✅✅✅ `db_pool` after init_pg(): {db_pool}")
     logger.info("✅ Connected to the database. ✅✅✅✅✅✅✅✅✅✅")
 
-    asyncio.create_task(rate_limiter.worker())
+    await rate_limiter.start_workers()
     logger.info("✅ Started worker of RateLimitQueue(50) succesfully!")
 
+    cpu_limiter.executor = await ocr_engine.start()
     await cpu_limiter.start_workers()
-    logger.info("✅ Started worker of CpuIntensiveQueue(1) succesfully!")
+    logger.info(f"✅ Started {cpu_limiter.max_workers} workers of CpuIntensiveQueue succesfully!")
+
+    # Replit stops/redeploys with SIGTERM: finish the queued work first, then disconnect
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, lambda: asyncio.create_task(shutdown()))
 
 
     
@@ -220,11 +284,12 @@ async def giveaway(interaction: discord.Interaction, message_id:str,  anzahl_gew
         return
 
     
-    giveaway_message = await rate_limiter.add_request(giveaway_channel.fetch_message, (int(message_id),), {})
+    giveaway_message = await rate_limiter.add_request(giveaway_channel.fetch_message, (int(message_id),), {}, priority="interaction",
+                                                      created_at=interaction.created_at)
 
     # TODO: REMOVE HARDCODED GIVEAWAY
-    faygral = await bot.fetch_user(1352680582165037127)
-    resox = await bot.fetch_user(1167383273903771668)
+    faygral = await rate_limiter.add_request(bot.fetch_user, (1352680582165037127,), {}, priority="interaction", created_at=interaction.created_at)
+    resox = await rate_limiter.add_request(bot.fetch_user, (1167383273903771668,), {}, priority="interaction", created_at=interaction.created_at)
     
     embed = discord.Embed(
         title="🎉 Gewinner des Giveaways!",
@@ -238,7 +303,7 @@ async def giveaway(interaction: discord.Interaction, message_id:str,  anzahl_gew
     embed.set_footer(text="Danke für deinen Support! ❤️")
 
     await rate_limiter.add_request(interaction.response.send_message, (), 
-        {"embed": embed})
+        {"embed": embed}, priority="interaction", created_at=interaction.created_at)
     logger.info("✅ Giveaway results sent.")
     return
     
@@ -251,16 +316,11 @@ async def giveaway(interaction: discord.Interaction, message_id:str,  anzahl_gew
     with_populated = False
 
     if with_populated:
-        for file_name in os.listdir("data"):      # FOR USERS SAVED IN THE DABASE (FOR DEBUGGING)
-            if file_name.endswith(".json"):
-                file_path = os.path.join("data", file_name)
-                with open(file_path, "r", encoding="utf-8") as file:
-                    user_data = json.load(file)
-                    if user_data:
-                        chance = calculate_total_chance(user_data["played_minutes"], user_data["invite"]["total_invites"], user_data["creator_code"]) 
-                        participants.append(user_data["discord_id"])
-                        user_weights.append(chance)
-                        total_chance += chance
+        for user_data in user_store.iter_users():      # FOR USERS SAVED IN THE DABASE (FOR DEBUGGING)
+            chance = calculate_total_chance(user_data["played_minutes"], user_data["invite"]["total_invites"], user_data["creator_code"]) 
+            participants.append(user_data["discord_id"])
+            user_weights.append(chance)
+            total_chance += chance
     
     else: 
         for reaction in giveaway_message.reactions:    # FOR USERS THAT HAVE REACTED/ ACCESS TO GIVEAWAY
@@ -281,7 +341,7 @@ async def giveaway(interaction: discord.Interaction, message_id:str,  anzahl_gew
     if len(participants) < anzahl_gewinner:
         await rate_limiter.add_request(interaction.response.send_message, (), 
             {"content":"❌ Nicht genug Teilnehmer!",
-            "ephemeral":True})
+            "ephemeral":True}, priority="interaction", created_at=interaction.created_at)
         return
 
     # Select winners using weighted random sampling
@@ -307,7 +367,7 @@ async def giveaway(interaction: discord.Interaction, message_id:str,  anzahl_gew
     embed.set_footer(text="Danke für deinen Support! ❤️")
 
     await rate_limiter.add_request(interaction.response.send_message, (), 
-        {"embed": embed})
+        {"embed": embed}, priority="interaction", created_at=interaction.created_at)
     logger.info("✅ Giveaway results sent.")
 
 
@@ -372,6 +432,36 @@ async def sync2(interaction: discord.Interaction):
     logger.info("✅⚠️ Slash commands synced2! commands")
 
 
+@bot.tree.command(name="stats")
+@is_admin_user()
+async def stats(interaction: discord.Interaction):
+    """Shows runtime statistics (OCR cache, ...)."""
+    lines = ["**OCR Cache**"] + [f"{key}: {value}" for key, value in ocr_cache.get_stats().items()]
+    lines += ["**OCR Load**"] + [f"{key}: {value}" for key, value in {**ocr_governor.get_stats(), **cpu_limiter.get_load()}.items()]
+    lines += ["**Discord Rate Limits**"] + [f"{key}: {value}" for key, value in rate_limiter.get_stats().items()]
+    lines += ["**PostgreSQL Write-Behind**"] + [f"{key}: {value}" for key, value in pg_queue.get_stats().items()]
+    lines += ["**User Store**"] + [f"{key}: {value}" for key, value in user_store.get_stats().items()]
+    lines += ["**Leaderboard Index**"] + [f"{key}: {value}" for key, value in leaderboard_index.get_stats().items()]
+    lines += ["**Aggregates**"] + [f"{key}: {value}" for key, value in aggregates.get_stats().items()]
+    lines += ["**Object Storage Uploads**"] + [f"{key}: {value}" for key, value in object_storage_queue.get_stats().items()]
+    await interaction.response.send_message("\n".join(lines), ephemeral=True)
+
+
+@bot.tree.command(name="rank", description="Zeigt deinen Platz im Leaderboard (oder den eines anderen Supporters)")
+async def rank(interaction: discord.Interaction, user: discord.Member = None):
+    """Looks up a user's leaderboard rank in the leaderboard index."""
+    user = user or interaction.user
+    ranked = get_user_rank(user.id)
+    if ranked is None:
+        await interaction.response.send_message(f"❌ {user.mention} ist noch nicht im Leaderboard.", ephemeral=True)
+        return
+    position, entry = ranked
+    await interaction.response.send_message(
+        f"🏆 {user.mention} ist auf Platz **{position}** mit 🎲 {entry['total_chance']} Gewinnchance "
+        f"(⏱ {entry['played_minutes']} Minuten, 🔗 {entry['invites']} Einladungen, ✅ Creator Code {entry['creator_code']})",
+        ephemeral=True)
+
+
 @bot.tree.command(name="restore_user")
 @is_admin_user()
 async def restore_user(interaction: discord.Interaction, user: discord.Member):
@@ -406,7 +496,7 @@ class BaseView(View):
             child.disabled = True
 
         await rate_limiter.add_request(interaction.message.edit, (), # Update the message
-            {"view": self})
+            {"view": self}, coalesce_key=("view", interaction.message.id))  # several clicks -> one edit
         logger.debug("✅⚠️ Buttons disabled.")
 
 
@@ -419,6 +509,11 @@ class Welcome2SubmitView(BaseView):
         guild = interaction.guild
         user = interaction.user
 
+        # Acknowledge within the 3 seconds first, loading the user and the DM (and the link to it) can take longer under load
+        await rate_limiter.add_request(interaction.response.defer, (), {"ephemeral": True, "thinking": True},
+                                       priority="interaction", created_at=interaction.created_at)
+
+        await ensure_users_loaded(user.id)
         initialize_key(user.id)
         user_data = load_user_data(user.id)
             
@@ -437,8 +532,8 @@ class Welcome2SubmitView(BaseView):
 
         dm_message = await rate_limiter.add_request(user.send, (), {"embed": embed})
         dm_link = dm_message.jump_url
-        save_dm_link_to_database(user.id, user.name, dm_link)
-        await rate_limiter.add_request(interaction.response.send_message, (), 
+        await save_dm_link_to_database(user.id, user.name, dm_link)
+        await rate_limiter.add_request(interaction.followup.send, (), 
             {"content":f"✅ {user.mention} Ich habe dir eine DM gesendet! ➡️ **[Zu deinen DMs🔗]({dm_link}) **",
              "ephemeral":True})
 
@@ -470,15 +565,18 @@ async def stress_test_concurrent_users(frequency=10):
 
 async def test_cpu_queue(max_workers=1):
 
-    cpu_limiterTEST = CpuIntensiveQueue(max_workers=max_workers)
+    cpu_limiterTEST = CpuIntensiveQueue(max_workers=max_workers, min_workers=max_workers)
     logger.info("✅ created CpuIntensiveQueue() succesfully!")
     await cpu_limiterTEST.start_workers()
     logger.info("✅ Started worker of CpuIntensiveQueue() succesfully!")
     
     testing_starttime = time.time()
 
+    # Synthetic proofs (see src/proof_generator.py) instead of live CDN URLs
+    rng = np.random.default_rng()
+    test_images = [generate_proof(rng, preset=preset)[0] for preset in PRESETS for j in range(4)]
     image_tasks = [
-        cpu_limiterTEST.add_task(check_image, i) for i in range(1,8) for j in range(4)
+        check_image(None, cpu_queue=cpu_limiterTEST, image_bytes=image_bytes) for image_bytes in test_images
     ]
     results = await asyncio.gather(*image_tasks)  # Wait for all tasks to finish
 
@@ -525,14 +623,9 @@ def run_bot_with_flask(bot, token):
 
 if __name__ == "__main__":
 
-    # ❌DANGER❌ DELETE local fileystem database at /data which we alse be the case when restarting the deployed bot
-    if os.path.exists(DB_DIR):
-        shutil.rmtree(DB_DIR)
-        logger.info(f"🗑️ Deleted directory: {DB_DIR}")
-    else:
-        logger.info(f"❌ Directory does not exist: {DB_DIR}")
-    time.sleep(0.1)
-    os.makedirs(DB_DIR, exist_ok=True)  # reset the database
+    # The local user store in /data is kept as a snapshot: init_pg() only catches up with the PostgreSQL changes since
+    # the last restore (all users if there is no snapshot yet, e.g. on a fresh deployment)
+    os.makedirs(DB_DIR, exist_ok=True)
 
 
     
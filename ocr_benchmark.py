@@ -0,0 +1,99 @@
+import os
+import sys
+import time
+import asyncio
+import argparse
+import tempfile
+import numpy as np
+
+# The benchmark runs offline: the modules in src import each other like in the bot and only need a placeholder key
+# (the one of timeTracker.verse) because the hashes are generated with the same key.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "src"))
+os.environ.setdefault("SECRET_TIMETRACKER_KEY", "13456789012345679")
+
+from ai import OcrEngine, OCR_PROFILES, check_image_bytes
+from queues import CpuIntensiveQueue
+from proof_generator import PRESETS, generate_proof
+from config import OCR_WORKERS
+
+
+# OFFLINE OCR BENCHMARK
+# Renders synthetic proof images with known ground truth and runs them through the OCR pipeline of check_image()
+# (OcrEngine worker pool + CpuIntensiveQueue, without the result cache). Every OCR change should be judged by this.
+# The digit templates the workers learn go to a temporary file (never to DIGIT_TEMPLATES_PATH), every preset/profile
+# starts without templates: the cold pass learns them, the warm pass runs the same images with the learned templates.
+#
+#   python ocr_benchmark.py --images 20 --invalid-ratio 0.2 --seed 1
+
+
+def generate_dataset(preset, count, invalid_ratio, seed):
+    """Generates `count` proofs for a preset, `invalid_ratio` of them with a wrong hash."""
+    rng = np.random.default_rng(seed)
+    return [generate_proof(rng, preset=preset, valid=rng.random() >= invalid_ratio) for _ in range(count)]
+
+
+def is_correct(result, truth):
+    """A valid proof must be accepted with the right minutes, an invalid one must be rejected."""
+    if truth["valid_hash"]:
+        return bool(result.get("valid_hash")) and result.get("played_time") == truth["played_time"]
+    return not result.get("valid_hash")
+
+
+async def timed_task(cpu_queue, image_bytes, stages):
+    start_time = time.perf_counter()
+    result = await cpu_queue.add_task(check_image_bytes, image_bytes, stages=stages)
+    return result, time.perf_counter() - start_time
+
+
+async def run_benchmark(dataset, stages, cpu_queue):
+    """Runs all images of a dataset concurrently and returns the metrics."""
+    start_time = time.perf_counter()
+    runs = await asyncio.gather(*(timed_task(cpu_queue, image_bytes, stages) for image_bytes, _ in dataset))
+    elapsed = time.perf_counter() - start_time
+
+    latencies = [latency for _, latency in runs]
+    valid_total = sum(1 for _, truth in dataset if truth["valid_hash"])
+    return {
+        "images_per_sec": len(dataset) / elapsed,
+        "p50": float(np.percentile(latencies, 50)),
+        "p95": float(np.percentile(latencies, 95)),
+        "accuracy": sum(is_correct(result, truth) for (result, _), (_, truth) in zip(runs, dataset)) / len(dataset),
+        "recall": sum(bool(result.get("valid_hash")) for (result, _), (_, truth) in zip(runs, dataset) if truth["valid_hash"]) / max(1, valid_total),
+        "false_accepts": sum(bool(result.get("valid_hash")) for (result, _), (_, truth) in zip(runs, dataset) if not truth["valid_hash"])
+    }
+
+
+async def main(args):
+    num_workers = max(1, args.workers or OCR_WORKERS)
+    # Fixed concurrency (min == max), so the numbers don't depend on the adaptive controller's ramp-up
+    cpu_queue = CpuIntensiveQueue(max_workers=num_workers, min_workers=num_workers)
+    await cpu_queue.start_workers()
+
+    presets = args.presets or list(PRESETS)
+    profiles = args.profiles or list(OCR_PROFILES)
+    print(f"{'preset':<12} {'profile':<9} {'pass':<5} {'images/s':>9} {'p50 [s]':>8} {'p95 [s]':>8} {'accuracy':>9} {'recall':>7} {'false acc.':>10}")
+    with tempfile.TemporaryDirectory(prefix="ocr_benchmark_") as templates_dir:
+        for preset in presets:
+            dataset = generate_dataset(preset, args.images, args.invalid_ratio, args.seed)
+            for profile in profiles:
+                # New workers with an empty templates file: the workers keep the templates they loaded in memory
+                ocr_engine = OcrEngine(num_workers=num_workers, templates_path=os.path.join(templates_dir, f"{preset}_{profile}.npz"))
+                cpu_queue.executor = await ocr_engine.start()
+                try:
+                    for run in ("cold", "warm"):
+                        metrics = await run_benchmark(dataset, OCR_PROFILES[profile], cpu_queue)
+                        print(f"{preset:<12} {profile:<9} {run:<5} {metrics['images_per_sec']:>9.2f} {metrics['p50']:>8.2f} {metrics['p95']:>8.2f} "
+                              f"{metrics['accuracy']:>9.1%} {metrics['recall']:>7.1%} {metrics['false_accepts']:>10}")
+                finally:
+                    ocr_engine.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline OCR benchmark on synthetic proof images.")
+    parser.add_argument("--images", type=int, default=20, help="Images per preset")
+    parser.add_argument("--invalid-ratio", type=float, default=0.2, help="Share of proofs with a wrong hash")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--workers", type=int, default=None, help="OCR worker processes (default: OCR_WORKERS)")
+    parser.add_argument("--presets", nargs="*", choices=list(PRESETS), help="Augmentation presets (default: all)")
+    parser.add_argument("--profiles", nargs="*", choices=list(OCR_PROFILES), help="OCR profiles (default: all)")
+    asyncio.run(main(parser.parse_args()))
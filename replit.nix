@@ -13,7 +13,8 @@
     pkgs.cairo
     pkgs.libGLU
     pkgs.libGL
-    pkgs.tesseract
+    pkgs.tesseract  # also provides the headers/libs tesserocr (requirements.txt) is built against
+    pkgs.leptonica
     pkgs.unixtools.ping
     pkgs.postgresql
     pkgs.glibcLocales
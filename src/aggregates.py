@@ -0,0 +1,228 @@
+import os
+import sys
+import json
+import time
+import fcntl
+import asyncio
+import logging
+from config import LOGGING_LEVEL, AGGREGATES_CHECKPOINT, AGGREGATES_CHECKPOINT_INTERVAL, AGGREGATES_RECONCILE_INTERVAL
+
+
+# ✅ Setup logging configuration
+logging.basicConfig(
+    level=LOGGING_LEVEL,  # Capture ALL logs (INFO, DEBUG, ERROR)
+    format="%(asctime)s [%(levelname)s] %(message)s",
+    handlers=[
+        logging.StreamHandler(sys.stdout)  # Ensure logs are printed to Replit console
+    ]
+)
+logger = logging.getLogger(__name__)  # ✅ Use logger instead of print()
+
+
+# USER AGGREGATES
+# Running totals over all users (for the live "Minutes Played" / "Price Pool" channels and /stats), so nobody has to
+# read every user entry to get one number.
+
+FIELDS = ("users", "played_minutes", "approved_proofs", "denied_proofs", "total_invites", "creator_code_users")
+ZERO = (0,) * len(FIELDS)
+
+
+def contribution(user_data):
+    """What one user entry adds to each total (in the order of FIELDS)."""
+    if user_data is None:
+        return ZERO
+    images = user_data.get("images") or []
+    return (
+        1,
+        user_data.get("played_minutes") or 0,
+        sum(1 for image in images if image.get("image_status") == "approved"),
+        sum(1 for image in images if image.get("image_status") == "denied"),
+        user_data.get("invite", {}).get("total_invites") or 0,
+        1 if user_data.get("creator_code") else 0
+    )
+
+
+class UserAggregates:
+    """
+    Totals over all user entries, kept up to date from the user store's change listener: the totals only change by
+    the difference between a user's old and new contribution, so an update costs the same for 10 or 100k users.
+
+    The contributions are checkpointed to `checkpoint_path` with the store version they are up to date with, so a
+    restart only applies the entries written since. Both bot processes checkpoint to the same file, the one with the
+    newer version is kept (write_checkpoint()). A full recount in the background (reconcile()) corrects the
+    totals if they ever drift (e.g. a checkpoint newer than the entries that were flushed before a crash).
+    """
+    def __init__(self, checkpoint_path=AGGREGATES_CHECKPOINT, checkpoint_interval=AGGREGATES_CHECKPOINT_INTERVAL,
+                 reconcile_interval=AGGREGATES_RECONCILE_INTERVAL):
+        self.checkpoint_path = checkpoint_path
+        self.checkpoint_interval = checkpoint_interval
+        self.reconcile_interval = reconcile_interval
+        self.contributions = {}  # discord_id -> contribution()
+        self.totals = dict.fromkeys(FIELDS, 0)
+        self.synced_version = None  # store version the totals are up to date with (None = not counted yet)
+        self.touched = None  # during reconcile(): users updated meanwhile
+        self.changed = False  # something to checkpoint
+        self.task = None
+        self.stats = {"updates": 0, "syncs": 0, "checkpoints": 0, "checkpoints_skipped": 0, "recounts": 0, "reconciles": 0, "corrections": 0}
+        self.load_checkpoint()
+
+    def update(self, discord_id, user_data):
+        """Applies the difference between the user's old and new contribution (user_data None removes the user)."""
+        discord_id = str(discord_id)
+        new = contribution(user_data)
+        old = self.contributions.get(discord_id, ZERO)
+        if new != old:
+            for field, old_value, new_value in zip(FIELDS, old, new):
+                self.totals[field] += new_value - old_value
+            if user_data is None:
+                self.contributions.pop(discord_id, None)
+            else:
+                self.contributions[discord_id] = new
+            self.changed = True
+        if self.touched is not None:
+            self.touched.add(discord_id)
+        self.stats["updates"] += 1
+
+    def recount(self, user_store):
+        """Counts all entries of the store from scratch."""
+        version = user_store.current_version()
+        self.contributions = {user_data["discord_id"]: contribution(user_data) for user_data in user_store.iter_users()}
+        self.totals = {field: sum(values) for field, values in zip(FIELDS, zip(ZERO, *self.contributions.values()))}
+        self.synced_version = version
+        self.changed = True
+        self.stats["recounts"] += 1
+        logger.info(f"🧮 Counted totals of {len(self.contributions)} users")
+
+    def sync(self, user_store):
+        """Applies the entries written since the last sync (by the other process), counts everything if there is no checkpoint."""
+        if self.synced_version is None:
+            self.recount(user_store)
+            return
+        records, self.synced_version = user_store.changed_since(self.synced_version)
+        for user_data in records:
+            self.update(user_data["discord_id"], user_data)
+        self.stats["syncs"] += 1
+
+    async def reconcile(self, user_store, chunk=1000):
+        """
+        Recounts all entries in the event loop (yielding every `chunk` users) and corrects the totals if they differ.
+        Users that change during the recount keep the contribution update() gave them.
+        """
+        self.touched = set()
+        try:
+            version = user_store.current_version()
+            contributions = {}
+            for index, user_data in enumerate(user_store.iter_users()):
+                contributions[user_data["discord_id"]] = contribution(user_data)
+                if index % chunk == chunk - 1:
+                    await asyncio.sleep(0)
+            for discord_id in self.touched:
+                if discord_id in self.contributions:
+                    contributions[discord_id] = self.contributions[discord_id]
+                else:
+                    contributions.pop(discord_id, None)
+        finally:
+            self.touched = None
+        totals = {field: sum(values) for field, values in zip(FIELDS, zip(ZERO, *contributions.values()))}
+        self.stats["reconciles"] += 1
+        if totals != self.totals:
+            self.stats["corrections"] += 1
+            logger.warning(f"⚠️ Aggregates drifted, corrected {self.totals} -> {totals}")
+            self.contributions, self.totals = contributions, totals
+            self.changed = True
+        self.synced_version = min(self.synced_version, version) if self.synced_version is not None else version
+
+    def read_checkpoint(self):
+        """Returns the stored checkpoint, None if there is none (or it can't be read)."""
+        try:
+            with open(self.checkpoint_path, "r", encoding="utf-8") as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"⚠️ Ignoring unreadable aggregates checkpoint {self.checkpoint_path}: {e}")
+            return None
+
+    def load_checkpoint(self):
+        checkpoint = self.read_checkpoint()
+        if checkpoint is None:
+            return
+        if checkpoint.get("fields") != list(FIELDS):
+            logger.info("🔄 Aggregates checkpoint has other fields, counting again")
+            return
+        self.contributions = {discord_id: tuple(values) for discord_id, values in checkpoint["contributions"].items()}
+        self.totals = checkpoint["totals"]
+        self.synced_version = checkpoint["version"]
+        logger.info(f"✅ Loaded aggregates checkpoint of {len(self.contributions)} users: {self.totals}")
+
+    def write_checkpoint(self, content, version):
+        """
+        Writes the checkpoint atomically (runs in a thread). Both bot processes write it: under a lock, and not over
+        a checkpoint the other process wrote at a newer store version.
+
+        :return: False if the stored checkpoint is newer (nothing written)
+        """
+        os.makedirs(os.path.dirname(self.checkpoint_path) or ".", exist_ok=True)
+        with open(f"{self.checkpoint_path}.lock", "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)  # released when the file is closed
+            stored = self.read_checkpoint()
+            if stored is not None and stored.get("fields") == list(FIELDS) and stored.get("version", 0) > version:
+                return False
+            temp_path = f"{self.checkpoint_path}.{os.getpid()}.tmp"
+            with open(temp_path, "w", encoding="utf-8") as file:
+                file.write(content)
+            os.replace(temp_path, self.checkpoint_path)
+        return True
+
+    async def checkpoint(self):
+        if not self.changed or self.synced_version is None:
+            return
+        self.changed = False
+        content = json.dumps({"fields": list(FIELDS), "version": self.synced_version, "totals": self.totals,
+                              "contributions": self.contributions}, separators=(",", ":"))
+        try:
+            if await asyncio.to_thread(self.write_checkpoint, content, self.synced_version):
+                self.stats["checkpoints"] += 1
+            else:
+                self.stats["checkpoints_skipped"] += 1
+                logger.debug("💾 Aggregates checkpoint of the other process is newer, not replaced")
+        except Exception as e:
+            self.changed = True
+            logger.error(f"❌ Writing aggregates checkpoint failed: {e}")
+
+    async def maintain(self, user_store):
+        """Syncs and checkpoints every checkpoint_interval seconds, reconciles every reconcile_interval seconds."""
+        last_reconcile = time.monotonic()
+        while True:
+            await asyncio.sleep(self.checkpoint_interval)
+            try:
+                self.sync(user_store)
+                if time.monotonic() - last_reconcile >= self.reconcile_interval:
+                    last_reconcile = time.monotonic()
+                    await self.reconcile(user_store)
+                await self.checkpoint()
+            except Exception as e:
+                logger.error(f"❌ Aggregates maintenance failed: {e}")
+
+    def start(self, user_store):
+        """Brings the totals up to date and starts the background checkpoints/reconciles (in the running event loop)."""
+        self.sync(user_store)
+        if self.task is None:
+            self.task = asyncio.create_task(self.maintain(user_store))
+            logger.info(f"✅ Started aggregates maintenance (checkpoint {self.checkpoint_interval}s, reconcile {self.reconcile_interval}s)")
+
+    async def close(self):
+        """Stops the background task and writes a last checkpoint."""
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+        await self.checkpoint()
+
+    def get_totals(self):
+        """Current totals (the other process's writes are applied by maintain() every checkpoint_interval seconds)."""
+        return dict(self.totals)
+
+    def get_stats(self):
+        return {**self.totals, "counted_users": len(self.contributions), **self.stats}
+
+# --- END OF USER AGGREGATES ---
@@ -8,9 +8,22 @@ import sys
 import numpy as np
 import aiohttp
 import asyncio
+import struct
+import multiprocessing
+from urllib.parse import urlencode, urlsplit, parse_qsl, urlunsplit
+from concurrent.futures import ProcessPoolExecutor
 from matplotlib import pyplot as plt
 from fuzzywuzzy import process
-from config import LOGGING_LEVEL, SECRET_TIMETRACKER_KEY
+from config import LOGGING_LEVEL, SECRET_TIMETRACKER_KEY, OCR_WORKERS
+from config import OCR_DEGRADE_QUEUE_DEPTH, OCR_DEGRADE_WAIT_SECONDS, OCR_RECOVER_RATIO
+from config import MAX_IMAGE_BYTES, MAX_IMAGE_PIXELS, OCR_MAX_PIXELS, DECODE_MIN_LONG_SIDE
+from http_client import get_http_session, read_capped, ResponseTooLarge
+from ocr_cache import OcrResultCache
+
+try:
+    import tesserocr  # Optional: binds libtesseract directly so a worker keeps the model loaded between images
+except ImportError:
+    tesserocr = None
 
 #pytesseract.pytesseract.tesseract_cmd = "/nix/store/73fd7sj6spffmshv6q5ijjqxf5zmjfbk-tesseract-5.3.0/bin/tesseract"
 
@@ -32,6 +45,131 @@ custom_tessdata_dir = "models"
 custom_config = f"--tessdata-dir {custom_tessdata_dir} --oem 3 --psm 6"
 model = "eng_fast"
 
+# ✅ Bump OCR_PIPELINE_VERSION whenever preprocessing/parsing changes, it is part of the OCR cache key
+OCR_PIPELINE_VERSION = f"{model}|{custom_config}|roi-v1|digits-v1|templates-v1|cascade-v1|gray-decode-v1"
+# Errors that depend only on the image content. Other errors (e.g. a crashed tesseract) are not cached.
+CACHEABLE_ERRORS = {"Image could not be processed", "Image too large", "Invalid format", "Incomplete or incorrect data"}
+ocr_cache = OcrResultCache()
+
+
+def screen_image_attachment(url, proxy_url, size, width, height):
+    """
+    Screens an attachment with the metadata Discord sends along (no download needed).
+    Oversized images are rejected, large ones are requested downscaled from Discord's media proxy.
+
+    :param url: The CDN URL of the attachment.
+    :param proxy_url: The media proxy URL of the attachment (supports `width`/`height` query parameters).
+    :param size: File size in bytes.
+    :param width: Image width in pixels (None if Discord could not read it).
+    :param height: Image height in pixels (None if Discord could not read it).
+    :return: Tuple (URL to download, error message or None).
+    """
+    if size and size > MAX_IMAGE_BYTES:
+        logger.warning(f"⚠️ Attachment rejected: {size} bytes > {MAX_IMAGE_BYTES}")
+        return None, "Image too large"
+    if not width or not height:
+        return url, None  # not readable for Discord, the streamed download and the decoder still check it
+    if width * height > MAX_IMAGE_PIXELS:
+        logger.warning(f"⚠️ Attachment rejected: {width}x{height} pixels")
+        return None, "Image too large"
+    if width * height > OCR_MAX_PIXELS and proxy_url:
+        scale = (OCR_MAX_PIXELS / (width * height)) ** 0.5
+        parts = urlsplit(proxy_url)
+        query = parse_qsl(parts.query) + [("width", int(width * scale)), ("height", int(height * scale))]
+        logger.info(f"📉 Attachment {width}x{height} is downscaled by the media proxy (x{scale:.2f})")
+        return urlunsplit(parts._replace(query=urlencode(query))), None
+    return url, None
+
+async def fetch_image_bytes(image_url, max_bytes=MAX_IMAGE_BYTES):
+    """
+    Fetches the raw bytes of an image from a Discord CDN URL.
+    The body is streamed and the download is aborted as soon as it exceeds `max_bytes`.
+
+    :param image_url: The URL of the image to fetch.
+    :param max_bytes: Hard cap of the download size.
+    :return: The image bytes or None if an error occurs.
+    """
+    try:
+        async with get_http_session().get(image_url) as response:
+            if response.status != 200:
+                logger.error(f"❌ Failed to fetch image: HTTP {response.status}")
+                return None
+            return await read_capped(response, max_bytes)
+
+    except ResponseTooLarge as e:
+        logger.error(f"❌ Image too large: {e}")
+        return None
+    except Exception as e:
+        logger.error(f"❌ Error fetching image: {e}")
+        return None
+
+def read_image_size(image_bytes):
+    """
+    Reads width and height from the PNG/JPEG header without decoding the image.
+
+    :param image_bytes: The raw image bytes.
+    :return: Tuple (width, height) or None for other formats / broken headers.
+    """
+    try:
+        if image_bytes[:8] == b"\x89PNG\r\n\x1a\n":
+            return struct.unpack(">II", image_bytes[16:24])
+        if image_bytes[:2] == b"\xff\xd8":
+            i = 2
+            while i + 9 < len(image_bytes):
+                if image_bytes[i] != 0xFF:
+                    return None
+                marker = image_bytes[i + 1]
+                if marker == 0xFF:  # fill byte
+                    i += 1
+                    continue
+                length = struct.unpack(">H", image_bytes[i + 2:i + 4])[0]
+                if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):  # start of frame
+                    height, width = struct.unpack(">HH", image_bytes[i + 5:i + 9])
+                    return width, height
+                i += 2 + length
+    except struct.error:
+        pass
+    return None
+
+def decode_image(image_bytes):
+    """
+    Decodes image bytes into OpenCV format.
+
+    :param image_bytes: The raw (PNG/JPEG/...) image bytes.
+    :return: OpenCV image (NumPy array) or None if decoding failed.
+    """
+    # ✅ Convert bytes to NumPy array and decode image
+    np_arr = np.frombuffer(image_bytes, np.uint8)
+    image = cv2.imdecode(np_arr, cv2.IMREAD_COLOR)
+
+    if image is None:
+        logger.error("❌ Invalid image format or decoding failed.")
+        return None
+
+    return image
+
+def decode_image_gray(image_bytes, size=None):
+    """
+    Decodes image bytes straight into a (reduced) grayscale image, as the OCR needs it.
+    Large images are decoded at 1/2, 1/4 or 1/8 size (JPEGs are scaled inside the decoder), so a 12 MP photo is
+    never expanded into a full resolution BGR array.
+
+    :param image_bytes: The raw (PNG/JPEG/...) image bytes.
+    :param size: (width, height) from read_image_size(), None decodes at full size.
+    :return: Grayscale OpenCV image or None if decoding failed.
+    """
+    flag = cv2.IMREAD_GRAYSCALE
+    if size:
+        for factor, reduced_flag in ((8, cv2.IMREAD_REDUCED_GRAYSCALE_8), (4, cv2.IMREAD_REDUCED_GRAYSCALE_4), (2, cv2.IMREAD_REDUCED_GRAYSCALE_2)):
+            if max(size) / factor >= DECODE_MIN_LONG_SIDE:
+                flag = reduced_flag
+                break
+
+    image = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), flag)
+    if image is None:
+        logger.error("❌ Invalid image format or decoding failed.")
+        return None
+    return image
 
 async def fetch_image_from_cdn(image_url):
     """
@@ -40,51 +178,661 @@ async def fetch_image_from_cdn(image_url):
     :param image_url: The URL of the image to fetch.
     :return: OpenCV image (NumPy array) or None if an error occurs.
     """
-    try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(image_url) as response:
-                if response.status != 200:
-                    logger.error(f"❌ Failed to fetch image: HTTP {response.status}")
-                    return None
+    image_bytes = await fetch_image_bytes(image_url)
+    if image_bytes is None:
+        return None
+    return decode_image(image_bytes)
 
-                image_bytes = await response.read()
 
-        # ✅ Convert bytes to NumPy array and decode image
-        np_arr = np.frombuffer(image_bytes, np.uint8)
-        image = cv2.imdecode(np_arr, cv2.IMREAD_COLOR)
+# OCR ENGINE
 
-        if image is None:
-            logger.error("❌ Invalid image format or decoding failed.")
-            return None
+# Set in every OCR worker process by _init_ocr_worker(). Stays None in processes that never ran the initializer,
+# in which case run_ocr() falls back to pytesseract (one tesseract process per image).
+_tess_api = None
 
-        return image
+def _init_ocr_worker(tessdata_dir, lang, templates_path=None):
+    """
+    Runs once per OCR worker process: loads the model a single time and keeps it resident.
 
-    except Exception as e:
-        logger.error(f"❌ Error fetching image: {e}")
+    :param templates_path: Digit templates file of the worker's DigitTemplateClassifier (default: DIGIT_TEMPLATES_PATH).
+    """
+    global _tess_api
+    if templates_path is not None:
+        digit_classifier.path = templates_path
+    if tesserocr is not None:
+        _tess_api = tesserocr.PyTessBaseAPI(path=tessdata_dir, lang=lang,
+                                            psm=tesserocr.PSM.SINGLE_BLOCK, oem=tesserocr.OEM.DEFAULT)
+    logger.info(f"✅ OCR worker {os.getpid()} ready (resident model: {_tess_api is not None})")
+
+def _ocr_worker_ping():
+    """No-op job used to spawn and pre-warm the worker processes."""
+    return os.getpid()
+
+def run_ocr(image, whitelist=None):
+    """
+    Runs Tesseract on a grayscale image.
+
+    :param image: Grayscale OpenCV image (2D NumPy array).
+    :param whitelist: Optional string of the only characters Tesseract may output.
+    :return: The recognised text.
+    """
+    if _tess_api is not None:
+        image = np.ascontiguousarray(image)
+        height, width = image.shape[:2]
+        _tess_api.SetVariable("tessedit_char_whitelist", whitelist or "")
+        _tess_api.SetImageBytes(image.tobytes(), width, height, 1, width)
+        return _tess_api.GetUTF8Text()
+    config = custom_config if whitelist is None else f"{custom_config} -c tessedit_char_whitelist={whitelist}"
+    return pytesseract.image_to_string(image, lang=model, config=config)
+
+
+class OcrEngine:
+    """
+    Pool of long-lived OCR worker processes. Every worker loads the eng_fast model once and reuses it
+    for all following images, so throughput scales with the number of cores instead of being bound by the GIL.
+    Hand `engine.executor` to the CpuIntensiveQueue so the queue feeds the workers.
+    `templates_path` replaces DIGIT_TEMPLATES_PATH in the workers (ocr_benchmark.py must not learn into the production file).
+    """
+    def __init__(self, num_workers=OCR_WORKERS, templates_path=None):
+        self.num_workers = max(1, num_workers)
+        self.templates_path = templates_path
+        self.executor = None
+
+    async def start(self):
+        """Creates the process pool and waits until every worker is spawned and has its model loaded."""
+        if self.executor is not None:
+            return self.executor
+
+        # forkserver: the bot process runs threads (asyncio.to_thread, the user store), forking it could copy a lock
+        # some thread holds into the workers. Workers start from the clean fork server process instead.
+        self.executor = ProcessPoolExecutor(
+            max_workers=self.num_workers,
+            mp_context=multiprocessing.get_context("forkserver"),
+            initializer=_init_ocr_worker,
+            initargs=(os.path.abspath(custom_tessdata_dir), model, self.templates_path)
+        )
+        loop = asyncio.get_running_loop()
+        pids = await asyncio.gather(*[loop.run_in_executor(self.executor, _ocr_worker_ping) for _ in range(self.num_workers)])
+        logger.info(f"✅ OcrEngine started {len(set(pids))} worker processes")
+        if tesserocr is None:
+            logger.warning("⚠️⚠️⚠️ tesserocr is NOT installed: every OCR call starts its own tesseract process through pytesseract "
+                           "(much slower, several calls per proof). Install tesserocr (requirements.txt, replit.nix) to keep the model loaded. ⚠️⚠️⚠️")
+        return self.executor
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+# --- END OF OCR ENGINE ---
+
+
+# REGION OF INTEREST
+
+# The proof popup of timeTracker.verse is light text on a dark panel. Detection runs on a small copy of the
+# image, the crop is then rescaled so the text lines have the same height (~ same DPI) for every input resolution.
+ROI_DETECTION_WIDTH = 960  # width of the downscaled copy used to search the popup
+ROI_MIN_EDGE_STRENGTH = 60  # min. gradient (0-255) for a pixel to count as glyph edge
+ROI_LINE_HEIGHT = 32  # text line height (px) the popup crop is normalised to before OCR
+
+def find_text_lines(image_gray, frame_length=None):
+    """
+    Finds text line boxes with a morphological gradient + horizontal closing.
+
+    :param image_gray: Grayscale OpenCV image.
+    :param frame_length: See find_text_words().
+    :return: List of (x, y, w, h) line boxes.
+    """
+    return merge_words_to_lines(find_text_words(image_gray, frame_length=frame_length))
+
+def find_text_words(image_gray, word_gap=None, frame_length=None):
+    """
+    Finds word boxes: glyph edges that are closer than `word_gap` pixels are connected.
+
+    :param image_gray: Grayscale OpenCV image.
+    :param word_gap: Max. horizontal gap (px) inside a word. Defaults to 1/160 of the image width.
+    :param frame_length: Straight edges longer than this (px) are removed as frames. Defaults to 1/10 of width/height.
+    :return: List of (x, y, w, h) word boxes.
+    """
+    height, width = image_gray.shape[:2]
+    gradient = cv2.morphologyEx(image_gray, cv2.MORPH_GRADIENT, cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3)))
+    otsu_threshold, _ = cv2.threshold(gradient, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)
+    # Glyph edges of the popup are high contrast, never accept a threshold that lets soft scenery edges through
+    _, mask = cv2.threshold(gradient, max(otsu_threshold, ROI_MIN_EDGE_STRENGTH), 255, cv2.THRESH_BINARY)
+    # Remove long straight edges (panel border, UI frames) so text lines don't get merged with them
+    frame_width, frame_height = (frame_length, frame_length) if frame_length else (width // 10, height // 10)
+    for kernel_size in ((max(3, frame_width), 1), (1, max(3, frame_height))):
+        straight_edges = cv2.morphologyEx(mask, cv2.MORPH_OPEN, cv2.getStructuringElement(cv2.MORPH_RECT, kernel_size))
+        mask = cv2.subtract(mask, straight_edges)
+    # Connect the glyphs of a word (small kernel, so text never gets glued to a frame next to it)
+    word_gap = word_gap or max(3, width // 160)
+    mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, cv2.getStructuringElement(cv2.MORPH_RECT, (word_gap, 1)))
+
+    words = []
+    # RETR_LIST: lines inside the popup are nested in the contour of the panel border
+    contours, _ = cv2.findContours(mask, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
+    for contour in contours:
+        x, y, w, h = cv2.boundingRect(contour)
+        if h < 4 or h > height * 0.1 or w < 0.3 * h:
+            continue  # too small, too high or not glyph shaped
+        if cv2.countNonZero(mask[y:y + h, x:x + w]) < 0.3 * w * h:
+            continue  # sparse edges (scenery) instead of glyphs
+        words.append((x, y, w, h))
+    return words
+
+def merge_words_to_lines(words):
+    """
+    Merges word boxes that sit on the same row and are close to each other into line boxes.
+
+    :param words: List of (x, y, w, h) word boxes.
+    :return: List of (x, y, w, h) line boxes.
+    """
+    lines = []
+    for x, y, w, h in sorted(words):
+        for i, (lx, ly, lw, lh) in enumerate(lines):
+            overlap = min(y + h, ly + lh) - max(y, ly)
+            if overlap > 0.5 * min(h, lh) and x - (lx + lw) < 3 * max(h, lh):
+                x0, y0 = min(x, lx), min(y, ly)
+                lines[i] = (x0, y0, max(x + w, lx + lw) - x0, max(y + h, ly + lh) - y0)
+                break
+        else:
+            lines.append((x, y, w, h))
+    return [line for line in lines if line[2] >= 2 * line[3]]
+
+def group_text_lines(lines):
+    """
+    Groups vertically stacked, left or center aligned text lines into blocks (the popup's "Name/Hash/Played Time" rows).
+
+    :param lines: List of (x, y, w, h) line boxes.
+    :return: The block with the most lines as list of line boxes (empty if there are less than 2 lines).
+    """
+    lines = sorted(lines, key=lambda line: line[1])
+    best_block = []
+    for i, first in enumerate(lines):
+        block = [first]
+        for line in lines[i + 1:]:
+            last = block[-1]
+            line_height = max(last[3], line[3])
+            if line[1] - (last[1] + last[3]) > 3 * line_height:
+                break  # too far below, the popup lines are close together
+            left_aligned = abs(line[0] - first[0]) <= 2 * line_height
+            centered = abs((line[0] + line[2] / 2) - (first[0] + first[2] / 2)) <= 2 * line_height
+            if (left_aligned or centered) and 0.5 < line[3] / first[3] < 2:
+                block.append(line)
+        if len(block) > len(best_block):
+            best_block = block
+    return best_block if len(best_block) >= 2 else []
+
+def locate_proof_popup(image_gray):
+    """
+    Locates the proof popup (its text rows) in a screenshot or phone photo.
+
+    :param image_gray: Grayscale OpenCV image.
+    :return: Tuple ((x, y, w, h), line_height) in full resolution coordinates or None if not found.
+    """
+    height, width = image_gray.shape[:2]
+    scale = min(1.0, ROI_DETECTION_WIDTH / width)
+    small = cv2.resize(image_gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA) if scale < 1 else image_gray
+
+    block = group_text_lines(find_text_lines(small))
+    if not block:
         return None
 
-async def check_image(image_url, display=False):
+    x0 = min(x for x, _, _, _ in block)
+    y0 = min(y for _, y, _, _ in block)
+    x1 = max(x + w for x, _, w, _ in block)
+    y1 = max(y + h for _, y, _, h in block)
+    line_height = float(np.median([h for _, _, _, h in block]))
+
+    # Pad by one line so that no glyph is cut and map back to full resolution
+    pad = line_height
+    x0, y0 = max(0, int((x0 - pad) / scale)), max(0, int((y0 - pad) / scale))
+    x1, y1 = min(width, int((x1 + pad) / scale)), min(height, int((y1 + pad) / scale))
+    return (x0, y0, x1 - x0, y1 - y0), line_height / scale
+
+def crop_to_popup(image_gray, target_line_height=ROI_LINE_HEIGHT, roi=None):
     """
-    Processes an image from a Discord CDN, extracts text using OCR, and verifies the hash.
+    Crops the image to the proof popup and normalises the text size. Returns the image unchanged if no popup was found.
 
-    :param image_url: The Discord CDN URL of the image.
-    :param display: Whether to display the processed image (default: False).
+    :param image_gray: Grayscale OpenCV image.
+    :param target_line_height: Line height (px) of the returned crop.
+    :param roi: Result of locate_proof_popup() if already known.
+    :return: Grayscale OpenCV image.
+    """
+    roi = roi or locate_proof_popup(image_gray)
+    if roi is None:
+        logger.debug("No popup found, running OCR on the whole image.")
+        return image_gray
+
+    (x, y, w, h), line_height = roi
+    crop = image_gray[y:y + h, x:x + w]
+    scale = target_line_height / line_height
+    interpolation = cv2.INTER_AREA if scale < 1 else cv2.INTER_CUBIC
+    logger.debug(f"Popup found at {(x, y, w, h)}, line height {line_height:.1f}px, scale {scale:.2f}")
+    return cv2.resize(crop, None, fx=scale, fy=scale, interpolation=interpolation)
+
+# --- END OF REGION OF INTEREST ---
+
+
+# DIGIT FIELDS FAST PATH
+
+# Only the values of the "Hash" and "Played Time" rows matter. They are recognised as digits (+ the X separator)
+# without the labels, which is faster and avoids letter/digit confusions (O/0, l/1, S/5, ...).
+DIGIT_WHITELIST = "0123456789X"
+DIGIT_WORD_GAP = 0.25  # max. gap inside a word relative to the line height
+
+def extract_value_fields(image_gray):
+    """
+    Cuts the right-most word (the value) out of every text row of the popup.
+
+    :param image_gray: Grayscale OpenCV image of the popup (light text on dark background).
+    :return: List of grayscale field images in row order (empty if less than 2 rows were found).
+    """
+    frame_length = 3 * ROI_LINE_HEIGHT  # the popup crop is normalised, glyph stems are much shorter than this
+    lines = sorted(find_text_lines(image_gray, frame_length=frame_length), key=lambda line: line[1])
+    if len(lines) < 2:
+        return []
+
+    line_height = float(np.median([h for _, _, _, h in lines]))
+    words = find_text_words(image_gray, word_gap=max(3, int(line_height * DIGIT_WORD_GAP)), frame_length=frame_length)
+    pad = max(2, int(line_height * 0.25))
+
+    fields = []
+    for lx, ly, lw, lh in lines:
+        row_words = [word for word in words if ly <= word[1] + word[3] / 2 <= ly + lh and word[0] >= lx - pad]
+        if not row_words:
+            continue
+        x, y, w, h = max(row_words, key=lambda word: word[0] + word[2])
+        fields.append(image_gray[max(0, y - pad):y + h + pad, max(0, x - pad):x + w + pad])
+    return fields
+
+def read_digit_fields(fields, invert=True):
+    """
+    Stacks the field images and recognises them in a single Tesseract call with the digit whitelist.
+
+    :param fields: Field images from extract_value_fields().
+    :param invert: Invert to dark text on light background before OCR (Tesseract's preferred polarity).
+    :return: List of recognised strings (one per recognised line, empty lines are dropped).
+    """
+    # One field per line, separated by empty background rows
+    pad = ROI_LINE_HEIGHT // 4
+    field_width = max(field.shape[1] for field in fields)
+    background = int(np.median(np.concatenate([field.ravel() for field in fields])))
+    stacked = []
+    for field in fields:
+        stacked.append(cv2.copyMakeBorder(field, 0, pad, 0, field_width - field.shape[1], cv2.BORDER_CONSTANT, value=background))
+    stacked = np.vstack(stacked)
+    text = run_ocr(cv2.bitwise_not(stacked) if invert else stacked, whitelist=DIGIT_WHITELIST)
+    logger.debug(f"Digit fields OCR Text: {text}")
+
+    return [line.replace(" ", "") for line in text.split("\n") if line.strip()]
+
+def match_proof_values(values):
+    """
+    Finds the hash value (`MapCodeXHash`) and the played time value (the next all-digit value after it).
+
+    :param values: Recognised field strings in row order (None for unreadable fields).
+    :return: Tuple (hash_index, played_time_index) or None.
+    """
+    for i, value in enumerate(values):
+        if value and re.fullmatch(r"\d+X\d+", value):
+            for j in range(i + 1, len(values)):
+                if values[j] and values[j].isdigit():
+                    return i, j
+            return None
+    return None
+
+def verify_proof_values(proof_string, playedtime_string):
+    """
+    Parses and verifies a hash/played time pair.
+
+    :return: The played time if the hash is valid, else None.
+    """
+    map_code, provided_hash, played_time = extract_mapcode_hash_playedtime(proof_string, playedtime_string)
+    if map_code is not None and played_time and verify_hash(map_code, played_time, provided_hash):
+        return played_time
+    return None
+
+# --- END OF DIGIT FIELDS FAST PATH ---
+
+
+# DIGIT TEMPLATE CLASSIFIER
+
+# The popup always uses the same Fortnite UI font, so its digits can be classified by comparing normalised glyph
+# crops with stored templates (one matrix product). Templates are learned from fields Tesseract read correctly
+# (the hash verified, so the labels are known to be right) and are shared by the workers through DIGIT_TEMPLATES_PATH.
+DIGIT_TEMPLATES_PATH = os.path.join(custom_tessdata_dir, "digit_templates.npz")
+DIGIT_TEMPLATES_PER_CHAR = 8  # max. stored templates per character
+DIGIT_GLYPH_SIZE = (20, 28)  # (width, height) of a normalised glyph
+DIGIT_MIN_SCORE = 0.85  # min. correlation of a glyph with its best template
+DIGIT_MIN_MARGIN = 0.05  # min. distance to the second best character
+
+class DigitTemplateClassifier:
+    """Template matching classifier for the digits (and the X separator) of the proof popup."""
+    def __init__(self, path=DIGIT_TEMPLATES_PATH):
+        self.path = path
+        self.templates = {}  # {char: [glyph vector, ...]}
+        self.mtime = None
+        self._chars = []
+        self._matrix = None  # all templates, grouped by char (rows)
+        self._offsets = None  # first row of every char in _matrix
+
+    def load(self):
+        """(Re)loads the templates if the file changed (another worker may have learned new ones)."""
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            return
+        if mtime == self.mtime:
+            return
+        with np.load(self.path) as data:
+            self.templates = {char: list(data[char]) for char in data.files}
+        self.mtime = mtime
+        self._build_matrix()
+
+    def save(self):
+        """Merges the templates with the ones on disk (other workers) and writes them atomically."""
+        try:
+            with np.load(self.path) as data:
+                for char in data.files:
+                    known = self.templates.setdefault(char, [])
+                    for vector in data[char]:
+                        if len(known) < DIGIT_TEMPLATES_PER_CHAR and not any(np.array_equal(vector, k) for k in known):
+                            known.append(vector)
+        except (OSError, ValueError):
+            pass
+        tmp_path = f"{self.path}.{os.getpid()}.tmp.npz"
+        np.savez(tmp_path, **{char: np.stack(vectors) for char, vectors in self.templates.items()})
+        os.replace(tmp_path, self.path)
+        self.mtime = os.path.getmtime(self.path)
+        self._build_matrix()
+
+    def _build_matrix(self):
+        self._chars = sorted(char for char in self.templates if self.templates[char])
+        if not self._chars:
+            self._matrix = None
+            return
+        rows, self._offsets = [], []
+        for char in self._chars:
+            self._offsets.append(len(rows))
+            rows.extend(self.templates[char])
+        self._matrix = np.stack(rows).astype(np.float32)
+        self._offsets = np.array(self._offsets)
+
+    @staticmethod
+    def segment(field):
+        """
+        Splits a field image into normalised glyph vectors.
+
+        :param field: Grayscale field image (light text on dark background).
+        :return: Matrix with one zero-mean, unit-length glyph vector per row (left to right), or None.
+        """
+        _, binary = cv2.threshold(field, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)
+        count, _, stats, _ = cv2.connectedComponentsWithStats(binary, connectivity=8)
+        if count < 2:
+            return None
+        glyph_height = stats[1:, cv2.CC_STAT_HEIGHT].max()
+        boxes = sorted((stat[cv2.CC_STAT_LEFT], stat[cv2.CC_STAT_TOP], stat[cv2.CC_STAT_WIDTH], stat[cv2.CC_STAT_HEIGHT])
+                       for stat in stats[1:] if stat[cv2.CC_STAT_HEIGHT] >= 0.6 * glyph_height)
+
+        width, height = DIGIT_GLYPH_SIZE
+        scale = height / glyph_height  # same scale for all glyphs so that e.g. a "1" stays narrow
+        vectors = []
+        for x, y, w, h in boxes:
+            glyph = cv2.resize(binary[y:y + h, x:x + w], (max(1, min(width, round(w * scale))), max(1, min(height, round(h * scale)))),
+                               interpolation=cv2.INTER_AREA)
+            canvas = np.zeros((height, width), np.float32)
+            top, left = (height - glyph.shape[0]) // 2, (width - glyph.shape[1]) // 2
+            canvas[top:top + glyph.shape[0], left:left + glyph.shape[1]] = glyph
+            vector = canvas.ravel() - canvas.mean()
+            norm = np.linalg.norm(vector)
+            vectors.append(vector / norm if norm else vector)
+        return np.stack(vectors)
+
+    def classify(self, field):
+        """
+        Classifies all glyphs of a field.
+
+        :param field: Grayscale field image (light text on dark background).
+        :return: Tuple (text, confidences) with one confidence per glyph, or None if there are no templates/glyphs.
+        """
+        if self._matrix is None:
+            return None
+        glyphs = self.segment(field)
+        if glyphs is None:
+            return None
+
+        scores = glyphs @ self._matrix.T  # correlation of every glyph with every template
+        char_scores = np.maximum.reduceat(scores, self._offsets, axis=1)  # best template per char
+        best = char_scores.argmax(axis=1)
+        best_scores = char_scores[np.arange(len(best)), best]
+        if char_scores.shape[1] > 1:
+            second_scores = np.partition(char_scores, -2, axis=1)[:, -2]
+        else:
+            second_scores = np.zeros_like(best_scores)
+        # Confidence: the best score, but zero if the second best char is too close
+        confidences = np.where(best_scores - second_scores >= DIGIT_MIN_MARGIN, best_scores, 0.0)
+        return "".join(self._chars[i] for i in best), confidences
+
+    def read(self, field):
+        """Returns the text of a field, or None if any glyph is below the confidence threshold."""
+        result = self.classify(field)
+        if result is None:
+            return None
+        text, confidences = result
+        logger.debug(f"Template classifier: {text} confidences: {np.round(confidences, 2).tolist()}")
+        return text if confidences.min() >= DIGIT_MIN_SCORE else None
+
+    def learn(self, field, text):
+        """
+        Stores the glyphs of a correctly read field as templates.
+
+        :return: True if new templates were added.
+        """
+        glyphs = self.segment(field)
+        if glyphs is None or len(glyphs) != len(text):
+            return False  # segmentation does not match the text (touching/broken glyphs), don't learn from it
+        added = False
+        for char, vector in zip(text, glyphs):
+            known = self.templates.setdefault(char, [])
+            if len(known) < DIGIT_TEMPLATES_PER_CHAR:
+                known.append(vector.astype(np.float32))
+                added = True
+        return added
+
+digit_classifier = DigitTemplateClassifier()
+
+# --- END OF DIGIT TEMPLATE CLASSIFIER ---
+
+
+# OCR CASCADE
+
+# Stages from cheap to expensive. A stage only runs if no earlier stage produced a verified hash.
+OCR_CASCADE = ("downscaled", "full", "adaptive", "otsu", "non-inverted")
+OCR_COARSE_LINE_HEIGHT = 20  # line height (px) of the downscaled popup crop
+OCR_COARSE_MAX_WIDTH = 1280  # max. width of the downscaled image if no popup was found
+
+def build_ocr_variants(image_gray, stages=OCR_CASCADE):
+    """
+    Lazily builds the preprocessed images of the cascade, so stages that are never reached cost nothing.
+
+    :param image_gray: Grayscale OpenCV image (light text on dark background).
+    :param stages: Names of the stages to run, in order (see OCR_CASCADE).
+    :return: Generator of (stage name, image, invert) tuples.
+    """
+    roi = locate_proof_popup(image_gray)
+    if roi is None:
+        logger.debug("No popup found, running OCR on the whole image.")
+    full = crop_to_popup(image_gray, roi=roi) if roi else image_gray
+
+    for stage in stages:
+        if stage == "downscaled":
+            if roi:
+                yield stage, crop_to_popup(image_gray, target_line_height=OCR_COARSE_LINE_HEIGHT, roi=roi), True
+            else:
+                scale = min(1.0, OCR_COARSE_MAX_WIDTH / image_gray.shape[1])
+                yield stage, cv2.resize(image_gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA), True
+        elif stage == "full":
+            yield stage, full, True
+        elif stage == "adaptive":
+            # Light text: pixels clearly above their neighbourhood mean become white
+            yield stage, cv2.adaptiveThreshold(full, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 31, -10), True
+        elif stage == "otsu":
+            yield stage, cv2.threshold(full, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)[1], True
+        elif stage == "non-inverted":
+            yield stage, full, False
+
+def recognise_variant(image, invert=True):
+    """
+    Recognises one preprocessed image: digit template classifier, then Tesseract on the digit fields,
+    then Tesseract on the full page. A later step only runs if the previous result does not verify.
+
+    :param image: Grayscale OpenCV image (light text on dark background).
+    :param invert: Invert the image for Tesseract.
+    :return: Tuple (result dictionary, name of the step that produced it).
+    """
+    fields = extract_value_fields(image)
+    if fields:
+        # ✅ Fastest: template classifier, no Tesseract at all
+        digit_classifier.load()
+        values = [digit_classifier.read(field) for field in fields]
+        match = match_proof_values(values)
+        if match and (played_time := verify_proof_values(values[match[0]], values[match[1]])):
+            return {"valid_hash": True, "played_time": played_time}, "digit templates"
+
+        # ✅ Fast: Tesseract on the digit fields only
+        values = read_digit_fields(fields, invert=invert)
+        match = match_proof_values(values)
+        if match and (played_time := verify_proof_values(values[match[0]], values[match[1]])):
+            # Verified, so the read is correct: learn the glyphs for the template classifier
+            # (only if no empty line was dropped, otherwise values and fields are not aligned)
+            if len(values) == len(fields) and any([digit_classifier.learn(fields[i], values[i]) for i in match]):
+                digit_classifier.save()
+            return {"valid_hash": True, "played_time": played_time}, "digit fields"
+
+    # ✅ Fallback: full page OCR
+    return recognise_full_page(cv2.bitwise_not(image) if invert else image), "full page"
+
+# --- END OF OCR CASCADE ---
+
+
+# LOAD-AWARE DEGRADATION
+
+# Under a burst (e.g. right after a giveaway announcement) the full cascade can't keep up. The degraded profile
+# only runs the single, cheap downscaled pass.
+OCR_PROFILES = {
+    "normal": OCR_CASCADE,
+    "degraded": ("downscaled",)
+}
+
+class OcrLoadGovernor:
+    """
+    Chooses the OCR profile from the backlog of the CpuIntensiveQueue. Switches to "degraded" when the queue depth or
+    the wait time of the oldest image passes its threshold and back to "normal" once both drained (hysteresis).
+    """
+    def __init__(self, queue_depth_threshold=OCR_DEGRADE_QUEUE_DEPTH, wait_threshold=OCR_DEGRADE_WAIT_SECONDS,
+                 recover_ratio=OCR_RECOVER_RATIO):
+        self.queue_depth_threshold = queue_depth_threshold
+        self.wait_threshold = wait_threshold
+        self.recover_ratio = recover_ratio
+        self.mode = "normal"
+        self.mode_since = time.time()
+        self.time_in_mode = {mode: 0.0 for mode in OCR_PROFILES}
+        self.switches = 0
+
+    def select(self, cpu_queue):
+        """
+        Returns the profile name for the next image.
+
+        :param cpu_queue: The CpuIntensiveQueue the image will be queued in.
+        """
+        load = cpu_queue.get_load()
+        overloaded = load["queue_depth"] >= self.queue_depth_threshold or load["oldest_wait"] >= self.wait_threshold
+        drained = (load["queue_depth"] <= self.queue_depth_threshold * self.recover_ratio
+                   and load["oldest_wait"] <= self.wait_threshold * self.recover_ratio)
+
+        if self.mode == "normal" and overloaded:
+            self._switch("degraded", load)
+        elif self.mode == "degraded" and drained:
+            self._switch("normal", load)
+        return self.mode
+
+    def _switch(self, mode, load):
+        now = time.time()
+        self.time_in_mode[self.mode] += now - self.mode_since
+        logger.warning(f"⚠️ OCR profile {self.mode} -> {mode} (queue depth: {load['queue_depth']}, oldest wait: {load['oldest_wait']:.1f}s)")
+        self.mode = mode
+        self.mode_since = now
+        self.switches += 1
+
+    def get_stats(self):
+        """Returns the active mode and the seconds spent in every mode."""
+        time_in_mode = dict(self.time_in_mode)
+        time_in_mode[self.mode] += time.time() - self.mode_since
+        return {
+            "mode": self.mode,
+            "switches": self.switches,
+            **{f"seconds_{mode}": round(seconds, 1) for mode, seconds in time_in_mode.items()}
+        }
+
+ocr_governor = OcrLoadGovernor()
+
+# --- END OF LOAD-AWARE DEGRADATION ---
+
+
+def check_image_bytes(image_bytes, stages=OCR_CASCADE):
+    """
+    Decodes the image, extracts text using OCR, and verifies the hash.
+    This is the CPU-heavy part of check_image() and is executed inside an OcrEngine worker process.
+    Runs the OCR cascade and stops as soon as a hash verifies.
+
+    :param image_bytes: The raw image bytes.
+    :param stages: Cascade stages to run (see OCR_CASCADE).
     :return: Dictionary with verification result (`valid_hash`, `played_time`).
     """
-    # ✅ Fetch the image from Discord CDN
-    image = await fetch_image_from_cdn(image_url)
-    if image is None:
+    # ✅ Reject decompression bombs before decoding (formats without a readable header are checked after decoding)
+    size = read_image_size(image_bytes)
+    if size and size[0] * size[1] > MAX_IMAGE_PIXELS:
+        logger.error(f"❌ Image too large: {size[0]}x{size[1]} pixels")
+        return {"error": "Image too large"}
+
+    # ✅ Decode straight to (reduced) grayscale, the cascade crops to the popup
+    image_gray = decode_image_gray(image_bytes, size)
+    if image_gray is None:
         return {"error": "Image could not be processed"}
+    if image_gray.size > MAX_IMAGE_PIXELS:
+        return {"error": "Image too large"}
 
-    # ✅ Convert to grayscale and invert colors for OCR
-    image_gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    image_inverted = cv2.bitwise_not(image_gray)
-
-    # ✅ Run OCR on the processed image
     start_time = time.time()
-    text = pytesseract.image_to_string(image_inverted, lang=model, config=custom_config)
-    end_time = time.time()
+    result = None
+    try:
+        for stage, image_variant, invert in build_ocr_variants(image_gray, stages):
+            stage_result, step = recognise_variant(image_variant, invert)
+            logger.debug(f"OCR cascade stage {stage} ({step}): {stage_result}")
+            if stage_result.get("valid_hash"):
+                logger.info(f"Hash Verification Result: True (stage: {stage}, {step})")
+                result = stage_result
+                break
+            # Keep the most informative failure: a parsed but invalid hash beats a format error
+            if result is None or ("error" in result and "error" not in stage_result):
+                result = stage_result
+    except Exception as e:
+        # Don't let the exception leave the worker process (some pytesseract errors can't be pickled back)
+        logger.error(f"❌ OCR failed: {e}")
+        return {"error": "OCR failed"}
+
+    logger.info(f"OCR Inference Time: {time.time() - start_time:.3f} seconds")
+    logger.info("----------")
+    return result or {"error": "Invalid format"}
 
+def recognise_full_page(image_inverted):
+    """
+    Recognises the whole (inverted) popup, parses the key-value rows and verifies the hash.
+
+    :param image_inverted: Grayscale OpenCV image with dark text on light background.
+    :return: Dictionary with verification result (`valid_hash`, `played_time`) or `error`.
+    """
+    text = run_ocr(image_inverted)
     logger.debug(f"OCR Extracted Text: {text}")
 
     # ✅ Extract key-value pairs from OCR text
@@ -108,22 +856,50 @@ async def check_image(image_url, display=False):
 
     # ✅ Verify hash
     valid_hash = verify_hash(map_code, played_time, provided_hash)
-
     logger.info(f"Hash Verification Result: {valid_hash}")
-    logger.info(f"OCR Inference Time: {end_time - start_time:.3f} seconds")
-    logger.info("----------")
-
-    if display:
-        #plt.imshow(image_inverted, cmap='gray')
-        #plt.axis('off')
-        #plt.show()
-        pass
 
     return {
         "valid_hash": valid_hash,
         "played_time": played_time
     }
 
+async def check_image(image_url, display=False, cpu_queue=None, image_bytes=None, user_id=None, replace=False):
+    """
+    Processes an image from a Discord CDN, extracts text using OCR, and verifies the hash.
+
+    :param image_url: The Discord CDN URL of the image.
+    :param display: Whether to display the processed image (default: False).
+    :param cpu_queue: CpuIntensiveQueue that runs the OCR (on the OcrEngine workers). Without it the OCR runs in a thread.
+    :param image_bytes: Already fetched image bytes. If given, the image is not fetched again.
+    :param user_id: Discord user ID of the sender (fair scheduling and rate limit in cpu_queue).
+    :param replace: Replace the user's proofs that are still queued in cpu_queue.
+    :return: Dictionary with verification result (`valid_hash`, `played_time`).
+    """
+    # ✅ Fetch the image from Discord CDN (I/O, stays on the event loop)
+    if image_bytes is None:
+        image_bytes = await fetch_image_bytes(image_url)
+    if image_bytes is None:
+        return {"error": "Image could not be processed"}
+
+    # ✅ Same screenshot sent again? Answer from the cache
+    cache_key = OcrResultCache.make_key(image_bytes, OCR_PIPELINE_VERSION)
+    cached_result = ocr_cache.get(cache_key)
+    if cached_result is not None:
+        logger.info(f"♻️ OCR cache hit: {cached_result}")
+        return cached_result
+
+    if cpu_queue is not None:
+        profile = ocr_governor.select(cpu_queue)
+        result = await cpu_queue.add_task(check_image_bytes, image_bytes, stages=OCR_PROFILES[profile], user_id=user_id, replace=replace)
+    else:
+        profile = "normal"
+        result = await asyncio.to_thread(check_image_bytes, image_bytes)
+
+    # A rejection from the degraded profile might pass the full cascade later, so only cache those in normal mode
+    if result.get("valid_hash") or (profile == "normal" and ("error" not in result or result["error"] in CACHEABLE_ERRORS)):
+        ocr_cache.put(cache_key, result)
+    return result
+
 def extract_ocr_data(text):
     """
     Parses the OCR text and extracts key-value pairs.
@@ -184,16 +960,28 @@ def verify_hash(map_code, play_time, provided_hash):
     :param provided_hash: The extracted hash value.
     :return: True if the hash is valid, False otherwise.
     """
-    calculated_hash = ((map_code * 134569 + play_time * 456781) + int(SECRET_TIMETRACKER_KEY)) % 3456789
-    return calculated_hash == provided_hash
+    return compute_proof_hash(map_code, play_time) == provided_hash
+
+def compute_proof_hash(map_code, play_time):
+    """
+    Computes the hash timeTracker.verse (ComputeProofHash) shows in the popup.
+
+    :param map_code: The map code (public key of the map).
+    :param play_time: The played time in minutes.
+    :return: The hash value.
+    """
+    return ((map_code * 134569 + play_time * 456781) + int(SECRET_TIMETRACKER_KEY)) % 3456789
 
 # ✅ TESTING
 if __name__ == "__main__":
-    test_image_url = "https://cdn.discordapp.com/attachments/1335408542479286384/1351319742912135188/Screenshot_2025-03-16_175343.png?ex=67d9f215&is=67d8a095&hm=2d33f0ffca72ef984d18e678545ea8f4df1806ac1a26704514de7f167556bbea&"  # Example CDN URL
+    # Offline test on a synthetic proof, see ocr_benchmark.py for the full benchmark
+    from proof_generator import generate_proof
+    import numpy as np
 
     async def run_test():
-        result = await check_image(test_image_url, display=False)
-        logger.info(f"Test Result: {result}")
+        image_bytes, truth = generate_proof(np.random.default_rng(), preset="phone-photo")
+        result = await check_image(None, display=False, image_bytes=image_bytes)
+        logger.info(f"Test Result: {result}, expected: {truth}")
 
     
     asyncio.run(run_test())
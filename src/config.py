@@ -19,6 +19,68 @@ ENVIRONMENT = os.getenv("ENVIRONMENT")
 DATABASE_URL = os.getenv("DATABASE_URL")
 SECRET_TIMETRACKER_KEY =  os.getenv("SECRET_TIMETRACKER_KEY")
 
+# HTTP
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", 20))  # max. open connections of the shared aiohttp session (per process)
+
+# OCR
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", os.cpu_count() or 1))  # number of OCR worker processes (each keeps the model loaded)
+OCR_CACHE_DIR = "cache/ocr"  # on-disk tier of the OCR result cache
+OCR_CACHE_MEMORY_SIZE = 1024  # results kept in the in-memory LRU tier
+OCR_CACHE_DISK_SIZE = 50000  # results kept on disk, the oldest are pruned
+OCR_DEGRADE_QUEUE_DEPTH = int(os.getenv("OCR_DEGRADE_QUEUE_DEPTH", 20))  # switch to the cheap OCR profile from this many queued images ...
+OCR_DEGRADE_WAIT_SECONDS = float(os.getenv("OCR_DEGRADE_WAIT_SECONDS", 15))  # ... or if the oldest image waits this long
+OCR_RECOVER_RATIO = 0.5  # switch back when depth and wait are below this fraction of the thresholds
+OCR_MIN_CONCURRENCY = int(os.getenv("OCR_MIN_CONCURRENCY", 1))  # bounds of the adaptive number of concurrent OCR jobs,
+OCR_MAX_CONCURRENCY = int(os.getenv("OCR_MAX_CONCURRENCY", OCR_WORKERS))  # the upper bound is also capped by OCR_WORKERS
+OCR_CPU_HIGH_PERCENT = 90  # above this CPU utilisation the OCR concurrency is not raised (and lowered if jobs get slower)
+OCR_MIN_FREE_MEMORY_MB = 300  # below this much available memory the OCR concurrency is lowered
+OCR_CONTROL_INTERVAL = 2.0  # seconds between two adjustments of the OCR concurrency
+
+# Image screening (before download / decode)
+MAX_IMAGE_BYTES = int(os.getenv("MAX_IMAGE_BYTES", 25 * 1024 * 1024))  # hard cap of a streamed download
+MAX_IMAGE_PIXELS = 50_000_000  # larger attachments are rejected without downloading them
+OCR_MAX_PIXELS = 3840 * 2160  # larger attachments are downscaled by Discord's media proxy before download
+DECODE_MIN_LONG_SIDE = 1920  # reduced decoding (1/2, 1/4, 1/8) keeps at least this many pixels on the long side
+
+
+# Queue admission control: capacity (0 = unbounded) and overflow policy ("reject", "shed-oldest" or "spill" to QUEUE_SPILL_DIR)
+RATE_LIMIT_QUEUE_CAPACITY = int(os.getenv("RATE_LIMIT_QUEUE_CAPACITY", 2000))
+RATE_LIMIT_QUEUE_OVERFLOW = "reject"  # bound discord.py methods can't be spilled to disk
+CPU_QUEUE_CAPACITY = int(os.getenv("CPU_QUEUE_CAPACITY", 200))
+CPU_QUEUE_OVERFLOW = os.getenv("CPU_QUEUE_OVERFLOW", "reject")
+DB_QUEUE_CAPACITY = int(os.getenv("DB_QUEUE_CAPACITY", 1000))
+DB_QUEUE_OVERFLOW = os.getenv("DB_QUEUE_OVERFLOW", "spill")  # never lose a DB write / upload, park it on disk instead
+QUEUE_SPILL_DIR = "cache/spill"  # overflowing items of the "spill" queues are parked here
+PG_FLUSH_INTERVAL = float(os.getenv("PG_FLUSH_INTERVAL", 0.5))  # write-behind: pending user rows are flushed after this many seconds ...
+PG_FLUSH_BATCH_SIZE = int(os.getenv("PG_FLUSH_BATCH_SIZE", 500))  # ... or as soon as this many users are pending
+PG_COPY_MIN_ROWS = 50  # flushes from this size use COPY into a staging table, smaller ones executemany()
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "json")  # local user store: "json" (one file per user in data/) or "sqlite" (one database in WAL mode)
+SQLITE_FILENAME = "users.sqlite3"  # inside data/ (restored from PostgreSQL like the JSON files)
+USER_STORE_FLUSH_INTERVAL = float(os.getenv("USER_STORE_FLUSH_INTERVAL", 0.5))  # dirty user records are written to data/ in batches this often
+USER_CHANGE_LOG = "changes.log"  # inside data/: append-only log of the written user files (JSON backend), the indexes of both processes follow it
+USER_CHANGE_LOG_MAX_BYTES = int(os.getenv("USER_CHANGE_LOG_MAX_BYTES", 8 * 1024 * 1024))  # the log starts over from this size (readers rescan once)
+LEADERBOARD_SYNC_INTERVAL = float(os.getenv("LEADERBOARD_SYNC_INTERVAL", 5))  # seconds between syncs of the leaderboard index with the other process's writes
+RESTORE_BATCH_SIZE = int(os.getenv("RESTORE_BATCH_SIZE", 500))  # users per fetch of the startup restore (server-side cursor)
+RESTORE_OVERLAP_SECONDS = 300  # the catch-up restore also re-reads rows this much older than the high-water mark (writes committed late)
+RESTORE_RETRY_DELAYS = (5, 30, 120)  # seconds before the retries of a failed startup restore (then the local snapshot is used as is)
+RESTORE_MARK_FILE = "restore_mark"  # inside data/: updated_at high-water mark up to which the local user store matches PostgreSQL
+AGGREGATES_CHECKPOINT = "cache/aggregates.json"  # running totals (minutes, proofs, invites)
+AGGREGATES_CHECKPOINT_INTERVAL = float(os.getenv("AGGREGATES_CHECKPOINT_INTERVAL", 60))  # seconds between syncs (the other process's writes) and checkpoints of the totals
+AGGREGATES_RECONCILE_INTERVAL = float(os.getenv("AGGREGATES_RECONCILE_INTERVAL", 3600))  # seconds between full recounts that correct them
+JOURNAL_DIR = "journal"  # write-ahead journal of pending DB writes and uploads
+JOURNAL_SEGMENT_BYTES = int(os.getenv("JOURNAL_SEGMENT_BYTES", 16 * 1024 * 1024))  # a new segment file is started from this size
+JOURNAL_COMMIT_DELAY = float(os.getenv("JOURNAL_COMMIT_DELAY", 0.002))  # seconds a commit waits for more records to fsync them together
+OCR_MAX_ETA_SECONDS = int(os.getenv("OCR_MAX_ETA_SECONDS", 600))  # proofs that would wait longer are refused
+USER_TASKS_PER_MINUTE = float(os.getenv("USER_TASKS_PER_MINUTE", 3))  # proofs per user and minute (token bucket) ...
+USER_TASK_BURST = int(os.getenv("USER_TASK_BURST", 5))  # ... with bursts of this many
+
+# Object storage uploads
+OBJECT_STORAGE_BACKEND = os.getenv("OBJECT_STORAGE_BACKEND", "replit")  # "replit" or "local" (LocalBucketClient, for offline runs/benchmarks)
+LOCAL_BUCKET_DIR = os.getenv("LOCAL_BUCKET_DIR", "cache/bucket")
+OBJECT_STORAGE_WORKERS = int(os.getenv("OBJECT_STORAGE_WORKERS", 8))  # concurrent uploads (the Replit client keeps max. 10 connections)
+UPLOAD_MAX_ATTEMPTS = int(os.getenv("UPLOAD_MAX_ATTEMPTS", 5))  # a failed upload is retried with exponential backoff ...
+UPLOAD_BACKOFF_BASE = 0.5  # ... sleeping a random time (full jitter) up to base * 2^attempt seconds ...
+UPLOAD_BACKOFF_MAX = 30.0  # ... but at most this long
 
 # links
 creativeMapPlayerTimeURL = "https://cdn.discordapp.com/attachments/894683986868203551/1351628595386253373/image.png?ex=67db11b9&is=67d9c039&hm=1c1ac8abb24c82cc25d109d1a7cc4f34947f2ef5fb29e7fd813a2933bddb0abb&"
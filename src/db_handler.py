@@ -2,6 +2,8 @@ import json
 import asyncpg
 import asyncio
 import os
+import time
+import fcntl
 import shutil
 import sys
 import requests
@@ -9,9 +11,17 @@ import logging
 import aiohttp
 import aiofiles
 from datetime import datetime
-from replit.object_storage import Client
-from config import OBJECT_STORAGE_BUCKET_ID, DATABASE_URL, LOGGING_LEVEL, DB_TABLE
+from urllib.parse import urlsplit
+from config import OBJECT_STORAGE_WORKERS, DATABASE_URL, LOGGING_LEVEL, DB_TABLE, MAX_IMAGE_BYTES, PG_COPY_MIN_ROWS
+from config import STORAGE_BACKEND, RESTORE_MARK_FILE, RESTORE_RETRY_DELAYS
 from queues import PGQueue, ObjectStorageQueue
+from journal import Journal
+from object_storage import create_bucket_client
+from user_store import create_user_store
+from leaderboard_index import LeaderboardIndex
+from aggregates import UserAggregates
+from restore import read_restore_mark, write_restore_mark, catch_up, delete_missing
+from http_client import get_http_session, read_capped
 
 
 # ✅ Setup logging configuration
@@ -28,12 +38,14 @@ logger = logging.getLogger(__name__)  # ✅ Use logger instead of print()
 logger.info(f"📁 Database URL: {DATABASE_URL}")
 
 db_pool = None
+pg_initialized = False  # init_pg() runs from on_ready(), which fires again after every gateway reconnect
 logger.info("✅✅✅✅✅   db_pool = None  ✅✅✅✅✅")
-bucketClient = Client(bucket_id=OBJECT_STORAGE_BUCKET_ID)
+bucketClient = create_bucket_client()  # Replit bucket (or LocalBucketClient with OBJECT_STORAGE_BACKEND=local)
 
-pg_queue = PGQueue(max_workers=1) 
-object_storage_queue = ObjectStorageQueue(max_workers=1) # increase max_workers to parallelize uploads
-logger.info("✅ Created PGQueue and ObjectStorageQueue successfully!")
+# User rows are written behind: collapsed per discord_id and flushed in batches (see PGQueue)
+# Both queues journal their pending work on disk first (see journal.py), it is replayed after a crash/redeploy
+pg_queue = PGQueue(max_workers=1, flush_func=lambda rows: save_user_rows_to_pg(rows), journal=Journal("postgres"))
+logger.info("✅ Created PGQueue successfully!")
 
 PG_SEMAPHORE = asyncio.Semaphore(10)  # Limit the number of concurrent database operations to 10
 OBJECT_STORAGE_SEMAPHORE = asyncio.Semaphore(10) # to prevent "Connection pool is full, discarding connection: storage.googleapis.com. Connection pool size: 10"
@@ -41,6 +53,14 @@ OBJECT_STORAGE_SEMAPHORE = asyncio.Semaphore(10) # to prevent "Connection pool i
 # Define storage location for user files
 DB_DIR = "data"
 os.makedirs(DB_DIR, exist_ok=True)  # Ensure directory exists
+user_store = create_user_store(DB_DIR)  # resident user entries, written to DB_DIR in batches (JSON files or SQLite, see STORAGE_BACKEND)
+leaderboard_index = LeaderboardIndex()  # users ordered by total chance, re-ranked on every change of an entry
+user_store.add_listener(leaderboard_index.update)
+aggregates = UserAggregates()  # running totals (minutes, proofs, invites), changed by the difference of every saved entry
+user_store.add_listener(aggregates.update)
+restore_done = asyncio.Event()  # set once the local user store caught up with PostgreSQL, or the restore gave up (see restore_filesystem_from_db)
+restore_failed = False  # the restore gave up: the local snapshot may miss users, ensure_users_loaded() keeps fetching them
+loaded_on_demand = set()  # users fetched by ensure_users_loaded() before the restore reached them
 
 # List of attributes each user entry should have
 attributes_list = [
@@ -59,14 +79,12 @@ attributes_list = [
 # ✅ File path helper
 def get_user_file(discord_id):
     """Returns the file path for the user's data."""
-    return os.path.join(DB_DIR, f"{discord_id}.json")
+    return user_store.path(discord_id)
 
-# ✅ Initialize user file if missing
+# ✅ Initialize user entry if missing
 def initialize_key(discord_id):
     """Initializes a user entry with empty attributes if not already created."""
-    file_path = get_user_file(discord_id)
-
-    if not os.path.exists(file_path):
+    if not user_store.exists(discord_id):
         user_data = {attr: None for attr in attributes_list}
         user_data["discord_id"] = str(discord_id)
         user_data["images"] = []  # Initialize empty images list
@@ -74,85 +92,82 @@ def initialize_key(discord_id):
         user_data["played_minutes"] = 0
         user_data["invite"] = {"used_code": None, "inviter_id": None, "invited_users": [], "total_invites": 0}
         user_data["creator_code"] = 0
-        with open(file_path, "w", encoding="utf-8") as file:
-            json.dump(user_data, file, indent=4)
+        user_store.put(discord_id, user_data)
 
 # ✅ Load user data/user entry
 def load_user_data(discord_id):
-    """Loads a user's data from their JSON file."""
-    file_path = get_user_file(discord_id)
-
-    if os.path.exists(file_path):
-        with open(file_path, "r", encoding="utf-8") as file:
-            return json.load(file)
-    return None  # User file does not exist
+    """
+    Returns a user's data from the user store (read from their JSON file only if it's not resident or changed on disk).
+    The returned dict is a copy: changes only reach the store when it is passed to save_user_data().
+    """
+    return user_store.get(discord_id)  # None if the user does not exist
 
 async def download_image(media_url, image_name):
     """Downloads an image asynchronously and saves it locally."""
     try:
-        file_path = os.path.join(DB_DIR, image_name)
+        async with get_http_session().get(media_url) as response:
+            response.raise_for_status()
+            image_bytes = await read_capped(response, MAX_IMAGE_BYTES)
+    except Exception as e:
+        logger.info(f"❌ Failed to download image: {e}")
+        return None
+
+    return await save_image(image_bytes, image_name)
 
-        async with aiohttp.ClientSession() as session:
-            async with session.get(media_url) as response:
-                response.raise_for_status()
 
-                async with aiofiles.open(file_path, "wb") as image_file:
-                    await image_file.write(await response.read())
+async def save_image(image_bytes, image_name):
+    """Saves already fetched image bytes locally and queues the upload of the same buffer to object storage."""
+    try:
+        file_path = os.path.join(DB_DIR, image_name)
 
-        # ✅ Queue upload instead of blocking
-        asyncio.create_task(object_storage_queue.add_task(async_upload_to_object_storage, file_path, image_name))
+        async with aiofiles.open(file_path, "wb") as image_file:
+            await image_file.write(image_bytes)
+
+        # ✅ Queue upload instead of blocking (returns once the image is journaled, the upload runs in the background)
+        await object_storage_queue.add_upload(image_name, image_bytes)
 
         logger.info(f"✅ Image {image_name} saved locally and queued for object storage upload.")
         return file_path
     except Exception as e:
-        logger.info(f"❌ Failed to download image: {e}")
+        logger.info(f"❌ Failed to save image: {e}")
         return None
 
 
 
-
-async def async_upload_to_object_storage(file_path, medium_name):
-    """Asynchronously uploads a file to Replit Object Storage."""
+async def async_upload_to_object_storage(image_bytes, medium_name):
+    """Asynchronously uploads an in-memory file to Replit Object Storage. Raises on failure (the upload stays journaled)."""
     async with OBJECT_STORAGE_SEMAPHORE:
         try:
-            await asyncio.to_thread(bucketClient.upload_from_filename, medium_name, file_path)
+            await asyncio.to_thread(bucketClient.upload_from_bytes, medium_name, image_bytes)
             logger.info(f"✅ Asynchronously uploaded {medium_name} to object storage.")
         except Exception as e:
             logger.info(f"❌ Failed to upload {medium_name} to object storage: {e}")
+            raise  # ObjectStorageQueue retries it
+
+object_storage_queue = ObjectStorageQueue(max_workers=OBJECT_STORAGE_WORKERS, upload_func=async_upload_to_object_storage, journal=Journal("object_storage"))
+logger.info("✅ Created ObjectStorageQueue successfully!")
 
 
 def get_leaderboard_top_users(limit=99):
     """
-    Returns top users from the local filesystem database, sorted by total_chance.
+    Returns the top users of the leaderboard index, sorted by total_chance (1 + played/60 + invites + creator_code).
+    """
+    return [dict(entry) for entry in leaderboard_index.top(limit)]
+
+
+def get_user_rank(discord_id):
     """
-    leaderboard = []
-
-    for filename in os.listdir(DB_DIR):
-        if filename.endswith(".json"):
-            filepath = os.path.join(DB_DIR, filename)
-            with open(filepath, "r", encoding="utf-8") as file:
-                user_data = json.load(file)
-
-                discord_name = user_data.get("discord_name")
-                played_minutes = user_data.get("played_minutes")
-                invites = user_data.get("invite", {}).get("total_invites")
-                creator_code = user_data.get("creator_code")
-                # Berechnung der total_chance (1 + played/60 + invites + creator_code)
-                total_chance = round(1 + (played_minutes / 60) + invites + creator_code, 2)
-                if discord_name is not None:
-                    leaderboard.append({
-                        "discord_id": user_data.get("discord_id"),
-                        "name": discord_name,
-                        "total_chance": total_chance,
-                        "played_minutes": played_minutes,
-                        "invites": invites,
-                        "creator_code": creator_code
-                    })
-     
-    # Sortiere nach total_chance absteigend
-    leaderboard.sort(key=lambda u: u["total_chance"], reverse=True)
-
-    return leaderboard[:limit]
+    Returns (rank, leaderboard entry) of a user, or None if the user is not on the leaderboard.
+    """
+    ranked = leaderboard_index.rank(discord_id)
+    if ranked is None:
+        return None
+    return ranked[0], dict(ranked[1])
+
+
+def get_total_played_minutes():
+    """Returns the sum of the played minutes of all users (running total, see UserAggregates)."""
+    return aggregates.get_totals()["played_minutes"]
 
 
 # END OF GET
@@ -164,32 +179,25 @@ def get_leaderboard_top_users(limit=99):
 # POST
 
 # ✅ Save user data
-def save_user_data(discord_id, data, only_local=False, loop=None):
-    """Saves user data to their individual JSON file and updates PostgreSQL asynchronously."""
-    file_path = get_user_file(discord_id)
-
-    with open(file_path, "w", encoding="utf-8") as file:
-        json.dump(data, file, indent=4)
-
-    if not only_local:
-        #✅ Add database save to queue instead of direct call
-        if loop:
-            loop.create_task(pg_queue.add_task(save_user_data_to_pg, discord_id, data=data))
-            logger.debug(f"✅ /notify save_user_data_to_pg() scheduled in bot loop for {discord_id} for ")
-        else:
-            try:
-                running_loop = asyncio.get_running_loop()
-                running_loop.create_task(pg_queue.add_task(save_user_data_to_pg, discord_id, data=data))
-            except RuntimeError:
-                asyncio.run(pg_queue.add_task(save_user_data_to_pg, discord_id, data=data))  # Blocking fallback
+async def save_user_data(discord_id, data):
+    """
+    Saves user data to the user store (its JSON file is written by the next batch) and updates PostgreSQL asynchronously.
+    Returns once the PostgreSQL write is journaled (it survives a crash), raises if it can't be (e.g. QueueClosed on
+    shutdown, or the journal's write error). Entries restored from PostgreSQL go to user_store.put() directly.
+    """
+    user_store.put(discord_id, data)
 
-        logger.debug(f"✅ save_user_data_to_pg() queued for {discord_id}")
+    #✅ Add database save to queue instead of direct call
+    # Snapshot the row now (the caller may keep changing `data`), the write-behind buffer keeps the latest per user
+    row = user_data_to_row(discord_id, data)
+    await pg_queue.add_write(row[0], row)
+    logger.debug(f"✅ PG write journaled and buffered for {discord_id}")
 
 
 
 
 # ✅ Save DM link
-def save_dm_link_to_database(discord_id, discord_name, dm_link):
+async def save_dm_link_to_database(discord_id, discord_name, dm_link):
     """Saves the dm link for a user."""
     initialize_key(discord_id)  # Ensure user file exists
     user_data = load_user_data(discord_id)  # Load current data
@@ -197,19 +205,26 @@ def save_dm_link_to_database(discord_id, discord_name, dm_link):
     user_data["discord_name"] = str(discord_name)
     user_data["dm_link"] = dm_link 
 
-    save_user_data(discord_id, user_data)  # Save back to file
+    await save_user_data(discord_id, user_data)  # Save back to file
     logger.info(f"✅ Saved dml link for user {discord_id}")
 
 
 # ✅ Save Image Proof
-async def save_image_proof_decision(discord_id, image_url, decision):
-    """Saves the image data for a user."""
+async def save_image_proof_decision(discord_id, image_url, decision, image_bytes=None):
+    """
+    Saves the image data for a user. Pass `image_bytes` if the image was already fetched (e.g. for OCR), they must be
+    the original attachment `image_url` serves (not a copy downscaled by the media proxy).
+    """
     initialize_key(discord_id)  # Ensure user file exists
     user_data = load_user_data(discord_id)  # Load current data
 
-    # Download image from Discord's CDN
-    image_name = f"{discord_id}_{len(user_data['images']) + 1}.png"
-    downloaded_image_path = await download_image(image_url, image_name)
+    # Reuse the already fetched image, download it from Discord's CDN only if necessary
+    extension = os.path.splitext(urlsplit(image_url).path)[1].lower() or ".png"  # the attachment's own format
+    image_name = f"{discord_id}_{len(user_data['images']) + 1}{extension}"
+    if image_bytes is not None:
+        downloaded_image_path = await save_image(image_bytes, image_name)
+    else:
+        downloaded_image_path = await download_image(image_url, image_name)
 
     # Add image data to the user's images list
     user_data["images"].append({
@@ -230,18 +245,18 @@ async def save_image_proof_decision(discord_id, image_url, decision):
         
         user_data["step_state"] = "image_proof"
     
-    save_user_data(discord_id, user_data)  # Save back to file
+    await save_user_data(discord_id, user_data)  # Save back to file
     logger.info(f"✅ Saved image proof for user {discord_id}")
 
 
-def save_invite_join_to_database(member, used_invite):
+async def save_invite_join_to_database(member, used_invite):
     inviter = used_invite.inviter
     initialize_key(inviter.id)
     inviter_data = load_user_data(inviter.id)
 
     inviter_data["invite"]["invited_users"].append(str(member.id))
     inviter_data["invite"]["total_invites"] += 1
-    save_user_data(inviter.id, inviter_data)
+    await save_user_data(inviter.id, inviter_data)
 
     # new member joined to discord server
     initialize_key(member.id)
@@ -249,19 +264,19 @@ def save_invite_join_to_database(member, used_invite):
     
     new_user_data["invite"]["used_code"] = used_invite.code
     new_user_data["invite"]["inviter_id"] = str(inviter.id)
-    save_user_data(member.id, new_user_data)
+    await save_user_data(member.id, new_user_data)
 
     return inviter_data["invite"]["total_invites"]
 
 
 
-def save_invite_remove_to_database(left_member, inviter_id):
+async def save_invite_remove_to_database(left_member, inviter_id):
     initialize_key(left_member.id)
     left_member_data = load_user_data(left_member.id)
 
     left_member_data["invite"]["used_code"] = None
     left_member_data["invite"]["inviter_id"] = None
-    save_user_data(left_member.id, left_member_data)
+    await save_user_data(left_member.id, left_member_data)
     
     inviter_data = load_user_data(inviter_id)
     if inviter_data:
@@ -269,7 +284,7 @@ def save_invite_remove_to_database(left_member, inviter_id):
         if str(left_member.id) in invited_users:
             invited_users.remove(str(left_member.id))
             inviter_data["invite"]["total_invites"] -= 1
-            save_user_data(inviter_id, inviter_data)
+            await save_user_data(inviter_id, inviter_data)
             
         return inviter_data["invite"]["total_invites"]
 
@@ -277,19 +292,15 @@ def save_invite_remove_to_database(left_member, inviter_id):
 def restore_invite_user_map():
     restored_map = {}
 
-    for filename in os.listdir(DB_DIR):
-        if filename.endswith(".json"):
-            filepath = os.path.join(DB_DIR, filename)
-            with open(filepath, "r", encoding="utf-8") as file:
-                user_data = json.load(file)
-                discord_id = int(user_data["discord_id"])
-                invite_info = user_data.get("invite", {})
+    for user_data in user_store.invited_users():
+        discord_id = int(user_data["discord_id"])
+        invite_info = user_data.get("invite", {})
 
-                used_code = invite_info.get("used_code")
-                inviter_id = invite_info.get("inviter_id")
+        used_code = invite_info.get("used_code")
+        inviter_id = invite_info.get("inviter_id")
 
-                if used_code and inviter_id:
-                    restored_map[discord_id] = (used_code, int(inviter_id))
+        if used_code and inviter_id:
+            restored_map[discord_id] = (used_code, int(inviter_id))
 
     return restored_map
     
@@ -302,22 +313,46 @@ def restore_invite_user_map():
 # POSTGRESQL
  
 async def init_pg():
-    """Initializes PostgreSQL: Creates connection pool, ensures table, and restores filesystem."""
-    asyncio.create_task(pg_queue.start_workers())
+    """
+    Initializes PostgreSQL: Creates connection pool, ensures table, and starts the restore of the local user store.
+    Returns before the restore is done, users it didn't reach yet are fetched on demand (ensure_users_loaded()).
+    The local parts (queues, user store, leaderboard index, aggregates) start even if PostgreSQL can't be reached,
+    the PostgreSQL part is tried again on the next call (on_ready() after a reconnect).
+    """
+    global db_pool, pg_initialized
+    if pg_initialized:
+        logger.info("🔁 PostgreSQL already initialized (reconnect), nothing to do")
+        return
+    pg_initialized = True  # a concurrent on_ready() doesn't start a second initialization
+    asyncio.create_task(pg_queue.start_workers())  # (the queues and the local store only start once)
     asyncio.create_task(object_storage_queue.start_workers())  # Start object storage workers
+    user_store.start()  # from now on user files are written in batches
     logger.info("✅ Started workers for PGQueue and ObjectStorageQueue successfully!")
-    
-    global db_pool
+    leaderboard_index.start(user_store)  # Rank the users of the local snapshot once, afterwards changes are applied (the other process's in the background)
+    aggregates.start(user_store)  # Totals from the checkpoint (or a full count), checkpointed and reconciled in the background
+
     logger.info(f"🔄 Initializing PostgreSQL with DATABSE_URL: {DATABASE_URL}")
     try:
-        db_pool = await asyncpg.create_pool(DATABASE_URL, min_size=1, max_size=5)  # Limit connections
-        logger.info("✅ PostgreSQL initialized successfully!")
+        if db_pool is None:
+            db_pool = await asyncpg.create_pool(DATABASE_URL, min_size=1, max_size=5)  # Limit connections
+        await create_table()  # Ensure DB structure
     except Exception as e:
-        logger.info(f"❌ Failed to initialize PostgreSQL: {e}")
-    await create_table()  # Ensure DB structure
-    await restore_filesystem_from_db()  # Restore filesystem from DB
+        pg_initialized = False
+        logger.error(f"❌ Failed to initialize PostgreSQL, trying again on the next reconnect: {e}")
+        return
+    asyncio.create_task(restore_filesystem_from_db())  # Catch up with PostgreSQL in the background
     logger.info("✅ PostgreSQL initialized successfully.")
 
+async def shutdown_db_queues(timeout=30):
+    """Lets the pending uploads and PostgreSQL writes finish on shutdown (what doesn't finish stays journaled)."""
+    await user_store.close()
+    leaderboard_index.close()
+    await aggregates.close()
+    await asyncio.gather(pg_queue.drain(timeout), object_storage_queue.drain(timeout))
+    if db_pool is not None:
+        await db_pool.close()
+    logger.info("✅ PostgreSQL and object storage queues shut down.")
+
 async def create_table():
     """Ensures that the {DB_TABLE} table exists."""
     async with db_pool.acquire() as conn:
@@ -330,37 +365,96 @@ async def create_table():
                 step_state TEXT,
                 played_minutes INTEGER DEFAULT 0,
                 invite JSONB,
-                creator_code INTEGER DEFAULT 0
+                creator_code INTEGER DEFAULT 0,
+                updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
             )
         """)
+        # Tables created before the incremental restore don't have updated_at yet
+        await conn.execute(f"ALTER TABLE {DB_TABLE} ADD COLUMN IF NOT EXISTS updated_at TIMESTAMPTZ NOT NULL DEFAULT now()")
+        await conn.execute(f"CREATE INDEX IF NOT EXISTS {DB_TABLE}_updated_at ON {DB_TABLE} (updated_at)")
     logger.info("✅ Database table ensured.")
 
+def row_to_user_data(row):
+    """Converts a {DB_TABLE} row into a user entry."""
+    return {
+        "discord_id": row["discord_id"],
+        "discord_name": row["discord_name"],
+        "dm_link": row["dm_link"],
+        "images": json.loads(row["images"]),
+        "step_state": row["step_state"],
+        "played_minutes": row["played_minutes"],
+        "invite": json.loads(row["invite"]),
+        "creator_code": row["creator_code"]
+    }
+
 async def restore_filesystem_from_db():
-    """Restores the local filesystem from PostgreSQL on bot startup, including pending images."""
-    async with db_pool.acquire() as conn:
-        rows = await conn.fetch(f"SELECT * FROM {DB_TABLE}")
+    """
+    Brings the local user store (the snapshot in DB_DIR that survives restarts) up to date with PostgreSQL.
+
+    Only the rows changed since the high-water mark of the last restore are read (all rows the first time, see
+    restore.catch_up()), users deleted in PostgreSQL are deleted locally (restore.delete_missing()). The bot processes take turns (file lock): the first one restores, the second one only catches
+    up with what changed meanwhile. Users with local changes PostgreSQL doesn't have yet (pending writes, fetched on
+    demand) are kept. A failed attempt is retried after each of RESTORE_RETRY_DELAYS; if all fail the bot goes on with
+    the local snapshot (users missing in it are still fetched on demand). restore_done is set either way.
+    """
+    global restore_failed
+    mark_path = os.path.join(DB_DIR, RESTORE_MARK_FILE)
 
-        for row in rows:
-            user_data = {
-                "discord_id": row["discord_id"],
-                "discord_name": row["discord_name"],
-                "dm_link": row["dm_link"],
-                "images": json.loads(row["images"]),
-                "step_state": row["step_state"],
-                "played_minutes": row["played_minutes"],
-                "invite": json.loads(row["invite"]),
-                "creator_code": row["creator_code"]
-            }
+    def keep_local(discord_id):
+        return discord_id in loaded_on_demand or discord_id in user_store.dirty or pg_queue.is_pending(discord_id)
 
-            # ✅ Save user data in the filesystem
-            save_user_data(user_data["discord_id"], user_data, only_local=True)
-            logger.info(f"✅ Restored user {row['discord_id']} from PostgreSQL to filesystem")
+    def save(discord_id, row):
+        user_store.put(discord_id, row_to_user_data(row))
 
+    try:
+        for attempt, delay in enumerate((*RESTORE_RETRY_DELAYS, None), start=1):
+            lock_fd = os.open(f"{mark_path}.lock", os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                await asyncio.to_thread(fcntl.flock, lock_fd, fcntl.LOCK_EX)
+                start_time = time.monotonic()
+                local_ids = set(await asyncio.to_thread(user_store.stored_versions)) | set(user_store.records)
+                async with db_pool.acquire() as conn:
+                    high_water, restored, skipped = await catch_up(conn, DB_TABLE, read_restore_mark(mark_path, DB_TABLE, STORAGE_BACKEND), keep_local, save)
+                    await delete_missing(conn, DB_TABLE, local_ids, keep_local, user_store.delete)
+                await user_store.flush()  # the snapshot has to be on disk before the mark
+                write_restore_mark(mark_path, DB_TABLE, STORAGE_BACKEND, high_water)
+            except Exception as e:
+                if delay is None:
+                    restore_failed = True
+                    logger.error(f"❌ Restore from PostgreSQL failed {attempt} times, going on with the local snapshot (missing users are fetched on demand): {e}")
+                    return
+                logger.error(f"❌ Restore from PostgreSQL failed (attempt {attempt}), retrying in {delay}s: {e}")
+            else:
+                loaded_on_demand.clear()
+                logger.info(f"✅ Restored {restored} users from PostgreSQL in {time.monotonic() - start_time:.1f}s ({skipped} with newer local data kept)")
+                return
+            finally:
+                os.close(lock_fd)
+            await asyncio.sleep(delay)
+    finally:
+        restore_done.set()
 
+async def ensure_users_loaded(*discord_ids):
+    """
+    Fetches users from PostgreSQL the startup restore didn't reach yet (does nothing once the restore is done, unless it
+    failed). A user in the local snapshot is fetched too, the snapshot may be older than PostgreSQL; only local changes
+    PostgreSQL doesn't have yet are kept. A user PostgreSQL doesn't have anymore is deleted locally.
+    """
+    if (restore_done.is_set() and not restore_failed) or db_pool is None:
+        return
+    for discord_id in discord_ids:
+        if discord_id is None or str(discord_id) in loaded_on_demand:
+            continue
+        key = str(discord_id)
+        loaded_on_demand.add(key)  # the restore skips it from now on
+        if key in user_store.dirty or pg_queue.is_pending(key):
+            continue
+        if await restore_user_from_db(discord_id) is None and user_store.exists(key):
+            user_store.delete(key)
 
 async def restore_user_from_db(discord_id: int):
     """Fetches and restores a specific user's data from PostgreSQL to the local cache."""
-    # This function is called by the discord slash command /restore_user
+    # This function is called by the discord slash command /restore_user and by ensure_users_loaded()
     async with db_pool.acquire() as conn:
         row = await conn.fetchrow(f"SELECT * FROM {DB_TABLE} WHERE discord_id = $1", str(discord_id))
 
@@ -368,57 +462,56 @@ async def restore_user_from_db(discord_id: int):
             logger.warning(f"❌ No data found for user {discord_id}.")
             return None  # Return None if user is not found
 
-        user_data = {
-            "discord_id": row["discord_id"],
-            "discord_name": row["discord_name"],
-            "dm_link": row["dm_link"],
-            "images": json.loads(row["images"]),
-            "step_state": row["step_state"],
-            "played_minutes": row["played_minutes"],
-            "invite": json.loads(row["invite"]),
-            "creator_code": row["creator_code"]
-        }
+        user_data = row_to_user_data(row)
 
         # ✅ Save user data in the filesystem
-        save_user_data(user_data["discord_id"], user_data, only_local=True)
+        user_store.put(user_data["discord_id"], user_data)
 
         logger.info(f"✅ Restored user {row['discord_id']} from PostgreSQL to filesystem")
         return user_data  # Return data if successful
 
 
 
-async def save_user_data_to_pg(discord_id, data):
-    """Saves user data asynchronously in PostgreSQL."""
-    logger.debug(f" db_pool check: {db_pool}")
-    try:
-        async with PG_SEMAPHORE:
-            async with db_pool.acquire() as conn:
-                await conn.execute(f"""
-                    INSERT INTO {DB_TABLE} (discord_id, discord_name, dm_link, images, step_state, played_minutes, invite, creator_code)
-                    VALUES ($1, $2, $3, $4, $5, $6, $7, $8)
-                    ON CONFLICT (discord_id) DO UPDATE SET
-                        discord_name = EXCLUDED.discord_name,
-                        dm_link = EXCLUDED.dm_link,
-                        images = EXCLUDED.images,
-                        step_state = EXCLUDED.step_state,
-                        played_minutes = EXCLUDED.played_minutes,
-                        invite = EXCLUDED.invite,
-                        creator_code = EXCLUDED.creator_code
-                """, 
-                    str(discord_id),
-                    data["discord_name"],
-                    data["dm_link"],
-                    json.dumps(data["images"]),
-                    data["step_state"],
-                    data.get("played_minutes", 0),
-                    json.dumps(data["invite"]),
-                    data.get("creator_code", 0),
-                )
-    
-                logger.debug(f"save_user_data_to_pg() executed for user {discord_id}")
+USER_COLUMNS = ["discord_id", "discord_name", "dm_link", "images", "step_state", "played_minutes", "invite", "creator_code"]
 
-    except Exception as e:
-        logger.info(f"❌ Error while saving data for user {discord_id}: {e}")
+def user_data_to_row(discord_id, data):
+    """Converts user data into a row tuple in the order of USER_COLUMNS (JSON columns serialized)."""
+    return (
+        str(discord_id),
+        data["discord_name"],
+        data["dm_link"],
+        json.dumps(data["images"]),
+        data["step_state"],
+        data.get("played_minutes", 0),
+        json.dumps(data["invite"]),
+        data.get("creator_code", 0),
+    )
+
+async def save_user_rows_to_pg(rows):
+    """
+    Upserts a batch of user rows (see user_data_to_row) in one transaction.
+    Small batches use executemany(), larger ones COPY into a temporary staging table and one INSERT ... ON CONFLICT.
+    Exceptions are raised, so the write-behind buffer of PGQueue can retry.
+    """
+    upsert_columns = ", ".join(f"{column} = EXCLUDED.{column}" for column in USER_COLUMNS[1:]) + ", updated_at = now()"
+    async with PG_SEMAPHORE:
+        async with db_pool.acquire() as conn:
+            async with conn.transaction():
+                if len(rows) < PG_COPY_MIN_ROWS:
+                    await conn.executemany(f"""
+                        INSERT INTO {DB_TABLE} ({", ".join(USER_COLUMNS)})
+                        VALUES ($1, $2, $3, $4, $5, $6, $7, $8)
+                        ON CONFLICT (discord_id) DO UPDATE SET {upsert_columns}
+                    """, rows)
+                else:
+                    await conn.execute(f"CREATE TEMP TABLE users_staging (LIKE {DB_TABLE} INCLUDING DEFAULTS) ON COMMIT DROP")
+                    await conn.copy_records_to_table("users_staging", records=rows, columns=USER_COLUMNS)
+                    await conn.execute(f"""
+                        INSERT INTO {DB_TABLE} ({", ".join(USER_COLUMNS)})
+                        SELECT {", ".join(USER_COLUMNS)} FROM users_staging
+                        ON CONFLICT (discord_id) DO UPDATE SET {upsert_columns}
+                    """)
+    logger.debug(f"save_user_rows_to_pg() wrote {len(rows)} rows")
 
 
 async def delete_users_table():
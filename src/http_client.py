@@ -0,0 +1,57 @@
+import sys
+import logging
+import aiohttp
+from config import LOGGING_LEVEL, HTTP_POOL_SIZE
+
+
+# ✅ Setup logging configuration
+logging.basicConfig(
+    level=LOGGING_LEVEL,  # Capture ALL logs (INFO, DEBUG, ERROR)
+    format="%(asctime)s [%(levelname)s] %(message)s",
+    handlers=[
+        logging.StreamHandler(sys.stdout)  # Ensure logs are printed to Replit console
+    ]
+)
+logger = logging.getLogger(__name__)  # ✅ Use logger instead of print()
+
+
+# One pooled aiohttp session per bot process. Every module (OCR fetch, image persistence, ...) uses it, so
+# connections to the Discord CDN are kept alive and reused instead of paying a TLS handshake per request.
+_session = None
+
+def get_http_session():
+    """Returns the process wide aiohttp session (created lazily inside the running event loop)."""
+    global _session
+    if _session is None or _session.closed:
+        connector = aiohttp.TCPConnector(limit=HTTP_POOL_SIZE, ttl_dns_cache=300, keepalive_timeout=60)
+        _session = aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=30))
+        logger.info(f"✅ Created pooled HTTP session (pool size: {HTTP_POOL_SIZE})")
+    return _session
+
+class ResponseTooLarge(Exception):
+    """Raised by read_capped() when a response body exceeds the allowed size."""
+
+async def read_capped(response, max_bytes):
+    """
+    Streams a response body and aborts as soon as it exceeds `max_bytes` (checks Content-Length first).
+
+    :param response: aiohttp response.
+    :param max_bytes: Hard cap of the body size.
+    :return: The body bytes.
+    """
+    if response.content_length is not None and response.content_length > max_bytes:
+        raise ResponseTooLarge(f"{response.content_length} bytes announced (max. {max_bytes})")
+
+    body = bytearray()
+    async for chunk in response.content.iter_chunked(64 * 1024):
+        body += chunk
+        if len(body) > max_bytes:
+            raise ResponseTooLarge(f"download aborted after {len(body)} bytes (max. {max_bytes})")
+    return bytes(body)
+
+async def close_http_session():
+    """Closes the process wide aiohttp session."""
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
@@ -0,0 +1,279 @@
+import os
+import sys
+import time
+import fcntl
+import struct
+import zlib
+import pickle
+import bisect
+import asyncio
+import logging
+from collections import deque
+from config import LOGGING_LEVEL, JOURNAL_DIR, JOURNAL_SEGMENT_BYTES, JOURNAL_COMMIT_DELAY
+
+
+# ✅ Setup logging configuration
+logging.basicConfig(
+    level=LOGGING_LEVEL,  # Capture ALL logs (INFO, DEBUG, ERROR)
+    format="%(asctime)s [%(levelname)s] %(message)s",
+    handlers=[
+        logging.StreamHandler(sys.stdout)  # Ensure logs are printed to Replit console
+    ]
+)
+logger = logging.getLogger(__name__)  # ✅ Use logger instead of print()
+
+
+# WRITE-AHEAD JOURNAL
+# Pending DB writes and uploads are appended here (and fsynced) before they are acknowledged, so a crash or a
+# redeploy doesn't lose them: on start the queues replay what the remote side never confirmed.
+#
+# <JOURNAL_DIR>/<name>/LOCK                    held by the process that owns the journal
+# <JOURNAL_DIR>/<name>/<first sequence>.seg    records: header (payload length, crc32, sequence) + pickled payload
+
+RECORD_HEADER = struct.Struct("<IIQ")
+fdatasync = getattr(os, "fdatasync", os.fsync)
+
+
+def record_checksum(seq, payload):
+    return zlib.crc32(struct.pack("<Q", seq) + payload)
+
+
+def fsync_directory(directory):
+    """Makes created/removed segment files durable (the directory entry is not covered by the file's fsync)."""
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class Segment:
+    """A segment file and the sequence numbers in it that are not acknowledged yet."""
+    def __init__(self, path, first_seq, size=0):
+        self.path = path
+        self.first_seq = first_seq
+        self.size = size
+        self.unacked = set()
+        self.fd = None  # only the active segment is open
+
+
+class Journal:
+    """
+    Append-only journal made of segment files. append() resolves once the record is on disk: all records appended
+    while a write is in progress are written and fsynced together by committer() (group commit).
+    ack() confirms records, a segment file is deleted as soon as all its records are confirmed.
+
+    Both bot processes use journals with the same names, so every process locks its own slot directory
+    (`name`, `name.1`, ...). A slot left behind by a previous run is taken over and replayed by open().
+    """
+    def __init__(self, name, directory=JOURNAL_DIR, segment_bytes=JOURNAL_SEGMENT_BYTES, commit_delay=JOURNAL_COMMIT_DELAY):
+        self.name = name
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.commit_delay = commit_delay  # seconds a commit waits for more records to join it
+        self.path = None
+        self.lock_fd = None
+        self.segments = []  # ordered by first_seq
+        self.first_seqs = []  # first_seq of self.segments (for bisect)
+        self.active = None
+        self.next_seq = 0
+        self.pending = []  # (seq, encoded record, future) waiting for the next commit
+        self.pending_event = asyncio.Event()
+        self.ready = asyncio.Event()  # set by start(), appends wait for it
+        self.committer_task = None
+        self.stats = {"appended": 0, "acked": 0, "replayed": 0, "commits": 0, "bytes_written": 0, "corrupt_tails": 0}
+        self.commit_latencies = deque(maxlen=200)
+
+    def lock_slot(self):
+        """Locks the first free slot directory of this journal (one per process)."""
+        os.makedirs(self.directory, exist_ok=True)
+        for slot in range(16):
+            path = os.path.join(self.directory, self.name if slot == 0 else f"{self.name}.{slot}")
+            os.makedirs(path, exist_ok=True)
+            lock_fd = os.open(os.path.join(path, "LOCK"), os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                os.close(lock_fd)
+                continue
+            self.path, self.lock_fd = path, lock_fd
+            return
+        raise RuntimeError(f"No free slot for journal {self.name} in {self.directory}")
+
+    def read_segment(self, segment):
+        """Reads the valid records of a segment file. A torn or corrupt tail (crash during a write) is cut off."""
+        records = []
+        with open(segment.path, "rb") as segment_file:
+            data = segment_file.read()
+        offset = 0
+        while offset < len(data):
+            if offset + RECORD_HEADER.size > len(data):
+                break
+            length, checksum, seq = RECORD_HEADER.unpack_from(data, offset)
+            payload = data[offset + RECORD_HEADER.size:offset + RECORD_HEADER.size + length]
+            if len(payload) < length or record_checksum(seq, payload) != checksum:
+                break
+            records.append((seq, pickle.loads(payload)))
+            offset += RECORD_HEADER.size + length
+        if offset < len(data):
+            self.stats["corrupt_tails"] += 1
+            logger.warning(f"⚠️ Journal {self.name}: cut off {len(data) - offset} corrupt bytes at the end of {segment.path}")
+            os.truncate(segment.path, offset)
+        segment.size = offset
+        return records
+
+    def open(self):
+        """
+        Locks a slot and reads the records that were never acknowledged (synchronous, call it before start()).
+
+        :return: List of (seq, record) in append order. The caller must ack() them once they are processed again.
+        """
+        self.lock_slot()
+        replayed = []
+        segment_files = sorted(filename for filename in os.listdir(self.path) if filename.endswith(".seg"))
+        for filename in segment_files:
+            segment = Segment(os.path.join(self.path, filename), int(filename[:-4]))
+            records = self.read_segment(segment)
+            if not records:
+                os.remove(segment.path)
+                continue
+            segment.unacked = {seq for seq, _ in records}
+            self.add_segment(segment)
+            replayed += records
+            self.next_seq = max(self.next_seq, records[-1][0] + 1)
+        self.stats["replayed"] = len(replayed)
+        if replayed:
+            logger.info(f"🔁 Journal {self.name}: replaying {len(replayed)} unacknowledged records from {self.path}")
+        return replayed
+
+    def add_segment(self, segment):
+        self.segments.append(segment)
+        self.first_seqs.append(segment.first_seq)
+
+    def remove_segment(self, segment):
+        index = self.segments.index(segment)
+        del self.segments[index]
+        del self.first_seqs[index]
+        os.remove(segment.path)
+        logger.debug(f"🗑️ Journal {self.name}: removed segment {segment.path}")
+
+    async def start(self, spawn=asyncio.create_task):
+        """
+        Starts the committer (opens the journal first if open() was not called).
+
+        :param spawn: Starts the committer task, e.g. the owning queue's spawn() so its drain() stops it.
+        """
+        if self.committer_task is not None:
+            return
+        if self.path is None:
+            self.open()
+        self.committer_task = spawn(self.committer())
+        self.ready.set()
+        logger.info(f"✅ Journal {self.name} ready at {self.path}")
+
+    async def append(self, record):
+        """
+        Appends a record (any picklable object) and waits until it is fsynced.
+
+        :return: Sequence number of the record, pass it to ack() once the remote side confirmed the write.
+        """
+        await self.ready.wait()
+        payload = pickle.dumps(record)
+        seq = self.next_seq
+        self.next_seq += 1
+        future = asyncio.get_event_loop().create_future()
+        self.pending.append((seq, RECORD_HEADER.pack(len(payload), record_checksum(seq, payload), seq) + payload, future))
+        self.pending_event.set()
+        await future
+        return seq
+
+    def ack(self, seqs):
+        """Confirms records. Segments (except the one being written) without unconfirmed records are deleted."""
+        for seq in seqs:
+            index = bisect.bisect_right(self.first_seqs, seq) - 1
+            if index < 0:
+                continue
+            segment = self.segments[index]
+            if seq in segment.unacked:
+                segment.unacked.discard(seq)
+                self.stats["acked"] += 1
+                if not segment.unacked and segment is not self.active:
+                    self.remove_segment(segment)
+
+    def roll_segment(self, first_seq):
+        """Closes the active segment and starts a new one (runs in the committer's thread)."""
+        if self.active is not None:
+            os.close(self.active.fd)
+            self.active.fd = None
+        segment = Segment(os.path.join(self.path, f"{first_seq:016d}.seg"), first_seq)
+        segment.fd = os.open(segment.path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        fsync_directory(self.path)
+        return segment
+
+    def write_batch(self, segment, data):
+        os.write(segment.fd, data)
+        fdatasync(segment.fd)
+
+    async def committer(self):
+        """Writes and fsyncs all pending records at once, then wakes up their appenders."""
+        while True:
+            await self.pending_event.wait()
+            if self.commit_delay:
+                await asyncio.sleep(self.commit_delay)  # let concurrent appends join this commit
+            batch, self.pending = self.pending, []
+            self.pending_event.clear()
+
+            start_time = time.monotonic()
+            try:
+                if self.active is None or self.active.size >= self.segment_bytes:
+                    previous = self.active
+                    self.active = await asyncio.to_thread(self.roll_segment, batch[0][0])
+                    self.add_segment(self.active)
+                    if previous is not None and not previous.unacked:
+                        self.remove_segment(previous)
+                data = b"".join(encoded for _, encoded, _ in batch)
+                self.active.unacked.update(seq for seq, _, _ in batch)
+                await asyncio.to_thread(self.write_batch, self.active, data)
+            except Exception as e:
+                logger.error(f"❌ Journal {self.name}: commit of {len(batch)} records failed: {e}")
+                if self.active is not None:  # the segment may end with a partial write now, continue in a new one
+                    self.active.unacked.difference_update(seq for seq, _, _ in batch)
+                    self.active.size = self.segment_bytes
+                for _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            self.active.size += len(data)
+            self.commit_latencies.append(time.monotonic() - start_time)
+            self.stats["commits"] += 1
+            self.stats["appended"] += len(batch)
+            self.stats["bytes_written"] += len(data)
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_result(None)
+
+    def close(self):
+        """Stops the committer, closes the active segment and releases the slot (pending appends are not committed anymore)."""
+        if self.committer_task is not None:
+            self.committer_task.cancel()
+            self.committer_task = None
+        if self.active is not None and self.active.fd is not None:
+            os.close(self.active.fd)
+            self.active.fd = None
+        if self.lock_fd is not None:
+            os.close(self.lock_fd)
+            self.lock_fd = None
+
+    def get_stats(self):
+        """Unconfirmed records, segment files and group commit sizes/latencies."""
+        latencies = sorted(self.commit_latencies)
+        return {
+            **self.stats,
+            "unacked": sum(len(segment.unacked) for segment in self.segments),
+            "segments": len(self.segments),
+            "avg_commit_size": self.stats["appended"] / self.stats["commits"] if self.stats["commits"] else 0.0,
+            "commit_latency_p95": latencies[int(len(latencies) * 0.95)] if latencies else 0.0
+        }
+
+# --- END OF WRITE-AHEAD JOURNAL ---
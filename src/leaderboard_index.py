@@ -0,0 +1,237 @@
+import sys
+import random
+import asyncio
+import logging
+from config import LOGGING_LEVEL, LEADERBOARD_SYNC_INTERVAL
+
+
+# ✅ Setup logging configuration
+logging.basicConfig(
+    level=LOGGING_LEVEL,  # Capture ALL logs (INFO, DEBUG, ERROR)
+    format="%(asctime)s [%(levelname)s] %(message)s",
+    handlers=[
+        logging.StreamHandler(sys.stdout)  # Ensure logs are printed to Replit console
+    ]
+)
+logger = logging.getLogger(__name__)  # ✅ Use logger instead of print()
+
+
+# LEADERBOARD INDEX
+# Keeps the users ordered by total chance, so the leaderboard (top K) and /rank don't sort all users every time.
+
+MAX_LEVEL = 32
+
+
+def total_chance(played_minutes, invites, creator_code):
+    """1 + played/60 + invites + creator code (rounded like on the leaderboard)."""
+    return round(1 + (played_minutes / 60) + invites + creator_code, 2)
+
+
+def leaderboard_entry(user_data):
+    """The leaderboard fields of a user entry (the dicts get_leaderboard_top_users() returns)."""
+    played_minutes = user_data.get("played_minutes") or 0
+    invites = user_data.get("invite", {}).get("total_invites") or 0
+    creator_code = user_data.get("creator_code") or 0
+    return {
+        "discord_id": user_data.get("discord_id"),
+        "name": user_data.get("discord_name"),
+        "total_chance": total_chance(played_minutes, invites, creator_code),
+        "played_minutes": played_minutes,
+        "invites": invites,
+        "creator_code": creator_code
+    }
+
+
+class SkipNode:
+    """Skip list node. `spans[level]` is the number of nodes `forward[level]` skips (for ranks)."""
+    __slots__ = ("key", "value", "forward", "spans")
+
+    def __init__(self, key, value, level):
+        self.key = key
+        self.value = value
+        self.forward = [None] * level
+        self.spans = [0] * level
+
+
+class IndexableSkipList:
+    """
+    Sorted map with positions: insert/remove/rank in O(log n) (expected), the first k items in O(k).
+    Keys must be unique and comparable.
+    """
+    def __init__(self, seed=None):
+        self.head = SkipNode(None, None, MAX_LEVEL)
+        self.level = 1
+        self.size = 0
+        self.random = random.Random(seed)
+
+    def __len__(self):
+        return self.size
+
+    def random_level(self):
+        level = 1
+        while level < MAX_LEVEL and self.random.random() < 0.5:
+            level += 1
+        return level
+
+    def find_path(self, key):
+        """Last node before `key` on every level and its position (0 = head)."""
+        update = [self.head] * MAX_LEVEL
+        positions = [0] * MAX_LEVEL
+        node, position = self.head, 0
+        for level in reversed(range(self.level)):
+            while node.forward[level] is not None and node.forward[level].key < key:
+                position += node.spans[level]
+                node = node.forward[level]
+            update[level] = node
+            positions[level] = position
+        return update, positions
+
+    def insert(self, key, value):
+        update, positions = self.find_path(key)
+        level = self.random_level()
+        if level > self.level:
+            for new_level in range(self.level, level):
+                update[new_level] = self.head
+                positions[new_level] = 0
+                self.head.spans[new_level] = self.size
+            self.level = level
+        node = SkipNode(key, value, level)
+        for i in range(level):
+            node.forward[i] = update[i].forward[i]
+            update[i].forward[i] = node
+            # the new node is at position positions[0] + 1, split the span of the node before it
+            node.spans[i] = update[i].spans[i] - (positions[0] - positions[i])
+            update[i].spans[i] = positions[0] - positions[i] + 1
+        for i in range(level, self.level):
+            update[i].spans[i] += 1
+        self.size += 1
+
+    def remove(self, key):
+        """Removes `key` and returns its value (KeyError if it isn't in the list)."""
+        update, _ = self.find_path(key)
+        node = update[0].forward[0]
+        if node is None or node.key != key:
+            raise KeyError(key)
+        for i in range(self.level):
+            if update[i].forward[i] is node:
+                update[i].spans[i] += node.spans[i] - 1
+                update[i].forward[i] = node.forward[i]
+            else:
+                update[i].spans[i] -= 1
+        while self.level > 1 and self.head.forward[self.level - 1] is None:
+            self.head.spans[self.level - 1] = 0
+            self.level -= 1
+        self.size -= 1
+        return node.value
+
+    def rank(self, key):
+        """1-based position of `key` (None if it isn't in the list)."""
+        node, position = self.head, 0
+        for level in reversed(range(self.level)):
+            while node.forward[level] is not None and node.forward[level].key <= key:
+                position += node.spans[level]
+                node = node.forward[level]
+            if node is not self.head and node.key == key:
+                return position
+        return None
+
+    def first(self, k):
+        """The first k (key, value) pairs."""
+        items = []
+        node = self.head.forward[0]
+        while node is not None and len(items) < k:
+            items.append((node.key, node.value))
+            node = node.forward[0]
+        return items
+
+
+class LeaderboardIndex:
+    """
+    Users ordered by total chance (best first, ties by discord_id), updated from the user store's change listener.
+
+    Only named users are ranked (like the leaderboard always did). Changes the other bot process wrote are picked up
+    by sync(), which asks the store for the entries written since the last sync; start() runs it in the background
+    every `sync_interval` seconds, so the leaderboard and /rank only read the index.
+    """
+    def __init__(self, sync_interval=LEADERBOARD_SYNC_INTERVAL):
+        self.sync_interval = sync_interval
+        self.task = None
+        self.entries = IndexableSkipList()
+        self.users = {}  # discord_id -> (key in self.entries, leaderboard entry)
+        self.synced_version = None  # storage version the index is up to date with (None = not built yet)
+        self.stats = {"rebuilds": 0, "updates": 0, "syncs": 0, "synced_users": 0}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def update(self, discord_id, user_data):
+        """Re-ranks a user after their entry changed (user_data None removes them)."""
+        discord_id = str(discord_id)
+        entry = leaderboard_entry(user_data) if user_data is not None and user_data.get("discord_name") is not None else None
+        key = (-entry["total_chance"], discord_id) if entry is not None else None
+        old = self.users.pop(discord_id, None)
+        if old is not None:
+            self.entries.remove(old[0])
+        if entry is not None:
+            self.entries.insert(key, entry)
+            self.users[discord_id] = (key, entry)
+        self.stats["updates"] += 1
+
+    def rebuild(self, user_store):
+        """Builds the index from all entries of the store."""
+        version = user_store.current_version()
+        self.entries = IndexableSkipList()
+        self.users = {}
+        for user_data in user_store.iter_users():
+            self.update(user_data["discord_id"], user_data)
+        self.synced_version = version
+        self.stats["rebuilds"] += 1
+        logger.info(f"🏆 Built leaderboard index with {len(self.entries)} users")
+
+    def sync(self, user_store):
+        """Applies the entries written since the last sync (by the other process), builds the index on first use."""
+        if self.synced_version is None:
+            self.rebuild(user_store)
+            return
+        records, self.synced_version = user_store.changed_since(self.synced_version)
+        for user_data in records:
+            self.update(user_data["discord_id"], user_data)
+        self.stats["syncs"] += 1
+        self.stats["synced_users"] += len(records)
+
+    async def maintain(self, user_store):
+        """Syncs every sync_interval seconds."""
+        while True:
+            await asyncio.sleep(self.sync_interval)
+            try:
+                self.sync(user_store)
+            except Exception as e:
+                logger.error(f"❌ Leaderboard index sync failed: {e}")
+
+    def start(self, user_store):
+        """Builds the index and starts the background sync (in the running event loop), once."""
+        if self.task is None:
+            self.rebuild(user_store)
+            self.task = asyncio.create_task(self.maintain(user_store))
+            logger.info(f"✅ Started leaderboard index sync ({self.sync_interval}s)")
+
+    def close(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    def top(self, limit):
+        """Leaderboard entries of the best `limit` users, best first."""
+        return [entry for _, entry in self.entries.first(limit)]
+
+    def rank(self, discord_id):
+        """(rank, leaderboard entry) of a user, None if they aren't ranked."""
+        user = self.users.get(str(discord_id))
+        if user is None:
+            return None
+        return self.entries.rank(user[0]), user[1]
+
+    def get_stats(self):
+        return {"ranked_users": len(self.entries), **self.stats}
+
+# --- END OF LEADERBOARD INDEX ---
@@ -0,0 +1,101 @@
+import os
+import sys
+import time
+import random
+import shutil
+import logging
+from config import LOGGING_LEVEL, OBJECT_STORAGE_BACKEND, OBJECT_STORAGE_BUCKET_ID, LOCAL_BUCKET_DIR
+
+
+# ✅ Setup logging configuration
+logging.basicConfig(
+    level=LOGGING_LEVEL,  # Capture ALL logs (INFO, DEBUG, ERROR)
+    format="%(asctime)s [%(levelname)s] %(message)s",
+    handlers=[
+        logging.StreamHandler(sys.stdout)  # Ensure logs are printed to Replit console
+    ]
+)
+logger = logging.getLogger(__name__)  # ✅ Use logger instead of print()
+
+
+# OBJECT STORAGE CLIENTS
+
+class LocalObject:
+    """Listed object (like the ones returned by replit.object_storage.Client.list())."""
+    def __init__(self, name):
+        self.name = name
+
+
+class LocalBucketClient:
+    """
+    Filesystem-backed stand-in for replit.object_storage.Client (same methods), for offline runs and benchmarks.
+
+    :param directory: Directory that holds the objects.
+    :param latency: Simulated seconds per request (blocking, like the real client).
+    :param failure_rate: Share of uploads that fail with ConnectionError (to exercise the retries).
+    """
+    def __init__(self, directory=LOCAL_BUCKET_DIR, latency=0.0, failure_rate=0.0, seed=None):
+        self.directory = directory
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.random = random.Random(seed)
+        os.makedirs(directory, exist_ok=True)
+
+    def object_path(self, object_name):
+        return os.path.join(self.directory, object_name)
+
+    def simulate_request(self):
+        if self.latency:
+            time.sleep(self.latency)
+        if self.failure_rate and self.random.random() < self.failure_rate:
+            raise ConnectionError("Simulated object storage failure")
+
+    def upload_from_bytes(self, object_name, src_data):
+        self.simulate_request()
+        path = self.object_path(object_name)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, "wb") as object_file:
+            object_file.write(src_data)
+        os.replace(temp_path, path)  # readers never see a partial object
+
+    def upload_from_text(self, object_name, src_data):
+        self.upload_from_bytes(object_name, src_data.encode("utf-8"))
+
+    def upload_from_filename(self, object_name, src_filename):
+        with open(src_filename, "rb") as src_file:
+            self.upload_from_bytes(object_name, src_file.read())
+
+    def download_as_bytes(self, object_name):
+        self.simulate_request()
+        with open(self.object_path(object_name), "rb") as object_file:
+            return object_file.read()
+
+    def download_as_text(self, object_name):
+        return self.download_as_bytes(object_name).decode("utf-8")
+
+    def download_to_filename(self, object_name, dest_filename):
+        shutil.copyfile(self.object_path(object_name), dest_filename)
+
+    def exists(self, object_name):
+        return os.path.exists(self.object_path(object_name))
+
+    def delete(self, object_name, ignore_not_found=False):
+        try:
+            os.remove(self.object_path(object_name))
+        except FileNotFoundError:
+            if not ignore_not_found:
+                raise
+
+    def list(self, prefix=""):
+        return [LocalObject(name) for name in sorted(os.listdir(self.directory)) if name.startswith(prefix) and not name.endswith(".tmp")]
+
+
+def create_bucket_client(backend=OBJECT_STORAGE_BACKEND):
+    """Returns the bucket client of the configured backend ("replit" or "local")."""
+    if backend == "local":
+        logger.info(f"🪣 Using local object storage in {LOCAL_BUCKET_DIR}")
+        return LocalBucketClient()
+    from replit.object_storage import Client  # only available on Replit
+    return Client(bucket_id=OBJECT_STORAGE_BUCKET_ID)
+
+# --- END OF OBJECT STORAGE CLIENTS ---
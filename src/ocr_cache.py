@@ -0,0 +1,109 @@
+import os
+import sys
+import json
+import hashlib
+import logging
+from collections import OrderedDict
+from config import LOGGING_LEVEL, OCR_CACHE_DIR, OCR_CACHE_MEMORY_SIZE, OCR_CACHE_DISK_SIZE
+
+
+# ✅ Setup logging configuration
+logging.basicConfig(
+    level=LOGGING_LEVEL,  # Capture ALL logs (INFO, DEBUG, ERROR)
+    format="%(asctime)s [%(levelname)s] %(message)s",
+    handlers=[
+        logging.StreamHandler(sys.stdout)  # Ensure logs are printed to Replit console
+    ]
+)
+logger = logging.getLogger(__name__)  # ✅ Use logger instead of print()
+
+
+class OcrResultCache:
+    """
+    Content-addressed cache for OCR results. The key is the SHA-256 of the image bytes plus the OCR pipeline version,
+    so a resent screenshot is answered without fetching/decoding/OCR again and a pipeline change invalidates old results.
+    Two tiers: a bounded in-memory LRU and one small JSON file per result on disk (survives restarts).
+    """
+    def __init__(self, cache_dir=OCR_CACHE_DIR, memory_size=OCR_CACHE_MEMORY_SIZE, disk_size=OCR_CACHE_DISK_SIZE):
+        self.cache_dir = cache_dir
+        self.memory_size = memory_size
+        self.disk_size = disk_size
+        self.memory = OrderedDict()  # {key: result}, most recently used last
+        self.disk_entries = 0
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0}
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.disk_entries = len(os.listdir(self.cache_dir))
+        logger.info(f"✅ OCR cache ready ({self.disk_entries} results on disk)")
+
+    @staticmethod
+    def make_key(image_bytes, version):
+        """Returns the cache key for the image bytes and OCR pipeline version."""
+        digest = hashlib.sha256(version.encode("utf-8"))
+        digest.update(image_bytes)
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def get(self, key):
+        """Returns the cached result or None."""
+        if key in self.memory:
+            self.memory.move_to_end(key)
+            self.stats["memory_hits"] += 1
+            return dict(self.memory[key])
+
+        try:
+            with open(self._path(key), "r", encoding="utf-8") as file:
+                result = json.load(file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.stats["misses"] += 1
+            return None
+
+        self.stats["disk_hits"] += 1
+        self._remember(key, result)
+        return dict(result)
+
+    def put(self, key, result):
+        """Stores a result in both tiers."""
+        self._remember(key, result)
+        path = self._path(key)
+        try:
+            is_new = not os.path.exists(path)
+            with open(path, "w", encoding="utf-8") as file:
+                json.dump(result, file)
+            self.stats["stores"] += 1
+            if is_new:
+                self.disk_entries += 1
+                if self.disk_entries > self.disk_size:
+                    self._prune_disk()
+        except OSError as e:
+            logger.warning(f"❌ Could not write OCR cache entry {key}: {e}")
+
+    def _remember(self, key, result):
+        self.memory[key] = dict(result)
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memory_size:
+            self.memory.popitem(last=False)
+
+    def _prune_disk(self):
+        """Deletes the oldest 10% of the disk tier."""
+        entries = sorted(os.scandir(self.cache_dir), key=lambda entry: entry.stat().st_mtime)
+        to_delete = entries[:max(1, len(entries) - int(self.disk_size * 0.9))]
+        for entry in to_delete:
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+        self.disk_entries = len(entries) - len(to_delete)
+        logger.info(f"🗑️ Pruned {len(to_delete)} OCR cache entries from disk")
+
+    def get_stats(self):
+        """Returns hit/miss counters and tier sizes."""
+        lookups = self.stats["memory_hits"] + self.stats["disk_hits"] + self.stats["misses"]
+        hits = self.stats["memory_hits"] + self.stats["disk_hits"]
+        return {
+            **self.stats,
+            "hit_rate": round(hits / lookups, 3) if lookups else 0.0,
+            "memory_entries": len(self.memory),
+            "disk_entries": self.disk_entries
+        }
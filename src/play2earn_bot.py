@@ -8,15 +8,17 @@ import asyncio
 import random
 import time
 import logging
+import signal
 import aiohttp
 from datetime import datetime
 from discord.ext import commands
 from discord.ui import Modal, TextInput, Button, View
 from config import LEADERBOARD_CHANNEL_ID, LEADERBOARD_MESSAGE_ID, LOGGING_LEVEL, INVITE_CHANNEL_ID, MEMBERS_STATS_ID, MINUTES_PLAYED_ID,  PRICE_POOL_ID, GUILD_ID
 from db_handler import load_user_data, save_invite_join_to_database, save_invite_remove_to_database, restore_invite_user_map, init_pg
-from db_handler import get_leaderboard_top_users
+from db_handler import get_leaderboard_top_users, get_total_played_minutes, shutdown_db_queues, ensure_users_loaded, restore_done
+from queues import RateLimitQueue
 
-# DANGER: TODO For scalability: Here I dont use API rate limiter 
+# DANGER: TODO For scalability: Here I only use the API rate limiter for the periodic "set state" edits (coalesced)
 
 # ✅ Setup logging configuration
 logging.basicConfig(
@@ -35,15 +37,24 @@ intents2.message_content = True
 intents2.reactions = True
 intents2.members = True
 intents2.guilds = True
-play2earn_bot = commands.Bot(command_prefix="!", intents=intents2)
+rate_limiter = RateLimitQueue(50)  # own limiter, this bot runs in its own process with its own token
+play2earn_bot = commands.Bot(command_prefix="!", intents=intents2, http_trace=rate_limiter.trace_config)
 
 invites = {}  # {guild.id: {code: uses}}
 invite_user_map = {}  # {member_id: (used_code, inviter_id)}
 
 
+async def shutdown():
+    """Graceful shutdown: drains the DB queues and the pending Discord requests, then closes the bot."""
+    logger.info("🛑 Shutting down Play2Earn bot, draining queues...")
+    await shutdown_db_queues()
+    await rate_limiter.drain()
+    await play2earn_bot.close()
+
+
 @play2earn_bot.event
 async def on_ready():
-    global invites, invite_user_map
+    global invites
 
     # ✅ Initialize PostgreSQL (for this process)
     await init_pg()
@@ -54,12 +65,15 @@ async def on_ready():
         invite_list = await guild.invites()
         invites[guild.id] = {invite.code: invite.uses for invite in invite_list}
 
-    invite_user_map = restore_invite_user_map()
+    asyncio.create_task(restore_invite_map())  # once the restore from PostgreSQL is done
 
     play2earn_bot.add_view(SupportView())
 
-    #asyncio.create_task(update_minutes_pricepool_stats()) # commented because not actual total minutes but submited proof total minutes
-                                                           # for now I will update the total minutes and price pool manually 
+    await rate_limiter.start_workers()
+    # Replit stops/redeploys with SIGTERM: finish the queued work first, then disconnect
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, lambda: asyncio.create_task(shutdown()))
+
+    asyncio.create_task(update_minutes_pricepool_stats())  # total of the submitted proof minutes, a running total (no scan of all users)
     asyncio.create_task(update_members_stats())
     asyncio.create_task(update_leaderboard_loop()) 
 
@@ -68,6 +82,13 @@ async def on_ready():
     logger.info("✅Play2Earn Bot is ready!")
 
 
+async def restore_invite_map():
+    """Fills invite_user_map from the user store once it caught up with PostgreSQL (or the restore gave up)."""
+    await restore_done.wait()
+    invite_user_map.update(restore_invite_user_map())
+    logger.info(f"✅ Restored {len(invite_user_map)} invited users")
+
+
 async def update_leaderboard_loop():
     await play2earn_bot.wait_until_ready()
     while not play2earn_bot.is_closed():
@@ -118,7 +139,8 @@ async def update_leaderboard():
 
     try:
         leaderboard_msg = await leaderboard_channel.fetch_message(LEADERBOARD_MESSAGE_ID)
-        await leaderboard_msg.edit(content=f"\n{leaderboard_text}\n")
+        await rate_limiter.add_request(leaderboard_msg.edit, (), {"content": f"\n{leaderboard_text}\n"},
+                                       priority="bulk", coalesce_key=("leaderboard", LEADERBOARD_MESSAGE_ID))
         #logger.info("🔁 Leaderboard updated (code block style).")
     except discord.HTTPException as e:
         logger.warning(f"❌ Failed to update leaderboard: {e}")
@@ -145,7 +167,8 @@ async def update_minutes_pricepool_stats():
                 if minutes_channel:
                     desired_name_minutes = f"Minutes Played: {short_int(total_minutes)}"
                     if True: #minutes_channel.name != desired_name_minutes:
-                        await minutes_channel.edit(name=desired_name_minutes)
+                        await rate_limiter.add_request(minutes_channel.edit, (), {"name": desired_name_minutes},
+                                                       priority="bulk", coalesce_key=("channel_name", MINUTES_PLAYED_ID))
                         logger.info(f"✅ Edited minutes channel name to: {desired_name_minutes}")
 
 
@@ -153,7 +176,8 @@ async def update_minutes_pricepool_stats():
                 if pricepool_channel:
                     desired_name_pricepool = f"💵│Price Pool: ${short_int(pricepool_value)}"
                     if True: #pricepool_channel.name != desired_name_pricepool:
-                        await pricepool_channel.edit(name=desired_name_pricepool)
+                        await rate_limiter.add_request(pricepool_channel.edit, (), {"name": desired_name_pricepool},
+                                                       priority="bulk", coalesce_key=("channel_name", PRICE_POOL_ID))
                         logger.info(f"✅ Edited pricepool channel name to: {desired_name_pricepool}")
         except Exception as e:
             logger.error(f"❌ Live update failed: {e}")
@@ -172,16 +196,7 @@ def short_int(num: int):
     
 
 def calculate_total_minutes_played():
-    total = 0
-    for file in os.listdir("data"):
-        if file.endswith(".json"):
-            with open(os.path.join("data", file), "r", encoding="utf-8") as f:
-                user_data = json.load(f)
-                if user_data:
-                    minutes = user_data["played_minutes"]
-                    if minutes:
-                        total += minutes
-    return total
+    return get_total_played_minutes()
 
 
 
@@ -194,7 +209,8 @@ async def update_members_stats():
             member_channel = guild.get_channel(MEMBERS_STATS_ID)
             if member_channel:
                 member_count = len(guild.members)
-                await member_channel.edit(name=f"Members: {member_count}")
+                await rate_limiter.add_request(member_channel.edit, (), {"name": f"Members: {member_count}"},
+                                               priority="bulk", coalesce_key=("channel_name", MEMBERS_STATS_ID))
                 logger.info(f"✅ Edited member channel name to: {member_count}")
         except Exception as e:
             logger.error(f"❌ member stats update failed: {e}")
@@ -224,6 +240,7 @@ async def creator(ctx):
         return
 
     # ✅ Load inviter data
+    await ensure_users_loaded(member.id)
     inviter_data = load_user_data(member.id)
     if not inviter_data:
         await ctx.send(f"❌ Fehler. Warte auf einen Mod {discord.utils.get(guild.roles, name='Mod').mention}")
@@ -235,6 +252,7 @@ async def creator(ctx):
         return
 
     successful_invites = len(invited_user_ids)
+    await ensure_users_loaded(*invited_user_ids)
 
     total_minutes = 0
     for user_id in invited_user_ids:
@@ -286,7 +304,8 @@ async def on_member_join(member):
             break
 
     if used_invite:
-        inviter_total_invites = save_invite_join_to_database(member, used_invite)
+        await ensure_users_loaded(member.id, used_invite.inviter.id)
+        inviter_total_invites = await save_invite_join_to_database(member, used_invite)
 
         # Store in memory
         used_code, inviter_id = used_invite.code, used_invite.inviter.id
@@ -337,7 +356,8 @@ async def on_member_remove(member):
     used_code, inviter_id = invite_user_map.get(member.id, (None, None))
     guild = member.guild
     if inviter_id:
-        inviter_total_invites = save_invite_remove_to_database(member, inviter_id)
+        await ensure_users_loaded(member.id, inviter_id)
+        inviter_total_invites = await save_invite_remove_to_database(member, inviter_id)
         invite_channel = play2earn_bot.get_channel(INVITE_CHANNEL_ID)
         
         inviter_member = guild.get_member(inviter_id)
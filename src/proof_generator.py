@@ -0,0 +1,125 @@
+import cv2
+import numpy as np
+from ai import compute_proof_hash
+
+
+# Synthetic proof images that look like the popup of timeTracker.verse (PopUpDialog with title, description and a
+# "Done" button) on top of random game scenery. Every image comes with its ground truth, so OCR changes can be
+# measured offline (see ocr_benchmark.py).
+
+RESOLUTIONS = [(1280, 720), (1920, 1080), (2560, 1440), (3840, 2160), (1170, 2532)]  # screenshots + phone portrait
+MAP_CODE = 905712  # public_key of timeTracker.verse
+
+# Augmentation presets used by the benchmark
+PRESETS = {
+    "clean": {"jpeg_quality": None, "noise": 0, "perspective": 0.0, "blur": 0},
+    "jpeg": {"jpeg_quality": 40, "noise": 4, "perspective": 0.0, "blur": 0},
+    "phone-photo": {"jpeg_quality": 70, "noise": 8, "perspective": 0.08, "blur": 3}
+}
+
+
+def render_scenery(width, height, rng):
+    """Random colourful background: smooth gradient, blurred noise and a few shapes."""
+    gradient = np.linspace(0, 1, height, dtype=np.float32)[:, None, None]
+    top, bottom = rng.integers(0, 255, 3), rng.integers(0, 255, 3)
+    image = (top * (1 - gradient) + bottom * gradient) * np.ones((height, width, 3), np.float32)
+
+    noise = rng.random((height // 16 + 1, width // 16 + 1, 3), dtype=np.float32) * 120 - 60
+    image += cv2.resize(noise, (width, height), interpolation=cv2.INTER_CUBIC)
+    image = np.clip(image, 0, 255).astype(np.uint8)
+
+    for _ in range(rng.integers(3, 12)):
+        color = tuple(int(c) for c in rng.integers(0, 255, 3))
+        x, y = int(rng.integers(0, width)), int(rng.integers(0, height))
+        size = int(rng.integers(height // 20, height // 4))
+        if rng.random() < 0.5:
+            cv2.rectangle(image, (x, y), (x + size, y + size // 2), color, -1)
+        else:
+            cv2.circle(image, (x, y), size // 2, color, -1)
+    return image
+
+
+def render_popup(image, player_name, proof_string, minutes, rng):
+    """Draws the popup (dark translucent panel, white text) centred on the image."""
+    height, width = image.shape[:2]
+    font_scale = min(width, height) / 1080 * rng.uniform(0.9, 1.2)
+    thickness = max(1, round(2 * font_scale))
+    font = cv2.FONT_HERSHEY_SIMPLEX
+
+    title = "Take image & Upload to Discord!"
+    lines = [f"Name: {player_name}", f"Hash: {proof_string}", f"Played Time (in minutes): {minutes}", "", "Test:"]
+    line_height = int(45 * font_scale)
+    text_width = max(cv2.getTextSize(text, font, font_scale, thickness)[0][0] for text in lines + [title])
+
+    panel_width = min(width - 20, int(text_width + 160 * font_scale))
+    panel_height = int(line_height * (len(lines) + 5))
+    x0, y0 = (width - panel_width) // 2, (height - panel_height) // 2
+
+    overlay = image.copy()
+    cv2.rectangle(overlay, (x0, y0), (x0 + panel_width, y0 + panel_height), (40, 22, 12), -1)
+    cv2.addWeighted(overlay, 0.9, image, 0.1, 0, dst=image)
+
+    def centered_text(text, y, scale):
+        size = cv2.getTextSize(text, font, scale, thickness)[0]
+        cv2.putText(image, text, (x0 + (panel_width - size[0]) // 2, y), font, scale, (255, 255, 255), thickness, cv2.LINE_AA)
+
+    centered_text(title, y0 + int(line_height * 1.5), font_scale * 1.2)
+    for i, text in enumerate(lines):
+        if text:
+            centered_text(text, y0 + int(line_height * (3 + i)), font_scale)
+
+    # "Done" button
+    button_width, button_height = int(200 * font_scale), int(line_height * 1.2)
+    bx, by = x0 + (panel_width - button_width) // 2, y0 + panel_height - int(line_height * 1.6)
+    cv2.rectangle(image, (bx, by), (bx + button_width, by + button_height), (230, 200, 40), -1)
+    centered_text("Done", by + int(button_height * 0.7), font_scale)
+    return image
+
+
+def augment(image, rng, jpeg_quality=None, noise=0, perspective=0.0, blur=0):
+    """
+    Applies capture artefacts to a rendered proof.
+
+    :param perspective: Max. corner displacement relative to the image size (phone photo of a screen).
+    :return: The encoded image bytes (PNG, or JPEG if `jpeg_quality` is set).
+    """
+    height, width = image.shape[:2]
+    if perspective:
+        corners = np.float32([[0, 0], [width, 0], [width, height], [0, height]])
+        jitter = rng.uniform(-perspective, perspective, (4, 2)) * [width, height]
+        matrix = cv2.getPerspectiveTransform(corners, np.float32(corners + jitter))
+        image = cv2.warpPerspective(image, matrix, (width, height), borderMode=cv2.BORDER_REPLICATE)
+    if blur:
+        image = cv2.GaussianBlur(image, (0, 0), blur / 2)
+    if noise:
+        image = np.clip(image + rng.normal(0, noise, image.shape), 0, 255).astype(np.uint8)
+
+    if jpeg_quality:
+        ok, buffer = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, jpeg_quality])
+    else:
+        ok, buffer = cv2.imencode(".png", image)
+    return buffer.tobytes()
+
+
+def generate_proof(rng, preset="clean", resolution=None, minutes=None, valid=True):
+    """
+    Generates one synthetic proof image.
+
+    :param rng: numpy Generator.
+    :param preset: Name of the augmentation preset (see PRESETS).
+    :param resolution: (width, height), random from RESOLUTIONS if None.
+    :param minutes: Played minutes, random if None.
+    :param valid: If False the shown hash is wrong (the proof must be rejected).
+    :return: Tuple (image bytes, ground truth dictionary with `valid_hash` and `played_time`).
+    """
+    width, height = resolution or RESOLUTIONS[rng.integers(len(RESOLUTIONS))]
+    minutes = minutes if minutes is not None else int(rng.integers(1, 20000))
+    proof_hash = compute_proof_hash(MAP_CODE, minutes)
+    if not valid:
+        proof_hash = (proof_hash + int(rng.integers(1, 3456788))) % 3456789
+    player_name = "".join(rng.choice(list("abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789_"), rng.integers(4, 14)))
+
+    image = render_scenery(width, height, rng)
+    image = render_popup(image, player_name, f"{MAP_CODE}X{proof_hash}", minutes, rng)
+    image_bytes = augment(image, rng, **PRESETS[preset])
+    return image_bytes, {"valid_hash": valid, "played_time": minutes}
@@ -2,8 +2,24 @@ import time
 import logging
 import sys
 import os
+import uuid
+import fcntl
 import asyncio
-from config import LOGGING_LEVEL
+import bisect
+import contextvars
+import heapq
+import itertools
+import functools
+import inspect
+import pickle
+import random
+import shutil
+import aiohttp
+from collections import deque
+from config import LOGGING_LEVEL, OCR_CPU_HIGH_PERCENT, OCR_MIN_FREE_MEMORY_MB, OCR_CONTROL_INTERVAL
+from config import RATE_LIMIT_QUEUE_CAPACITY, RATE_LIMIT_QUEUE_OVERFLOW, CPU_QUEUE_CAPACITY, CPU_QUEUE_OVERFLOW
+from config import DB_QUEUE_CAPACITY, DB_QUEUE_OVERFLOW, QUEUE_SPILL_DIR, USER_TASKS_PER_MINUTE, USER_TASK_BURST
+from config import PG_FLUSH_INTERVAL, PG_FLUSH_BATCH_SIZE, UPLOAD_MAX_ATTEMPTS, UPLOAD_BACKOFF_BASE, UPLOAD_BACKOFF_MAX
 import psutil
 
 
@@ -18,61 +34,837 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)  # ✅ Use logger instead of print()
 
 
+def describe_args(args):
+    """Short representation of task args for logs (image buffers are replaced by their size)."""
+    return tuple(f"<{len(arg)} bytes>" if isinstance(arg, (bytes, bytearray)) else arg for arg in args)
+
+
+# TASK FRAMEWORK
+
+TASK_COUNTERS = ("enqueued", "started", "completed", "failed", "cancelled", "timed_out")
+
+
+class DeadlineExceeded(Exception):
+    """Raised when a task can't be done before its deadline (for RateLimitQueue: a request can't be sent in time)."""
+
+
+class QueueClosed(Exception):
+    """Raised for tasks submitted to a queue that is draining for shutdown."""
+
+
+class TaskExecutor:
+    """
+    Shared base of all queues: a caller queues a task with a future and waits for it, a worker runs the task and
+    resolves the future.
+
+    - submit_future() creates the future of a task (with an optional deadline), wait_result() waits for it. When the
+      deadline passes or the caller is cancelled (e.g. the interaction went away), the future is cancelled, too:
+      a queued task is skipped, a running one is cancelled (a sync func in a process pool finishes, its result is dropped).
+    - execute() runs a task in a worker and resolves its future.
+    - spawn() starts background tasks (workers, ...), drain() lets the submitted tasks finish and stops them on shutdown.
+    - get_task_stats(): counters (TASK_COUNTERS) and the mean wait and service time.
+    """
+    def __init__(self, name, default_timeout=None):
+        self.name = name
+        self.default_timeout = default_timeout  # seconds a task may take from submission to result, None = no deadline
+        self.counters = dict.fromkeys(TASK_COUNTERS, 0)
+        self.wait_time_total = 0.0
+        self.service_time_total = 0.0
+        self.outstanding = {}  # future -> (time.monotonic() of the submission, deadline or None), until the future is done
+        self.idle = asyncio.Event()  # set while no submitted task is outstanding
+        self.idle.set()
+        self.closing = False
+        self.started = False
+        self.background_tasks = set()
+
+    def submit_future(self, timeout=None):
+        """
+        Creates the future of a new task. Raises QueueClosed while the queue drains.
+
+        :param timeout: Seconds until the task's deadline (default: default_timeout).
+        """
+        if self.closing:
+            raise QueueClosed(f"{self.name} queue is shutting down")
+        timeout = self.default_timeout if timeout is None else timeout
+        now = time.monotonic()
+        future = asyncio.get_event_loop().create_future()
+        self.outstanding[future] = (now, now + timeout if timeout is not None else None)
+        self.counters["enqueued"] += 1
+        self.idle.clear()
+        future.add_done_callback(self.forget)
+        return future
+
+    def withdraw(self, future):
+        """Forgets the future of a task that was refused at admission (it doesn't count as enqueued)."""
+        if self.outstanding.pop(future, None) is not None:
+            self.counters["enqueued"] -= 1
+        future.remove_done_callback(self.forget)
+        future.cancel()
+        if not self.outstanding:
+            self.idle.set()
+
+    def forget(self, future):
+        """Done callback of every task future (this also marks its exception as retrieved, execute() logs it)."""
+        self.outstanding.pop(future, None)
+        if future.cancelled():
+            self.counters["cancelled"] += 1
+        elif isinstance(future.exception(), DeadlineExceeded):
+            self.counters["timed_out"] += 1
+        if not self.outstanding:
+            self.idle.set()
+
+    async def wait_result(self, future, cancel_on_exit=True):
+        """
+        Waits for the result of a submitted task, until its deadline (then DeadlineExceeded is raised).
+
+        :param cancel_on_exit: Cancel the task if the caller is cancelled or the deadline passes. False for a future
+                               that other callers share (e.g. coalesced requests), the task goes on without this caller.
+        """
+        deadline = self.outstanding.get(future, (None, None))[1]
+        try:
+            if deadline is None:
+                return await asyncio.shield(future)
+            return await asyncio.wait_for(asyncio.shield(future), max(0.0, deadline - time.monotonic()))
+        except asyncio.TimeoutError:
+            if future.done() and not future.cancelled():
+                return future.result()  # finished just in time
+            error = DeadlineExceeded(f"{self.name} task did not finish before its deadline")
+            if cancel_on_exit and not future.done():
+                future.set_exception(error)
+            raise error
+        except asyncio.CancelledError:
+            if cancel_on_exit and not future.done():
+                future.cancel()
+            raise
+
+    async def execute(self, future, call, description):
+        """
+        Runs a queued task in a worker and resolves its future with the result or the exception.
+        A task whose future is already done (cancelled, superseded, ...) or whose deadline passed is skipped.
+
+        :param call: Function without arguments that returns the awaitable of the task.
+        :param description: Name of the task for the logs.
+        :return: The service time in seconds if the task succeeded, otherwise None.
+        """
+        if future.done():
+            return None
+        submitted_at, deadline = self.outstanding.get(future, (None, None))
+        start_time = time.monotonic()
+        if deadline is not None and start_time >= deadline:
+            future.set_exception(DeadlineExceeded(f"{description} waited past its deadline in the {self.name} queue"))
+            return None
+        self.counters["started"] += 1
+        if submitted_at is not None:
+            self.wait_time_total += start_time - submitted_at
+
+        task = asyncio.ensure_future(call())
+
+        def cancel_task(_):  # the caller went away or the deadline passed while it runs
+            task.cancel()
+
+        future.add_done_callback(cancel_task)
+        try:
+            result = await task
+        except asyncio.CancelledError:
+            if future.done():
+                logger.debug(f"{self.name}: cancelled running task {description}")
+                return None
+            future.cancel()  # the worker itself is cancelled (shutdown)
+            raise
+        except Exception as e:
+            self.counters["failed"] += 1
+            logger.error(f"❌ Error processing {self.name} task {description}: {e}")
+            if not future.done():
+                future.set_exception(e)
+            return None
+        finally:
+            future.remove_done_callback(cancel_task)
+
+        service_time = time.monotonic() - start_time
+        self.counters["completed"] += 1
+        self.service_time_total += service_time
+        if not future.done():
+            future.set_result(result)
+        return service_time
+
+    def mark_started(self):
+        """True only the first time: on_ready() (and with it start_workers()) runs again after every gateway reconnect."""
+        if self.started:
+            return False
+        self.started = True
+        return True
+
+    def spawn(self, coro):
+        """Starts a background task of the queue (stopped by drain())."""
+        task = asyncio.create_task(coro)
+        self.background_tasks.add(task)
+        task.add_done_callback(self.background_tasks.discard)
+        return task
+
+    async def drain(self, timeout=30):
+        """
+        Graceful shutdown: refuses new tasks, waits up to `timeout` seconds until the submitted ones are done,
+        then cancels what is left and stops the background tasks.
+        """
+        self.closing = True
+        try:
+            await asyncio.wait_for(self.idle.wait(), timeout)
+            logger.info(f"✅ {self.name} queue drained")
+        except asyncio.TimeoutError:
+            logger.warning(f"⚠️ {self.name} queue: {len(self.outstanding)} tasks not done after {timeout}s, cancelling them")
+        for future in list(self.outstanding):
+            future.cancel()
+        tasks = list(self.background_tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def get_task_stats(self):
+        return {
+            **self.counters,
+            "outstanding": len(self.outstanding),
+            "mean_wait_time": self.wait_time_total / self.counters["started"] if self.counters["started"] else 0.0,
+            "mean_service_time": self.service_time_total / self.counters["completed"] if self.counters["completed"] else 0.0
+        }
+
+# --- END OF TASK FRAMEWORK ---
+
+
+# ADMISSION CONTROL
+
+OVERFLOW_POLICIES = ("reject", "shed-oldest", "spill")
+
+
+class QueueOverflow(Exception):
+    """Raised when a full queue rejects a task (or sheds it to make room for a newer one)."""
+
+
+class UserRateLimited(Exception):
+    """Raised when a user submits more tasks per minute than allowed. `retry_after` is in seconds."""
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class TaskSuperseded(Exception):
+    """Raised for a queued task that was replaced by a newer submission of the same user."""
+
+
+class AdmissionQueue(asyncio.Queue):
+    """
+    asyncio.Queue with a bounded capacity and an overflow policy for a full queue:
+    - "reject": the new task is refused with QueueOverflow.
+    - "shed-oldest": the oldest queued task is dropped (its caller gets QueueOverflow) and the new one is queued.
+    - "spill": the new task is pickled to `spill_dir` and loaded back when there is room again. Only the future
+      (the waiting caller) stays in memory, so the task's func/args must be picklable.
+
+    Every queue instance spills to its own directory (`<name>.<uuid>`) and holds a flock on its LOCK file while the
+    process lives. A directory whose lock can be taken belongs to a process that is gone: its tasks are claimed on
+    init and queued again by recover_spills().
+
+    Items are tuples, `future_index` is the position of the caller's future in them.
+    """
+    def __init__(self, name, capacity=0, overflow="reject", future_index=3, spill_dir=QUEUE_SPILL_DIR):
+        super().__init__()  # the capacity is enforced by admit(), not by asyncio.Queue's maxsize
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy: {overflow}")
+        self.name = name
+        self.capacity = capacity
+        self.overflow = overflow
+        self.future_index = future_index
+        # Per instance: the main bot and the play2earn bot both have DB queues with the same name
+        self.spill_name = name.replace(' ', '_').lower()
+        self.spill_dir = os.path.join(spill_dir, f"{self.spill_name}.{uuid.uuid4().hex}")
+        self.spill_lock_fd = None
+        self.spilled = deque()  # (file path, future) of the tasks parked on disk, FIFO
+        self.orphaned_spills = []  # files claimed from spill directories of processes that are gone
+        self.spill_sequence = itertools.count()
+        self.overflow_counts = {"rejected": 0, "shed": 0, "spilled": 0, "recovered": 0}
+        if overflow == "spill":
+            os.makedirs(self.spill_dir, exist_ok=True)
+            self.spill_lock_fd = os.open(os.path.join(self.spill_dir, "LOCK"), os.O_RDWR | os.O_CREAT, 0o644)
+            fcntl.flock(self.spill_lock_fd, fcntl.LOCK_EX)  # released by the OS when the process ends, also on a crash
+            self.claim_orphaned_spills(spill_dir)
+
+    def spill_path(self):
+        return os.path.join(self.spill_dir, f"{next(self.spill_sequence):012d}.pickle")
+
+    def claim_orphaned_spills(self, spill_dir):
+        """Moves the tasks of this queue's spill directories nobody holds the lock of (the process is gone) into ours."""
+        for directory in sorted(os.listdir(spill_dir)):
+            path = os.path.join(spill_dir, directory)
+            own_queue = self.spill_name in (directory.rsplit(".", 1)[0], directory.rsplit("_", 1)[0])  # (`<name>_<pid>`: older versions)
+            if path == self.spill_dir or not own_queue:
+                continue
+            lock_fd = os.open(os.path.join(path, "LOCK"), os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                os.close(lock_fd)
+                continue  # a live process spills there
+            try:
+                for filename in sorted(name for name in os.listdir(path) if name.endswith(".pickle")):
+                    target = self.spill_path()
+                    os.replace(os.path.join(path, filename), target)
+                    self.orphaned_spills.append(target)
+                shutil.rmtree(path, ignore_errors=True)
+            finally:
+                os.close(lock_fd)
+        if self.orphaned_spills:
+            logger.info(f"♻️ {self.name} queue: claimed {len(self.orphaned_spills)} spilled tasks of a process that is gone")
+
+    def recover_spills(self, make_future, keep=lambda item: True):
+        """
+        Queues the tasks claimed by claim_orphaned_spills() (call it once the event loop runs). Their callers are gone,
+        make_future() gives each one a new future.
+
+        :param keep: keep(item) False drops a task instead (e.g. one its journal replays anyway).
+        :return: Number of recovered tasks.
+        """
+        recovered = 0
+        for path in self.orphaned_spills:
+            with open(path, "rb") as spill_file:
+                item = pickle.load(spill_file)
+            if not keep(item):
+                os.remove(path)
+                continue
+            self.spilled.append((path, make_future()))
+            recovered += 1
+        self.orphaned_spills = []
+        self.overflow_counts["recovered"] += recovered
+        self.refill()
+        return recovered
+
+    def pending(self):
+        """Number of queued tasks, in memory and on disk."""
+        return self.qsize() + len(self.spilled)
+
+    def admit(self, item):
+        """Queues an item (synchronously), applying the overflow policy if the queue is full."""
+        if not self.capacity or self.pending() < self.capacity:
+            self.put_nowait(item)
+        elif self.overflow == "reject":
+            self.overflow_counts["rejected"] += 1
+            raise QueueOverflow(f"{self.name} queue is full ({self.capacity} tasks)")
+        elif self.overflow == "shed-oldest":
+            oldest = self.pop_oldest()
+            self.task_done()  # the shed task will never be processed
+            self.overflow_counts["shed"] += 1
+            logger.warning(f"🗑️ {self.name} queue full, shed the oldest task")
+            oldest_future = oldest[self.future_index]
+            if not oldest_future.done():
+                oldest_future.set_exception(QueueOverflow(f"{self.name} queue is full, task was shed for a newer one"))
+            self.put_nowait(item)
+        else:
+            path = self.spill_path()
+            with open(path, "wb") as spill_file:
+                pickle.dump(item[:self.future_index] + (None,) + item[self.future_index + 1:], spill_file)
+            self.spilled.append((path, item[self.future_index]))
+            self.overflow_counts["spilled"] += 1
+            logger.debug(f"💾 {self.name} queue full, spilled task to {path}")
+
+    def pop_oldest(self):
+        return self._queue.popleft()
+
+    def refill(self):
+        """Moves spilled tasks back into memory while there is room."""
+        while self.spilled and (not self.capacity or self.qsize() < self.capacity):
+            path, future = self.spilled.popleft()
+            with open(path, "rb") as spill_file:
+                item = pickle.load(spill_file)
+            os.remove(path)
+            self.put_nowait(item[:self.future_index] + (future,) + item[self.future_index + 1:])
+
+    async def get(self):
+        item = await super().get()
+        self.refill()
+        return item
+
+    def peek(self):
+        """The oldest item in memory (None if the queue is empty)."""
+        return self._queue[0] if self._queue else None
+
+    def position_of(self, future):
+        """1-based position of the task that resolves `future` (None if it is not queued anymore)."""
+        for position, item in enumerate(self._queue, 1):
+            if item[self.future_index] is future:
+                return position
+        for position, (path, spilled_future) in enumerate(self.spilled, self.qsize() + 1):
+            if spilled_future is future:
+                return position
+        return None
+
+    def get_stats(self):
+        return {"pending": self.pending(), "capacity": self.capacity, "overflow": self.overflow, **self.overflow_counts}
+
+
+class RoundRobinBuffer:
+    """
+    Item buffer of FairAdmissionQueue: one FIFO per owner, popleft() serves the owners in turn (round-robin),
+    so an owner with many items only gets every n-th turn.
+    """
+    def __init__(self, owner_index):
+        self.owner_index = owner_index
+        self.flows = {}  # owner -> deque of items, in round-robin order (dicts keep insertion order)
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        """Items in the order they will be served."""
+        flows = [list(flow) for flow in self.flows.values()]
+        for turn in range(max(map(len, flows), default=0)):
+            for flow in flows:
+                if turn < len(flow):
+                    yield flow[turn]
+
+    def append(self, item):
+        self.flows.setdefault(item[self.owner_index], deque()).append(item)
+        self.size += 1
+
+    def popleft(self):
+        owner, flow = next(iter(self.flows.items()))
+        item = flow.popleft()
+        del self.flows[owner]
+        if flow:
+            self.flows[owner] = flow  # back to the end of the round
+        self.size -= 1
+        return item
+
+    def pop_oldest(self):
+        """Removes the oldest item of the owner with the most items (shedding hits the heaviest owner first)."""
+        owner = max(self.flows, key=lambda key: len(self.flows[key]))
+        item = self.flows[owner].popleft()
+        if not self.flows[owner]:
+            del self.flows[owner]
+        self.size -= 1
+        return item
+
+    def remove_owner(self, owner):
+        """Removes and returns all queued items of an owner."""
+        items = list(self.flows.pop(owner, ()))
+        self.size -= len(items)
+        return items
+
+    def queued(self, owner):
+        return len(self.flows.get(owner, ()))
+
+
+class FairAdmissionQueue(AdmissionQueue):
+    """AdmissionQueue that serves the owners of the items (e.g. Discord users) round-robin instead of FIFO."""
+    def __init__(self, name, capacity=0, overflow="reject", future_index=3, owner_index=5, enqueued_index=4, **kwargs):
+        self.owner_index = owner_index
+        self.enqueued_index = enqueued_index
+        super().__init__(name, capacity, overflow, future_index, **kwargs)
+
+    def _init(self, maxsize):  # asyncio.Queue hook: the buffer behind put()/get()
+        self._queue = RoundRobinBuffer(self.owner_index)
+
+    def pop_oldest(self):
+        return self._queue.pop_oldest()
+
+    def peek(self):
+        """The oldest item in memory (None if the queue is empty)."""
+        heads = [flow[0] for flow in self._queue.flows.values()]
+        return min(heads, key=lambda item: item[self.enqueued_index]) if heads else None
+
+    def position_for(self, owner, replace=False):
+        """
+        1-based position a new item of `owner` would get: one turn per owner and round before its own turn.
+
+        :param replace: The new item would replace the owner's queued items.
+        """
+        rounds = 1 if replace else self._queue.queued(owner) + 1
+        return sum(min(len(flow), rounds) for key, flow in self._queue.flows.items() if key != owner) + rounds + len(self.spilled)
+
+    def owners(self):
+        """Number of owners with queued items."""
+        return len(self._queue.flows)
+
+    def remove_owner(self, owner):
+        """Removes the queued (in memory) items of an owner and returns them."""
+        items = self._queue.remove_owner(owner)
+        for _ in items:
+            self.task_done()
+        return items
+
+# --- END OF ADMISSION CONTROL ---
+
+
 # DISCORD API RATE LIMIT QUEUE SYSTEM
 
-class RateLimitQueue:
+# Route of the request that is currently sent by RateLimitQueue.request_handler(). discord.py awaits the HTTP call
+# inside the handler's task, so the aiohttp trace callbacks see the same value and can attribute the response headers.
+current_route = contextvars.ContextVar("current_route", default=None)
+
+
+def route_key(func):
+    """
+    Rate limit route of a discord.py call: (method name, major parameter).
+    The major parameter is the channel (messages, permissions, ...), the interaction, the guild of a guild object
+    (member.add_roles, role.edit, ...) or the object the method is bound to.
+    """
+    owner = getattr(func, "__self__", None)
+    for attr in ("channel", "_parent"):  # Message/Thread -> channel, InteractionResponse -> interaction
+        major = getattr(getattr(owner, attr, None), "id", None)
+        if major is not None:
+            return (func.__name__, major)
+    guild_id = getattr(getattr(owner, "guild", None), "id", None)
+    if guild_id is not None and not hasattr(owner, "permissions_for"):  # Member/Role -> guild, a channel is its own route
+        return (func.__name__, guild_id)
+    return (func.__name__, getattr(owner, "id", None))
+
+
+class RouteBucket:
+    """Token bucket of one Discord rate limit bucket, filled from the X-RateLimit-* response headers."""
+    def __init__(self):
+        self.limit = None  # None = not learned yet
+        self.remaining = 1
+        self.reset_at = 0.0  # time.monotonic() when the bucket is full again
+        self.window = 0.0  # longest reset interval seen, used to refill the bucket until the next headers arrive
+
+    def delay(self):
+        """Seconds until a request may be sent (0 = now)."""
+        now = time.monotonic()
+        if self.limit is not None and self.remaining <= 0 and now >= self.reset_at:
+            self.remaining = self.limit
+            self.reset_at = now + self.window
+        if self.limit is None or self.remaining > 0:
+            return 0.0
+        return max(0.0, self.reset_at - now)
+
+    def update(self, limit, remaining, reset_after):
+        self.limit = limit
+        self.remaining = remaining
+        self.reset_at = time.monotonic() + reset_after
+        self.window = max(self.window, reset_after)
+
+
+# Priority lanes: a request without an explicit deadline is scheduled as if it was due this many seconds after it was queued.
+# Interaction acknowledgements must reach Discord within 3 seconds, so their lane deadline is also enforced (hard).
+REQUEST_LANES = {
+    "interaction": 2.5,  # interaction.response.*, and what has to happen before it
+    "user": 10.0,  # DMs/replies a user is waiting for (default)
+    "bulk": 60.0  # role/permission edits, channel renames, leaderboard edits
+}
+HARD_DEADLINE_LANES = {"interaction"}
+WAIT_HISTOGRAM_BOUNDS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, float("inf"))  # seconds
+
+
+class RateLimitQueue(TaskExecutor):
     """
     This class implements a rate limit queue for handling rate limits. You can use "await rate_limiter.add_request(func, args, kwargs)"
     in order to run it in the queue. If you only want to run it once (e.g. in on_ready()), you can also use "await func(*args, **kwargs)" thats no problem.
+
+    Every route (method + channel/interaction) has its own token bucket, learned from Discord's X-RateLimit-* headers
+    (pass `trace_config` as `http_trace` to the bot) and from 429s. On top of that a global token bucket allows at most
+    `max_requests_per_second` (with bursts of the same size). Only a saturated route waits, all others go out at once.
+
+    Requests are scheduled earliest-deadline-first (per route and for the global bucket). The deadline comes from the
+    priority lane (REQUEST_LANES) or is passed explicitly; requests that can't make a hard deadline are rejected with
+    DeadlineExceeded instead of being sent late.
+
+    "Set state X" calls (channel renames, leaderboard edits, ...) can pass a `coalesce_key`: while a request with the
+    same key is still queued, a newer one replaces its call and all callers get the result of the last one.
+
+    At most `capacity` requests are pending; when full, `overflow` decides ("reject" the new request or "shed-oldest").
     """
-    def __init__(self, max_requests_per_second):
+    def __init__(self, max_requests_per_second, capacity=RATE_LIMIT_QUEUE_CAPACITY, overflow=RATE_LIMIT_QUEUE_OVERFLOW):
+        if overflow not in ("reject", "shed-oldest"):
+            raise ValueError(f"RateLimitQueue can't use the overflow policy {overflow} (requests are bound methods)")
+        super().__init__("Rate Limit")
         self.queue = asyncio.Queue()
+        self.capacity = capacity
+        self.overflow = overflow
+        self.overflow_counts = {"rejected": 0, "shed": 0}
         self.max_requests_per_second = max_requests_per_second
-        self.requests_this_second = 0
-        self.current_second = int(time.time())
+        self.global_tokens = float(max_requests_per_second)
+        self.global_updated = time.monotonic()
+        self.global_blocked_until = 0.0  # set by a global 429
+        self.routes = {}  # route -> heap of pending requests (exists while the route has a drain task)
+        self.sequence = itertools.count()  # tie breaker for equal deadlines (FIFO)
+        self.global_waiters = []  # heap of (deadline, seq, event) of drain tasks waiting for a global token
+        self.lane_waits = {lane: [0] * len(WAIT_HISTOGRAM_BOUNDS) for lane in REQUEST_LANES}
+        self.rejected = {lane: 0 for lane in REQUEST_LANES}
+        self.coalescing = {}  # coalesce_key -> queued request that newer calls with the same key replace
+        self.coalesced = 0
+        self.buckets = {}  # route or (X-RateLimit-Bucket, major) -> RouteBucket
+        self.route_bucket = {}  # route -> key of its bucket in self.buckets (routes of a bucket share it)
         self.lock = asyncio.Lock()
+        self.trace_config = aiohttp.TraceConfig()
+        self.trace_config.on_request_end.append(self._on_request_end)
         logger.debug(f"Rate Limit Queue items: {self.queue.qsize()}")
 
-    async def add_request(self, func, args, kwargs):
-        future = asyncio.get_event_loop().create_future()
-        await self.queue.put((func, args, kwargs, future))
-        return await future  # Wartet auf das Ergebnis
+    async def add_request(self, func, args, kwargs, priority="user", deadline=None, coalesce_key=None, timeout=None, created_at=None):
+        """
+        Queues a Discord API call and waits for its result.
+
+        :param func: The discord.py coroutine function (bound method), e.g. message.channel.send.
+        :param args: Positional arguments (tuple).
+        :param kwargs: Keyword arguments (dict).
+        :param priority: Lane of the request (see REQUEST_LANES).
+        :param deadline: Optional hard deadline in seconds from now; the request is rejected if it can't be sent in time.
+        :param coalesce_key: Optional key of a "set state" call (same route!). A queued request with the same key is
+                             replaced by this one, only the latest call is sent.
+        :param timeout: Optional seconds until the caller gives up waiting for the response (the request is cancelled).
+        :param created_at: Optional time (aware datetime) the deadline counts from, e.g. interaction.created_at, so the
+                           time the event spent in the gateway and in earlier steps counts against the deadline.
+        :return: The result of the call. Raises DeadlineExceeded if the deadline can't be met, QueueOverflow if the queue is full.
+                 If the caller is cancelled, the request is cancelled too (except coalesced ones, other callers wait for them).
+        """
+        if coalesce_key is not None and coalesce_key in self.coalescing:
+            # Not sent yet: send this call instead (at the queued request's position), every caller gets its result
+            request = self.coalescing[coalesce_key]
+            request[5][:] = [func, args, kwargs]
+            self.coalesced += 1
+            logger.debug(f"🔀 Coalesced {func.__name__} ({coalesce_key})")
+            return await self.wait_result(request[6], cancel_on_exit=False)
+
+        now = time.monotonic()
+        if deadline is None and priority in HARD_DEADLINE_LANES:
+            deadline = REQUEST_LANES[priority]
+        hard_deadline = now + deadline if deadline is not None else None
+        if hard_deadline is not None and created_at is not None:
+            hard_deadline -= max(0.0, time.time() - created_at.timestamp())
+        due = hard_deadline if hard_deadline is not None else now + REQUEST_LANES[priority]
+        if hard_deadline is not None:
+            # Reject right away instead of after waiting out the deadline (and without using a token)
+            estimated_wait = self.estimated_delay(route_key(func), due)
+            if now + estimated_wait > hard_deadline:
+                self.rejected[priority] += 1
+                logger.warning(f"⌛ Rejected {func.__name__} ({priority}) at admission: estimated wait {estimated_wait:.2f}s")
+                raise DeadlineExceeded(f"{func.__name__} can't be sent before its deadline (estimated wait {estimated_wait:.2f}s)")
+
+        self.make_room(func)
+        future = self.submit_future(timeout)
+        request = (due, next(self.sequence), hard_deadline, priority, now, [func, args, kwargs], future, coalesce_key)
+        if coalesce_key is not None:
+            self.coalescing[coalesce_key] = request
+        await self.queue.put(request)
+        return await self.wait_result(future, cancel_on_exit=coalesce_key is None)  # Wartet auf das Ergebnis
+
+    def pending(self):
+        return self.queue.qsize() + sum(len(pending) for pending in self.routes.values())
+
+    def make_room(self, func):
+        """Admission control: raises QueueOverflow or sheds the oldest pending request if the queue is full."""
+        if not self.capacity or self.pending() < self.capacity:
+            return
+        if self.overflow == "reject" or not any(self.routes.values()):
+            self.overflow_counts["rejected"] += 1
+            raise QueueOverflow(f"Rate limit queue is full ({self.capacity} requests), {func.__name__} rejected")
+        route, oldest = min(((route, request) for route, pending in self.routes.items() for request in pending), key=lambda entry: entry[1][4])
+        self.routes[route].remove(oldest)
+        heapq.heapify(self.routes[route])
+        self.take(oldest)
+        self.overflow_counts["shed"] += 1
+        logger.warning(f"🗑️ Rate limit queue full, shed {oldest[5][0].__name__}")
+        if not oldest[6].done():
+            oldest[6].set_exception(QueueOverflow("Rate limit queue is full, request was shed for a newer one"))
+
+    def get_bucket(self, route):
+        return self.buckets.setdefault(self.route_bucket.get(route, route), RouteBucket())
+
+    def learn(self, route, headers, status):
+        """Updates the route's bucket (and the global limit) from the response headers of a request."""
+        if status == 429 and (headers.get("X-RateLimit-Global") or headers.get("X-RateLimit-Scope") == "global"):
+            retry_after = float(headers.get("Retry-After", 1))
+            self.global_blocked_until = time.monotonic() + retry_after
+            logger.warning(f"🚦 Global rate limit hit, pausing all requests for {retry_after:.2f}s")
+            return
+        if route is None:
+            return
+
+        if "X-RateLimit-Bucket" in headers:
+            bucket_key = (headers["X-RateLimit-Bucket"], route[1])
+            if self.route_bucket.get(route) != bucket_key:
+                self.buckets.setdefault(bucket_key, self.buckets.pop(route, None) or RouteBucket())
+                self.route_bucket[route] = bucket_key
+        if "X-RateLimit-Limit" in headers:
+            self.get_bucket(route).update(int(headers["X-RateLimit-Limit"]), int(headers["X-RateLimit-Remaining"]),
+                                          float(headers.get("X-RateLimit-Reset-After", 0)))
+        if status == 429:
+            bucket = self.get_bucket(route)
+            retry_after = float(headers.get("Retry-After", headers.get("X-RateLimit-Reset-After", 1)))
+            bucket.update(bucket.limit or 1, 0, retry_after)
+            logger.warning(f"🚦 Rate limited on {route[0]} ({route[1]}), retry after {retry_after:.2f}s")
+
+    async def _on_request_end(self, session, trace_config_ctx, params):
+        """aiohttp trace callback: every response of the bot's HTTP client passes here."""
+        self.learn(current_route.get(), params.response.headers, params.response.status)
 
-    async def request_handler(self, request_method, args, kwargs, current_sec, requests_this_second, future):
+    def refill_global(self):
+        now = time.monotonic()
+        self.global_tokens = min(self.max_requests_per_second, self.global_tokens + (now - self.global_updated) * self.max_requests_per_second)
+        self.global_updated = now
+        return now
+
+    def global_delay(self, due):
+        """Estimated seconds until a request due at `due` gets a global token (requests due earlier get theirs first)."""
+        now = self.refill_global()
+        ahead = sum(1 for entry in self.global_waiters if entry[0] <= due)
+        ahead += sum(1 for pending in self.routes.values() for request in pending if request[0] <= due)
+        return max(0.0, self.global_blocked_until - now) + max(0.0, (ahead + 1 - self.global_tokens) / self.max_requests_per_second)
+
+    def estimated_delay(self, route, due):
+        """Estimated seconds until a request of `route` due at `due` can be sent (route bucket and global bucket)."""
+        bucket = self.get_bucket(route)
+        delay = bucket.delay()
+        if bucket.limit is not None:
+            ahead = sum(1 for request in self.routes.get(route, ()) if request[0] <= due)
+            if ahead >= bucket.remaining:
+                delay = max(delay, bucket.reset_at - time.monotonic())
+        return max(delay, self.global_delay(due))
+
+    def leave_global(self, entry):
+        self.global_waiters.remove(entry)
+        heapq.heapify(self.global_waiters)
+        if self.global_waiters:
+            self.global_waiters[0][2].set()
+
+    async def acquire_global(self, due, hard_deadline=None):
+        """
+        Takes a token of the global bucket, earliest deadline first. Waits if it is empty or a global 429 is active.
+
+        :return: False (no token taken) as soon as the token can't be had before `hard_deadline`.
+        """
+        entry = (due, next(self.sequence), asyncio.Event())
+        heapq.heappush(self.global_waiters, entry)
+        if self.global_waiters[0] is entry:
+            entry[2].set()
         try:
-            if request_method == print:
-                result = f"Processing request: {args}, {round(time.time()%10,2)}, {round(current_sec%10,3)}, {requests_this_second}"
-                logger.debug(result)
+            return await self.wait_global(entry, hard_deadline)
+        except asyncio.CancelledError:
+            if entry in self.global_waiters:
+                self.leave_global(entry)
+            raise
+
+    async def wait_global(self, entry, hard_deadline):
+        while True:
+            try:
+                # only the waiter with the earliest deadline competes for the tokens
+                await asyncio.wait_for(entry[2].wait(), hard_deadline - time.monotonic() if hard_deadline is not None else None)
+            except asyncio.TimeoutError:
+                self.leave_global(entry)
+                return False
+            now = self.refill_global()
+            if self.global_waiters[0] is not entry:
+                entry[2].clear()  # an earlier deadline arrived in the meantime
+                continue
+            if now < self.global_blocked_until:
+                wait = self.global_blocked_until - now
+            elif self.global_tokens >= 1:
+                self.global_tokens -= 1
+                self.leave_global(entry)
+                return True
             else:
-                result = f"🚦 Processing request: {request_method.__name__}, {kwargs['content'] if 'content' in kwargs else ''}, {round(time.time()%10,2)}, {round(current_sec%10,3)}, {requests_this_second}"
-                logger.debug(result)
-                response = await request_method(*args, **kwargs)
-                future.set_result(response)  # Setze das Future-Ergebnis
+                wait = (1 - self.global_tokens) / self.max_requests_per_second
+            if hard_deadline is not None and now + wait > hard_deadline:
+                self.leave_global(entry)
+                return False
+            await asyncio.sleep(wait)
+
+    async def request_handler(self, request_method, args, kwargs, route, future):
+        current_route.set(route)  # before execute() creates the request's task, which copies the context
+        logger.debug(f"🚦 Processing request: {request_method.__name__}, {kwargs['content'] if 'content' in kwargs else ''}, {round(time.time()%10,2)}, {route}")
+        await self.execute(future, lambda: self.send(request_method, args, kwargs, route), request_method.__name__)
 
+    async def send(self, request_method, args, kwargs, route):
+        try:
+            response = request_method(*args, **kwargs)
+            return await response if inspect.isawaitable(response) else response  # plain functions (e.g. print) return directly
         except Exception as e:
-            future.set_exception(e)
+            retry_after = getattr(e, "retry_after", None)  # discord.RateLimited (retry_after above max_ratelimit_timeout)
+            if retry_after is not None:
+                self.get_bucket(route).update(self.get_bucket(route).limit or 1, 0, retry_after)
+            raise
+
+    def take(self, request):
+        """Removes a request from the coalescing table when it leaves the queue (sent or rejected)."""
+        coalesce_key = request[7]
+        if coalesce_key is not None and self.coalescing.get(coalesce_key) is request:
+            del self.coalescing[coalesce_key]
+        return request
+
+    def reject(self, request, reason):
+        due, _, hard_deadline, lane, enqueued_at, (request_method, args, kwargs), future, coalesce_key = self.take(request)
+        self.rejected[lane] += 1
+        logger.warning(f"⌛ Rejected {request_method.__name__} ({lane}): {reason}")
+        if not future.done():
+            future.set_exception(DeadlineExceeded(f"{request_method.__name__} can't be sent before its deadline ({reason})"))
 
+    async def drain_route(self, route):
+        """Sends the pending requests of one route (earliest deadline first), throttled by the route's bucket and the global bucket."""
+        pending = self.routes[route]
+        while pending:
+            bucket = self.get_bucket(route)
+            delay = bucket.delay()
+            hard_deadline = pending[0][2]
+            if hard_deadline is not None and time.monotonic() + delay > hard_deadline:
+                self.reject(heapq.heappop(pending), f"route busy for {delay:.2f}s")
+                continue
+            if delay > 0:
+                logger.debug(f"🚦 Route {route} saturated, waiting {delay:.2f}s")
+                await asyncio.sleep(min(delay, hard_deadline - time.monotonic()) if hard_deadline is not None else delay)
+                continue
+
+            request = heapq.heappop(pending)
+            due, _, hard_deadline, lane, enqueued_at, call, future, coalesce_key = request
+            if future.done():  # cancelled by its caller (or timed out) while it was queued
+                self.take(request)
+                continue
+            if hard_deadline is not None and time.monotonic() + self.global_delay(due) > hard_deadline:
+                self.reject(request, "global rate limit")  # don't queue up for a token it can't use in time
+                continue
+            if not await self.acquire_global(due, hard_deadline):
+                self.reject(request, "global rate limit")
+                continue
+            now = time.monotonic()
+            request_method, args, kwargs = self.take(request)[5]  # from now on newer calls with the same key queue up again
+
+            self.lane_waits[lane][bisect.bisect_left(WAIT_HISTOGRAM_BOUNDS, now - enqueued_at)] += 1
+            bucket = self.get_bucket(route)
+            bucket.remaining -= 1
+            if bucket.limit is None:
+                # Limit not learned yet: one request at a time on this route until the first response tells us
+                await self.request_handler(request_method, args, kwargs, route, future)
+            else:
+                self.spawn(self.request_handler(request_method, args, kwargs, route, future))
+        del self.routes[route]
 
     async def worker(self):
         while True:
-            request_method, args, kwargs, future = await self.queue.get()  # Future mit aus der Queue holen
-            async with self.lock:
-                now = int(time.time())
-                if now != self.current_second:
-                        self.current_second = now
-                        self.requests_this_second = 0
-                        
-                if self.requests_this_second >= self.max_requests_per_second:
-                        await asyncio.sleep(1 - (time.time() % 1))
-                        self.current_second = int(time.time())
-                        self.requests_this_second = 0
-                self.requests_this_second += 1
-
-            # Erstelle Task und setze das Future-Ergebnis
-            asyncio.create_task(self.request_handler(request_method, args, kwargs, self.current_second, self.requests_this_second, future))
-            await asyncio.sleep(1 / self.max_requests_per_second) 
+            request = await self.queue.get()  # Future mit aus der Queue holen
+            route = route_key(request[5][0])
+            if route in self.routes:
+                heapq.heappush(self.routes[route], request)
+            else:
+                self.routes[route] = [request]
+                self.spawn(self.drain_route(route))
             self.queue.task_done()
-            logger.debug(f"Rate Limit Queue items: {self.queue.qsize()}")
+            logger.debug(f"Rate Limit Queue items: {self.queue.qsize()}, active routes: {len(self.routes)}")
+
+    async def start_workers(self):
+        if not self.mark_started():
+            return
+        self.spawn(self.worker())
+        logger.info(f"✅ Started {self.name} worker (max. {self.max_requests_per_second} requests/s)")
+
+    def get_stats(self):
+        """Returns the pending requests, the throttled routes and per lane the wait time histogram and rejections."""
+        labels = [f"<={bound}s" for bound in WAIT_HISTOGRAM_BOUNDS[:-1]] + [f">{WAIT_HISTOGRAM_BOUNDS[-2]}s"]
+        return {
+            "pending_requests": self.pending(),
+            "capacity": self.capacity,
+            **self.overflow_counts,
+            "active_routes": len(self.routes),
+            "throttled_routes": [route for route in self.routes if self.get_bucket(route).delay() > 0],
+            "lane_waits": {lane: dict(zip(labels, counts)) for lane, counts in self.lane_waits.items()},
+            "rejected": self.rejected,
+            "coalesced": self.coalesced,
+            **self.get_task_stats()
+        }
 
 
 
@@ -81,59 +873,300 @@ class RateLimitQueue:
 
 # DATABASE QUEUE
 
-class BaseDBQueue:
+class BaseDBQueue(TaskExecutor):
     """
     Queue system for handling DB writes efficiently.
     This ensures that DB writes happen asynchronously without blocking the main event loop.
     It is mainly used to send user data to the database.
+    The queue is bounded (`capacity`), a full queue applies the `overflow` policy (see AdmissionQueue).
+    With a `journal` (see journal.py) journaled tasks are confirmed there once they succeeded.
     """
-    def __init__(self, name, max_workers=1):
-        self.queue = asyncio.Queue()
-        self.name = name
+    def __init__(self, name, max_workers=1, capacity=DB_QUEUE_CAPACITY, overflow=DB_QUEUE_OVERFLOW, journal=None):
+        super().__init__(name)
+        self.queue = AdmissionQueue(name, capacity, overflow)
         self.max_workers = max_workers
+        self.journal = journal
         self.lock = asyncio.Lock()  # Not really needed for PG, but keeping it for uniformity
         logger.debug(f"{self.name} Queue items: {self.queue.qsize()}")
         
-    async def add_task(self, func, *args, **kwargs):
-        """Add a database write operation to the queue."""
-        future = asyncio.get_event_loop().create_future()
-        await self.queue.put((func, args, kwargs, future))
-        logger.debug(f"Added task to {self.name} queue args: {args}")
-        return await future  # Waits for the result
+    async def add_task(self, func, *args, timeout=None, **kwargs):
+        """Add a database write operation to the queue (`timeout`: seconds until the task is cancelled)."""
+        future = self.submit_future(timeout)
+        self.admit((func, args, kwargs, future, None))
+        logger.debug(f"Added task to {self.name} queue args: {describe_args(args)}")
+        return await self.wait_result(future)  # Waits for the result
 
+    def admit(self, item):
+        try:
+            self.queue.admit(item)
+        except QueueOverflow:
+            self.withdraw(item[3])
+            raise
 
     async def worker(self):
         """Worker function that continuously processes tasks from the queue."""
         while True:
-            func, args, kwargs, future = await self.queue.get()
+            func, args, kwargs, future, journal_seq = await self.queue.get()
             try:
-                logger.debug(f"{self.name}🚦 Processing request: {func.__name__}, args: {args}")
-                response = await func(*args, **kwargs)  # Execute DB save
-                future.set_result(response)  # Set the result
-                logger.info(f"✅ Successfully saved to {self.name}: {args}")
-            except Exception as e:
-                logger.error(f"❌ Error processing {self.name} task: {e}")
-                future.set_exception(e)
+                logger.debug(f"{self.name}🚦 Processing request: {func.__name__}, args: {describe_args(args)}")
+                if await self.execute(future, lambda: self.run(func, args, kwargs), func.__name__) is not None:  # Execute DB save
+                    if journal_seq is not None:
+                        self.journal.ack([journal_seq])
+                    logger.info(f"✅ Successfully saved to {self.name}: {describe_args(args)}")
+                # a failed (or cancelled) journaled task stays in the journal and is replayed on the next start
             finally:
                 self.queue.task_done()
                 logger.debug(f"{self.name} queue task done. Queue items: {self.queue.qsize()}")
 
+    async def run(self, func, args, kwargs):
+        return await func(*args, **kwargs)
+
+    def replay(self, records):
+        """Re-queues the unconfirmed records of the journal (called by start_workers())."""
+
+    def orphan_future(self):
+        """Future of a recovered task nobody waits for anymore: a failure is only logged."""
+        future = self.submit_future()
+
+        def log_failure(done):
+            if not done.cancelled() and done.exception() is not None:
+                logger.error(f"❌ Recovered {self.name} task failed: {done.exception()}")
+        future.add_done_callback(log_failure)
+        return future
+
     async def start_workers(self):
         """Start multiple workers for parallel processing. For now: 1 worker, hence sequential"""
+        if not self.mark_started():
+            return
+        if self.journal is not None:
+            self.replay(self.journal.open())
+            await self.journal.start(spawn=self.spawn)  # the committer is a background task of the queue, drain() stops it
+        # Tasks a crashed process spilled: journaled ones were replayed above already
+        recovered = self.queue.recover_spills(self.orphan_future, keep=lambda item: item[4] is None)
+        if recovered:
+            logger.info(f"♻️ Recovered {recovered} spilled {self.name} tasks")
         for i in range(self.max_workers):
-            asyncio.create_task(self.worker())
+            self.spawn(self.worker())
             logger.info(f"✅ Started {self.name} worker {i}")
 
+    async def drain(self, timeout=30):
+        await super().drain(timeout)
+        if self.journal is not None:
+            self.journal.close()  # whatever is not confirmed yet is replayed on the next start
+
 
 class PGQueue(BaseDBQueue):
-    """Queue system for handling PostgreSQL writes asynchronously."""
-    def __init__(self, max_workers=1):
-        super().__init__(name="PostgreSQL", max_workers=max_workers)
+    """
+    Queue system for handling PostgreSQL writes asynchronously.
+
+    Row writes (add_write) go into a write-behind buffer instead of the task queue: pending writes are collapsed per
+    key (the latest row wins) and `flush_func(rows)` writes them in one batch, `flush_interval` seconds after the
+    first pending write or as soon as `batch_size` keys are pending. A failed flush is retried, newer rows win.
+    With a `journal`, add_write() only returns once the row is journaled, and the journal is confirmed per flush.
+    """
+    def __init__(self, max_workers=1, flush_func=None, flush_interval=PG_FLUSH_INTERVAL, batch_size=PG_FLUSH_BATCH_SIZE, **kwargs):
+        super().__init__(name="PostgreSQL", max_workers=max_workers, **kwargs)
+        self.flush_func = flush_func
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.buffer = {}  # key -> (row, futures of the callers waiting for it, journal sequence numbers)
+        self.flushing = {}  # the batch flush_func is writing right now
+        self.first_buffered_at = None
+        self.buffered_event = asyncio.Event()  # set while rows are pending
+        self.batch_full_event = asyncio.Event()  # set when batch_size rows are pending
+        self.failures = 0
+        self.flush_stats = {"writes": 0, "rows_flushed": 0, "flushes": 0, "failed_flushes": 0, "max_flush_size": 0}
+        self.flush_latencies = deque(maxlen=200)  # seconds of the last flushes
+
+    async def add_write(self, key, row):
+        """
+        Buffers a row write (write-behind). A pending row with the same key is replaced.
+
+        :param key: Primary key of the row (e.g. discord_id).
+        :param row: The complete row, in the form flush_func expects it.
+        :return: Future that resolves when the row (or a newer one of the same key) is written.
+        """
+        if self.closing:
+            raise QueueClosed(f"{self.name} queue is shutting down")
+        seqs = [await self.journal.append((key, row))] if self.journal is not None else []
+        future = asyncio.get_event_loop().create_future()
+        self.buffer_row(key, row, [future], seqs)
+        return future
+
+    def buffer_row(self, key, row, futures, seqs):
+        _, buffered_futures, buffered_seqs = self.buffer.get(key, (None, [], []))
+        self.buffer[key] = (row, buffered_futures + futures, buffered_seqs + seqs)
+        self.flush_stats["writes"] += 1
+        if self.first_buffered_at is None:
+            self.first_buffered_at = time.monotonic()
+            self.buffered_event.set()
+        if len(self.buffer) >= self.batch_size:
+            self.batch_full_event.set()
+
+    def replay(self, records):
+        for seq, (key, row) in records:
+            self.buffer_row(key, row, [], [seq])
+
+    def is_pending(self, key):
+        """True while a row of `key` is buffered or being written (PostgreSQL doesn't have it yet)."""
+        return key in self.buffer or key in self.flushing
+
+    async def flush(self):
+        """Writes all pending rows in one batch (called by flusher(), can be awaited directly e.g. on shutdown)."""
+        if not self.buffer:
+            return
+        batch, self.buffer = self.buffer, {}
+        self.first_buffered_at = None
+        self.buffered_event.clear()
+        self.batch_full_event.clear()
+
+        start_time = time.monotonic()
+        self.flushing = batch
+        try:
+            await self.flush_func([row for row, _, _ in batch.values()])
+        except Exception as e:
+            self.flushing = {}
+            self.failures += 1
+            self.flush_stats["failed_flushes"] += 1
+            logger.error(f"❌ {self.name} flush of {len(batch)} rows failed (attempt {self.failures}): {e}")
+            for key, (row, futures, seqs) in batch.items():  # put them back, unless a newer row arrived meanwhile
+                newer_row, newer_futures, newer_seqs = self.buffer.get(key, (row, [], []))
+                self.buffer[key] = (newer_row, futures + newer_futures, seqs + newer_seqs)
+            if self.first_buffered_at is None:
+                self.first_buffered_at = time.monotonic()
+            self.buffered_event.set()
+            await asyncio.sleep(min(30, 2 ** self.failures))  # back off, then the next window retries
+            return
+
+        self.flushing = {}
+        self.failures = 0
+        latency = time.monotonic() - start_time
+        self.flush_latencies.append(latency)
+        self.flush_stats["flushes"] += 1
+        self.flush_stats["rows_flushed"] += len(batch)
+        self.flush_stats["max_flush_size"] = max(self.flush_stats["max_flush_size"], len(batch))
+        if self.journal is not None:
+            self.journal.ack([seq for _, _, seqs in batch.values() for seq in seqs])
+        for _, futures, _ in batch.values():
+            for future in futures:
+                if not future.done():
+                    future.set_result(None)
+        logger.debug(f"✅ {self.name} flushed {len(batch)} rows in {latency:.3f}s")
+
+    async def flusher(self):
+        """Flushes the buffer when the time window ends or the batch is full."""
+        while True:
+            await self.buffered_event.wait()
+            remaining = self.first_buffered_at + self.flush_interval - time.monotonic()
+            if remaining > 0 and len(self.buffer) < self.batch_size:
+                try:
+                    await asyncio.wait_for(self.batch_full_event.wait(), remaining)
+                except asyncio.TimeoutError:
+                    pass
+            await self.flush()
+
+    async def start_workers(self):
+        if self.started:
+            return
+        await super().start_workers()
+        if self.flush_func is not None:
+            self.spawn(self.flusher())
+            logger.info(f"✅ Started {self.name} write-behind flusher ({self.flush_interval}s / {self.batch_size} rows)")
+
+    async def drain(self, timeout=30):
+        """Flushes the pending rows before the queue stops (rows that can't be written stay journaled)."""
+        self.closing = True
+        if self.buffer:
+            await self.flush()
+        await super().drain(timeout)
+
+    def get_stats(self):
+        """Flush sizes, latencies and the collapse ratio (buffered writes per written row) of the write-behind buffer."""
+        latencies = sorted(self.flush_latencies)
+        flushes = self.flush_stats["flushes"]
+        return {
+            **self.flush_stats,
+            "pending_rows": len(self.buffer),
+            "avg_flush_size": self.flush_stats["rows_flushed"] / flushes if flushes else 0.0,
+            "collapse_ratio": (self.flush_stats["writes"] - len(self.buffer)) / self.flush_stats["rows_flushed"] if self.flush_stats["rows_flushed"] else 1.0,
+            "flush_latency_p50": latencies[len(latencies) // 2] if latencies else 0.0,
+            "flush_latency_p95": latencies[int(len(latencies) * 0.95)] if latencies else 0.0,
+            **{f"tasks_{key}": value for key, value in self.get_task_stats().items()},
+            **({f"journal_{key}": value for key, value in self.journal.get_stats().items()} if self.journal is not None else {})
+        }
 
 class ObjectStorageQueue(BaseDBQueue):
-    """Queue system for handling object storage uploads asynchronously."""
-    def __init__(self, max_workers=1):
-        super().__init__(name="Object Storage", max_workers=max_workers)
+    """
+    Queue system for handling object storage uploads asynchronously, `max_workers` uploads run concurrently.
+    A failed upload is retried up to `max_attempts` times with exponential backoff and full jitter (a random sleep
+    up to backoff_base * 2^attempt seconds), so a hiccup of the bucket doesn't make all workers retry in lockstep.
+    add_upload() journals the data first (with a `journal`), so an upload that never succeeded is retried on the next start.
+    """
+    def __init__(self, max_workers=1, upload_func=None, max_attempts=UPLOAD_MAX_ATTEMPTS, backoff_base=UPLOAD_BACKOFF_BASE,
+                 backoff_max=UPLOAD_BACKOFF_MAX, **kwargs):
+        super().__init__(name="Object Storage", max_workers=max_workers, **kwargs)
+        self.upload_func = upload_func  # async upload_func(data, name), raises if the upload failed
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.upload_stats = {"uploads": 0, "failed_uploads": 0, "retries": 0, "bytes_uploaded": 0}
+        self.upload_latencies = deque(maxlen=200)  # seconds of the last uploads, retries included
+
+    def backoff(self, attempt):
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    async def run(self, func, args, kwargs):
+        """Runs a task (upload) with retries, raises the last error once all attempts failed."""
+        start_time = time.monotonic()
+        for attempt in range(self.max_attempts):
+            try:
+                response = await func(*args, **kwargs)
+                break
+            except Exception as e:
+                if attempt + 1 == self.max_attempts:
+                    self.upload_stats["failed_uploads"] += 1
+                    raise
+                delay = self.backoff(attempt)
+                self.upload_stats["retries"] += 1
+                logger.warning(f"🔁 {self.name} task failed (attempt {attempt + 1}/{self.max_attempts}): {e}, retrying in {delay:.2f}s")
+                await asyncio.sleep(delay)
+        self.upload_latencies.append(time.monotonic() - start_time)
+        self.upload_stats["uploads"] += 1
+        self.upload_stats["bytes_uploaded"] += sum(len(arg) for arg in args if isinstance(arg, (bytes, bytearray)))
+        return response
+
+    def get_stats(self):
+        """Upload counts, retries, uploaded bytes and latencies."""
+        latencies = sorted(self.upload_latencies)
+        return {
+            **self.upload_stats,
+            "workers": self.max_workers,
+            "pending": self.queue.pending(),
+            "upload_latency_p50": latencies[len(latencies) // 2] if latencies else 0.0,
+            "upload_latency_p95": latencies[int(len(latencies) * 0.95)] if latencies else 0.0,
+            **{f"tasks_{key}": value for key, value in self.get_task_stats().items()},
+            **({f"journal_{key}": value for key, value in self.journal.get_stats().items()} if self.journal is not None else {})
+        }
+
+    async def add_upload(self, name, data):
+        """
+        Queues an upload of in-memory data.
+
+        :return: Future that resolves when the upload is done (the data is journaled when add_upload() returns).
+        """
+        future = self.submit_future()
+        try:
+            seq = await self.journal.append((name, data)) if self.journal is not None else None
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        self.admit((self.upload_func, (data, name), {}, future, seq))
+        logger.debug(f"Added upload of {name} ({len(data)} bytes) to {self.name} queue")
+        return future
+
+    def replay(self, records):
+        for seq, (name, data) in records:
+            self.admit((self.upload_func, (data, name), {}, self.submit_future(), seq))
 
 # --- END OF DATABASE QUEUE ---
 
@@ -141,54 +1174,223 @@ class ObjectStorageQueue(BaseDBQueue):
 
 # --- Queue for CPU Intensive Tasks
 
-class CpuIntensiveQueue:
+class CpuIntensiveQueue(TaskExecutor):
     """
     Queue system for handling CPU-intensive tasks asynchronously.
     It prevents CPU overload by limiting the number of concurrent CPU-heavy tasks.
+    Synchronous funcs run in `executor` (e.g. the OcrEngine process pool), coroutine funcs are awaited directly.
+
+    The number of concurrent tasks adapts between `min_workers` and `max_workers` (AIMD): it grows by one while tasks
+    are waiting, the CPU has headroom and the service time stays close to its unloaded baseline, and it is cut by
+    a quarter when memory runs low or the CPU is saturated and tasks get slower. With min_workers == max_workers it is fixed.
+
+    The queue is bounded (`capacity`, `overflow` policy, see AdmissionQueue). estimate_admission() tells a caller its
+    position and expected wait before it submits, position_of() where a submitted task is.
+
+    Tasks with a `user_id` are served round-robin across users (FairAdmissionQueue), so a user with twenty queued
+    screenshots doesn't delay everyone else. Every user has a token bucket (USER_TASKS_PER_MINUTE, bursts of
+    USER_TASK_BURST) and can replace their own queued tasks with a newer one.
     """
 
-    def __init__(self, max_workers=2):
-        self.queue = asyncio.Queue()
-        self.max_workers = max_workers  # Limit parallel CPU-heavy tasks
-        self.semaphore = asyncio.Semaphore(max_workers)  # Controls concurrency
+    def __init__(self, max_workers=2, executor=None, min_workers=1, capacity=CPU_QUEUE_CAPACITY, overflow=CPU_QUEUE_OVERFLOW):
+        super().__init__("CPU")
+        self.queue = FairAdmissionQueue("CPU", capacity, overflow)
+        self.user_buckets = {}  # user_id -> (tokens, time.time() of the last update)
+        self.superseded = 0
+        self.max_workers = max_workers  # Upper bound of parallel CPU-heavy tasks (one worker task each)
+        self.min_workers = min(min_workers, max_workers)
+        self.executor = executor  # None = default thread pool of the event loop
+        self.limit = self.min_workers  # current number of tasks allowed to run concurrently
+        self.in_flight = 0  # tasks running right now
+        self.reserved = 0  # slots taken by workers (running a task or waiting for the next one), reserved <= limit
+        self.slots = asyncio.Condition()  # Controls concurrency (reserved <= limit)
+        self.avg_wait_time = 0.0  # moving average of the time tasks waited before they started
+        self.avg_service_time = None  # moving average of the run time of a task
+        self.baseline_service_time = None  # (slowly rising) minimum run time = run time without contention
+        self.cpu_percent = 0.0
+        self.memory_available_mb = 0.0
         logger.debug(f"CpuIntensiveQueue initialized. Queue size: {self.queue.qsize()}")
 
-    async def add_task(self, func, *args, **kwargs):
-        """Add a CPU-heavy task to the queue."""
-        future = asyncio.get_event_loop().create_future()
-        await self.queue.put((func, args, kwargs, future))
-        logger.debug(f"🖥️ Added CPU task: {func.__name__}, args: {args}")
-        return await future  # Waits for the result
+    async def add_task(self, func, *args, user_id=None, replace=False, timeout=None, **kwargs):
+        """
+        Add a CPU-heavy task to the queue.
+
+        :param user_id: Owner of the task (Discord user ID) for fair scheduling and the per-user rate limit.
+        :param replace: Replace the user's queued (not yet running) tasks, their callers get TaskSuperseded.
+        :param timeout: Seconds until the task is cancelled (queued or running), the caller gets DeadlineExceeded.
+        :return: The result of func. Raises UserRateLimited, QueueOverflow (queue full), TaskSuperseded or DeadlineExceeded.
+        """
+        if user_id is not None:
+            self.check_user_token(user_id)
+            if replace:
+                for item in self.queue.remove_owner(user_id):
+                    if not item[3].done():  # a queued task may have timed out or been cancelled already
+                        self.superseded += 1
+                        item[3].set_exception(TaskSuperseded(f"Replaced by a newer task of user {user_id}"))
+        future = self.submit_future(timeout)
+        try:
+            self.queue.admit((func, args, kwargs, future, time.time(), user_id))  # raises QueueOverflow if full (policy "reject")
+        except QueueOverflow:
+            self.withdraw(future)
+            raise
+        if user_id is not None:
+            self.user_retry_after(user_id, take=True)  # only an admitted task uses up the user's token
+        logger.debug(f"🖥️ Added CPU task: {func.__name__}, args: {describe_args(args)}")
+        return await self.wait_result(future)  # Waits for the result
+
+    def user_retry_after(self, user_id, take=False):
+        """Seconds until the user's token bucket allows the next task (0 = now). With `take` a token is used up."""
+        now = time.time()
+        tokens, updated = self.user_buckets.get(user_id, (USER_TASK_BURST, now))
+        tokens = min(USER_TASK_BURST, tokens + (now - updated) * USER_TASKS_PER_MINUTE / 60)
+        if tokens < 1:
+            return (1 - tokens) * 60 / USER_TASKS_PER_MINUTE
+        if take:
+            self.user_buckets[user_id] = (tokens - 1, now)
+            if len(self.user_buckets) > 10000:  # forget users whose bucket is full again
+                refill_time = USER_TASK_BURST * 60 / USER_TASKS_PER_MINUTE
+                self.user_buckets = {key: value for key, value in self.user_buckets.items() if now - value[1] < refill_time}
+        return 0.0
+
+    def check_user_token(self, user_id):
+        """Raises UserRateLimited if the user's bucket has no token (nothing is used up yet)."""
+        retry_after = self.user_retry_after(user_id)
+        if retry_after:
+            raise UserRateLimited(f"User {user_id} submits too many tasks", retry_after)
+
+    def estimate_wait(self, position):
+        """
+        Expected seconds until the task at `position` (1-based) is done, from the moving average of the service time.
+
+        :return: Seconds, or None as long as no task was measured.
+        """
+        if self.avg_service_time is None:
+            return None
+        # Tasks ahead of it (running ones are about half done) are processed `limit` at a time, then its own run
+        return ((position - 1 + self.in_flight / 2) / self.limit + 1) * self.avg_service_time
+
+    def estimate_admission(self, user_id=None, replace=False):
+        """
+        Position and expected wait a task submitted now would get (nothing is queued or used up).
+
+        :param user_id: Owner of the task (round-robin position and rate limit), None = not fair-scheduled.
+        :param replace: The task would replace the user's queued tasks.
+        :return: Dictionary with `position`, `eta` (seconds or None), `retry_after` (rate limit, 0 = ok) and
+                 `admitted` (False if the queue or the rate limit would reject it).
+        """
+        position = self.queue.position_for(user_id, replace=replace and user_id is not None)
+        retry_after = self.user_retry_after(user_id) if user_id is not None else 0.0
+        queue_full = self.queue.capacity and self.queue.pending() >= self.queue.capacity and self.queue.overflow == "reject"
+        return {"position": position, "eta": self.estimate_wait(position), "retry_after": retry_after,
+                "admitted": not queue_full and not retry_after}
+
+    def position_of(self, future):
+        """Position and expected wait of a submitted task (None once it runs)."""
+        position = self.queue.position_of(future)
+        return None if position is None else {"position": position, "eta": self.estimate_wait(position)}
+
+    def get_load(self):
+        """Returns the current backlog (queued tasks, wait of the oldest one, average wait) and the concurrency controller state."""
+        oldest = self.queue.peek()
+        return {
+            "queue_depth": self.queue.pending(),
+            "oldest_wait": time.time() - oldest[4] if oldest else 0.0,
+            "avg_wait_time": self.avg_wait_time,
+            "concurrency_limit": self.limit,
+            "in_flight": self.in_flight,
+            "avg_service_time": self.avg_service_time,
+            "cpu_percent": self.cpu_percent,
+            "memory_available_mb": round(self.memory_available_mb),
+            **{f"queue_{key}": value for key, value in self.queue.get_stats().items() if key != "pending"},
+            "queued_users": self.queue.owners(),
+            "superseded": self.superseded,
+            **{f"tasks_{key}": value for key, value in self.get_task_stats().items()}
+        }
+
+    def record_service_time(self, service_time):
+        if self.avg_service_time is None:
+            self.avg_service_time = self.baseline_service_time = service_time
+        self.avg_service_time = 0.8 * self.avg_service_time + 0.2 * service_time
+        # Minimum with slow decay upwards, so the baseline follows a changed image mix
+        self.baseline_service_time = min(self.baseline_service_time * 1.01, service_time)
+
+    async def set_limit(self, limit):
+        async with self.slots:
+            self.limit = limit
+            self.slots.notify_all()
+
+    async def controller(self):
+        """Adjusts the concurrency limit every OCR_CONTROL_INTERVAL seconds (additive increase, multiplicative decrease)."""
+        psutil.cpu_percent()  # first call only starts the measurement
+        while True:
+            await asyncio.sleep(OCR_CONTROL_INTERVAL)
+            self.cpu_percent = psutil.cpu_percent()
+            self.memory_available_mb = psutil.virtual_memory().available / 2**20
+            backlog = self.queue.qsize() > 0
+            slowdown = self.avg_service_time / self.baseline_service_time if self.avg_service_time else 1.0
+
+            limit = self.limit
+            if self.memory_available_mb < OCR_MIN_FREE_MEMORY_MB or (self.cpu_percent >= OCR_CPU_HIGH_PERCENT and slowdown > 2):
+                limit = max(self.min_workers, int(self.limit * 0.75))
+            elif backlog and self.in_flight >= self.limit and self.cpu_percent < OCR_CPU_HIGH_PERCENT and slowdown < 1.5:
+                limit = min(self.max_workers, self.limit + 1)
+
+            logger.debug(f"⚙️ CPU Usage: {self.cpu_percent}%, free memory: {self.memory_available_mb:.0f} MB, slowdown: {slowdown:.2f}, concurrency: {self.limit}")
+            if limit != self.limit:
+                logger.info(f"⚙️ CPU task concurrency {self.limit} -> {limit} (CPU {self.cpu_percent}%, free memory {self.memory_available_mb:.0f} MB, "
+                            f"service time x{slowdown:.2f}, wait {self.avg_wait_time:.2f}s)")
+                await self.set_limit(limit)
 
     async def worker(self):
-        """Worker function that processes CPU-heavy tasks."""
+        """
+        Worker function that processes CPU-heavy tasks. A worker takes a slot (at most `limit`) before it dequeues,
+        so idle workers above the limit leave the tasks in the fair queue (round-robin, replace, positions).
+        """
         while True:
-            cpu_usage = psutil.cpu_percent()  # Get current CPU usage
-            logger.info(f"⚙️ CPU Usage: {cpu_usage}%")
-            func, args, kwargs, future = await self.queue.get()
-            async with self.semaphore:  # Limits concurrent CPU-heavy tasks
+            async with self.slots:  # Limits concurrent CPU-heavy tasks
+                await self.slots.wait_for(lambda: self.reserved < self.limit)
+                self.reserved += 1
+            try:
+                func, args, kwargs, future, enqueued_at, user_id = await self.queue.get()
                 try:
-                    logger.debug(f"🖥️ Processing CPU task: {func.__name__}, args: {args}")
-                    start_time = time.time()
-
-                    # Run CPU-heavy task in an executor to avoid blocking the event loop
-                    loop = asyncio.get_running_loop()
-                    response = await loop.run_in_executor(None, func, *args, **kwargs)
-
-                    future.set_result(response)  # Return result
-                    logger.info(f"✅ CPU task {func.__name__} completed in {time.time() - start_time:.2f}s")
-                except Exception as e:
-                    logger.error(f"❌ Error processing CPU task: {e}")
-                    future.set_exception(e)
+                    if future.done():  # cancelled by its caller (or timed out) while it was queued
+                        continue
+                    self.in_flight += 1
+                    try:
+                        logger.debug(f"🖥️ Processing CPU task: {func.__name__}, args: {describe_args(args)}")
+                        self.avg_wait_time = 0.8 * self.avg_wait_time + 0.2 * (time.time() - enqueued_at)
+
+                        if asyncio.iscoroutinefunction(func):
+                            call = functools.partial(func, *args, **kwargs)
+                        else:
+                            # Run CPU-heavy task in an executor to avoid blocking the event loop
+                            call = functools.partial(asyncio.get_running_loop().run_in_executor, self.executor, functools.partial(func, *args, **kwargs))
+
+                        service_time = await self.execute(future, call, func.__name__)
+                        if service_time is not None:
+                            self.record_service_time(service_time)
+                            logger.info(f"✅ CPU task {func.__name__} completed in {service_time:.2f}s")
+                    finally:
+                        self.in_flight -= 1
                 finally:
                     self.queue.task_done()
                     logger.debug(f"CpuIntensiveQueue task done. Remaining: {self.queue.qsize()}")
+            finally:
+                async with self.slots:
+                    self.reserved -= 1
+                    self.slots.notify_all()
 
     async def start_workers(self):
-        """Starts multiple workers for parallel CPU processing (limited by max_workers)."""
+        """Starts the workers (max_workers, at most `limit` of them run a task at the same time) and the concurrency controller."""
+        if not self.mark_started():
+            return
+        self.queue.recover_spills(self.submit_future, keep=lambda item: False)  # nobody waits for the results of a crashed process's proofs
         for i in range(self.max_workers):
-            asyncio.create_task(self.worker())
+            self.spawn(self.worker())
             logger.info(f"✅ Started CpuIntensiveQueue worker {i}")
+        if self.min_workers < self.max_workers:
+            self.spawn(self.controller())
+            logger.info(f"✅ Started CpuIntensiveQueue concurrency controller ({self.min_workers}-{self.max_workers})")
 
 # --- END OF CPU Intensive Queue ---
 
@@ -0,0 +1,102 @@
+import os
+import sys
+import json
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from config import LOGGING_LEVEL, RESTORE_BATCH_SIZE, RESTORE_OVERLAP_SECONDS
+
+
+# ✅ Setup logging configuration
+logging.basicConfig(
+    level=LOGGING_LEVEL,  # Capture ALL logs (INFO, DEBUG, ERROR)
+    format="%(asctime)s [%(levelname)s] %(message)s",
+    handlers=[
+        logging.StreamHandler(sys.stdout)  # Ensure logs are printed to Replit console
+    ]
+)
+logger = logging.getLogger(__name__)  # ✅ Use logger instead of print()
+
+
+# RESTORE
+# Catch-up of the local user store with PostgreSQL (db_handler.restore_filesystem_from_db()), up to the updated_at
+# high-water mark of the last restore.
+
+def read_restore_mark(path, table, backend):
+    """Returns the updated_at high-water mark of the last restore, or None if the local store has to be restored completely."""
+    try:
+        with open(path, "r", encoding="utf-8") as file:
+            mark = json.load(file)
+    except (FileNotFoundError, ValueError):
+        return None
+    if mark.get("table") != table or mark.get("backend") != backend or not mark.get("high_water"):
+        return None  # the snapshot belongs to another table or storage backend
+    return datetime.fromisoformat(mark["high_water"])
+
+
+def write_restore_mark(path, table, backend, high_water):
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as file:
+        json.dump({"table": table, "backend": backend, "high_water": high_water.isoformat() if high_water else None}, file)
+    os.replace(temp_path, path)
+
+
+async def catch_up(conn, table, mark, keep_local, save, batch_size=RESTORE_BATCH_SIZE, overlap=RESTORE_OVERLAP_SECONDS):
+    """
+    Reads the rows of `table` changed since `mark` (all rows if it is None, also the `overlap` seconds before it for
+    writes committed late) through a server-side cursor in batches, most recently updated first, and passes them to
+    save(discord_id, row). Rows of users keep_local(discord_id) is true for (local changes PostgreSQL doesn't have
+    yet) are skipped.
+
+    :param conn: asyncpg connection (anything with transaction(), fetchval() and cursor())
+    :return: (new high-water mark, restored users, skipped users)
+    """
+    restored = skipped = 0
+    async with conn.transaction(isolation="repeatable_read", readonly=True):  # one snapshot for the rows and the new mark
+        high_water = await conn.fetchval(f"SELECT max(updated_at) FROM {table}")
+        if mark is None:
+            logger.info(f"🔄 No local snapshot of {table}, restoring all users from PostgreSQL")
+            cursor = await conn.cursor(f"SELECT * FROM {table} ORDER BY updated_at DESC")
+        else:
+            logger.info(f"🔄 Catching up with {table} changes since {mark.isoformat()}")
+            cursor = await conn.cursor(f"SELECT * FROM {table} WHERE updated_at >= $1 ORDER BY updated_at DESC",
+                                       mark - timedelta(seconds=overlap))
+        while rows := await cursor.fetch(batch_size):
+            for row in rows:
+                if keep_local(row["discord_id"]):
+                    skipped += 1
+                    continue
+                save(row["discord_id"], row)
+                restored += 1
+            logger.debug(f"🔄 Restored {restored} users so far")
+            await asyncio.sleep(0)  # let the bot handle events between the batches
+    return high_water or mark, restored, skipped
+
+
+async def delete_missing(conn, table, local_ids, keep_local, delete):
+    """
+    Deletes the local users that don't exist in `table` anymore (deleted in PostgreSQL), by comparing the keys.
+
+    :param local_ids: discord_ids of the local store, taken before this is called: a user whose first write reaches
+                      PostgreSQL during the query was pending then (keep_local()) and is no candidate
+    :param keep_local: predicate of users with local changes PostgreSQL doesn't have yet (checked again before deleting)
+    :param delete: delete(discord_id) removes a user from the local store
+    :return: number of deleted users
+    """
+    candidates = {discord_id for discord_id in local_ids if not keep_local(discord_id)}
+    if not candidates:
+        return 0
+    existing = {row["discord_id"] for row in await conn.fetch(f"SELECT discord_id FROM {table}")}
+    if not existing:
+        logger.warning(f"⚠️ {table} is empty, keeping the {len(candidates)} local users (not deleting the whole snapshot)")
+        return 0
+    deleted = 0
+    for discord_id in candidates - existing:
+        if not keep_local(discord_id):
+            delete(discord_id)
+            deleted += 1
+    if deleted:
+        logger.info(f"🗑️ Deleted {deleted} local users that were deleted in {table}")
+    return deleted
+
+# --- END OF RESTORE ---
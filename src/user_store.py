@@ -0,0 +1,584 @@
+import os
+import sys
+import copy
+import json
+import fcntl
+import time
+import sqlite3
+import asyncio
+import logging
+import threading
+from config import LOGGING_LEVEL, USER_STORE_FLUSH_INTERVAL, STORAGE_BACKEND, SQLITE_FILENAME, USER_CHANGE_LOG, USER_CHANGE_LOG_MAX_BYTES
+
+
+# ✅ Setup logging configuration
+logging.basicConfig(
+    level=LOGGING_LEVEL,  # Capture ALL logs (INFO, DEBUG, ERROR)
+    format="%(asctime)s [%(levelname)s] %(message)s",
+    handlers=[
+        logging.StreamHandler(sys.stdout)  # Ensure logs are printed to Replit console
+    ]
+)
+logger = logging.getLogger(__name__)  # ✅ Use logger instead of print()
+
+
+# USER STORE
+
+def merge_entries(base, ours, theirs):
+    """
+    Three-way merge of a user entry both processes changed since `base` (the entry as this process read it): the
+    fields this process changed take its value, the others keep the other process's. Nested dicts (invite) are merged
+    field by field, lists both sides appended to (images, invited_users) get both appends.
+    """
+    base = base or {}
+    merged = dict(theirs)
+    for field, value in ours.items():
+        old, other = base.get(field), theirs.get(field)
+        if value == old or value == other:
+            continue
+        if isinstance(value, dict) and isinstance(old, dict) and isinstance(other, dict):
+            merged[field] = merge_entries(old, value, other)
+        elif isinstance(value, list) and isinstance(old, list) and isinstance(other, list) and value[:len(old)] == old and other[:len(old)] == old:
+            merged[field] = other + [item for item in value[len(old):] if item not in other[len(old):]]
+        else:
+            merged[field] = value
+    return merged
+
+
+class UserRecord(dict):
+    """A resident user entry, with the version it had in storage when it was last read or written."""
+    __slots__ = ("version",)
+
+    def __init__(self, data, version=None):
+        super().__init__(data)
+        self.version = version
+
+
+class UserStore:
+    """
+    Resident user entries of a bot process, persisted as one JSON file per user in `directory`.
+
+    get() returns a copy of the resident record (no file read), put() replaces it with a copy of the new entry and
+    marks it dirty, so a caller's unsaved changes never reach the store (or the listeners). flusher() writes the dirty
+    records every `flush_interval` seconds in one batch, in a thread. Before the flusher runs (CLI, startup), put()
+    writes through.
+
+    Both bot processes share the storage. Once started, reads are served from the resident records without touching
+    the storage: after every flush the store follows changed_since() and re-reads the records the other process wrote
+    (before start(), e.g. in the CLI, get() checks the stored version instead). A dirty record is written with the
+    version it was read at: if the other process wrote the entry since, the flush re-reads it and merges both changes
+    (merge_entries()).
+
+    The records belong to the event loop thread of start(): put() and delete() called from another thread are
+    handed over to it (call_soon_threadsafe()), get() there only reads.
+
+    Subclasses change the storage by overriding load(), stored_version(), stored_versions(), encode() and write_batch(),
+    and invited_users() / current_version() / changed_since() if the storage can answer them from an index.
+
+    Listeners (add_listener()) are called with (discord_id, record) whenever a record is put or (re)read, indexes
+    built from the entries (e.g. the leaderboard) stay up to date with them and changed_since(). Every batch write is
+    appended to a change log (`discord_id version` lines), so changed_since() only reads the lines since its last call
+    instead of stat()ing every file.
+    """
+    CHANGE_LOG_SPAN = 1 << 48  # version marks are generation * CHANGE_LOG_SPAN + offset in the change log
+
+    def __init__(self, directory, flush_interval=USER_STORE_FLUSH_INTERVAL, change_log_max_bytes=USER_CHANGE_LOG_MAX_BYTES):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.change_log = os.path.join(directory, USER_CHANGE_LOG)
+        self.change_log_max_bytes = change_log_max_bytes
+        self.records = {}  # discord_id (str) -> UserRecord
+        self.dirty = set()  # discord_ids of records that are not written yet
+        self.bases = {}  # discord_id -> record as last read/written (merge base of a dirty record), None if there was none
+        self.flusher_task = None
+        self.loop = None  # event loop of start(), owns the records
+        self.loop_thread = None
+        self.followed_version = None  # changed_since() mark of follow()
+        self.listeners = []
+        self.stats = {"hits": 0, "reads": 0, "flushes": 0, "records_flushed": 0, "merges": 0}
+        os.makedirs(directory, exist_ok=True)
+
+    # storage (one JSON file per user)
+
+    def path(self, discord_id):
+        return os.path.join(self.directory, f"{discord_id}.json")
+
+    def load(self, key):
+        """Reads a stored entry: (data, version) or None."""
+        try:
+            with open(self.path(key), "r", encoding="utf-8") as file:
+                return json.load(file), os.fstat(file.fileno()).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def stored_version(self, key):
+        try:
+            return os.stat(self.path(key)).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def stored_versions(self):
+        """{discord_id: version} of all stored entries."""
+        versions = {}
+        for filename in os.listdir(self.directory):
+            if filename.endswith(".json"):
+                version = self.stored_version(filename[:-5])
+                if version is not None:
+                    versions[filename[:-5]] = version
+        return versions
+
+    def encode(self, key, record):
+        """Serializes a record for write_batch()."""
+        return key, json.dumps(record, separators=(",", ":"))
+
+    def merge_batch(self, batch):
+        """
+        Encodes a batch of take_dirty(), merging the entries the other process wrote since they were read here.
+        Runs in write_batch() while the storage is locked, so nobody writes between the version check and the write.
+
+        :return: (encoded records, {discord_id: merged entry})
+        """
+        encoded, merged = [], {}
+        for key, record, base in batch:
+            data = record
+            if self.locked_version(key) != (base.version if base is not None else None):
+                stored = self.locked_load(key)
+                if stored is not None:
+                    data = merged[key] = merge_entries(base, record, stored[0])
+                    self.stats["merges"] += 1
+                    logger.info(f"🔀 User {key} was changed by the other process meanwhile, merged both changes")
+            encoded.append(self.encode(key, data))
+        return encoded, merged
+
+    def locked_version(self, key):
+        """stored_version() while write_batch() holds the storage lock."""
+        return self.stored_version(key)
+
+    def locked_load(self, key):
+        """load() while write_batch() holds the storage lock."""
+        return self.load(key)
+
+    def write_batch(self, batch):
+        """
+        Writes a batch of take_dirty() (runs in a thread), holding a lock file both processes write under.
+
+        :return: ({discord_id: new version}, {discord_id: merged entry})
+        """
+        with open(os.path.join(self.directory, ".lock"), "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)  # released when the file is closed
+            encoded, merged = self.merge_batch(batch)
+            versions = {}
+            for key, content in encoded:
+                path = self.path(key)
+                temp_path = f"{path}.{os.getpid()}.tmp"
+                with open(temp_path, "w", encoding="utf-8") as file:
+                    file.write(content)
+                os.replace(temp_path, path)  # atomic: the other process never reads a half written file
+                versions[key] = os.stat(path).st_mtime_ns
+            self.append_changes(versions)
+        return versions, merged
+
+    def append_changes(self, versions):
+        """Appends written entries to the change log (holding the lock). A full log is replaced by the next generation."""
+        try:
+            with open(self.change_log, "rb") as file:
+                generation, size = int(file.readline()), os.fstat(file.fileno()).st_size
+        except FileNotFoundError:
+            generation, size = 0, 0
+        if size == 0 or size >= self.change_log_max_bytes:
+            temp_path = f"{self.change_log}.{os.getpid()}.tmp"
+            with open(temp_path, "w", encoding="utf-8") as file:
+                file.write(f"{generation + 1}\n")  # header: the generation (1, 2, ...)
+            os.replace(temp_path, self.change_log)
+        with open(self.change_log, "a", encoding="utf-8") as file:
+            file.write("".join(f"{key} {version}\n" for key, version in versions.items()))
+
+    # records
+
+    def read(self, key):
+        """Reads a stored entry into the store (None if it doesn't exist)."""
+        loaded = self.load(key)
+        if loaded is None:
+            self.records.pop(key, None)
+            return None
+        self.stats["reads"] += 1
+        record = self.records[key] = UserRecord(*loaded)
+        self.notify(key, record)
+        return record
+
+    def resident(self, key, version, loader):
+        """The resident record if it is dirty or still at the stored `version`, otherwise loader() reads the stored one."""
+        record = self.records.get(key)
+        if record is not None and (key in self.dirty or record.version == version):
+            self.stats["hits"] += 1
+            return record
+        return loader()
+
+    def foreign_thread(self):
+        """True if called outside the event loop thread that owns the records."""
+        return self.loop is not None and threading.get_ident() != self.loop_thread
+
+    def lookup(self, key):
+        """The resident record of a user (read if not resident yet) or None. Not to be changed by the caller."""
+        record = self.records.get(key)
+        if record is not None and self.flusher_task is not None:
+            self.stats["hits"] += 1  # kept fresh by follow()
+            return record
+        if self.foreign_thread():
+            loaded = self.load(key)  # read without making it resident (the loop thread owns the records)
+            return UserRecord(*loaded) if loaded is not None else None
+        if record is not None and key not in self.dirty:
+            return self.resident(key, self.stored_version(key), lambda: self.read(key))
+        return self.resident(key, None, lambda: self.read(key))
+
+    def get(self, discord_id):
+        """Returns a copy of the user's entry (change it and put() it back) or None."""
+        record = self.lookup(str(discord_id))
+        return copy.deepcopy(dict(record)) if record is not None else None
+
+    def put(self, discord_id, data):
+        """Stores a copy of a user's entry as the resident record and marks it dirty."""
+        if self.foreign_thread():
+            self.loop.call_soon_threadsafe(self.put, discord_id, copy.deepcopy(dict(data)))
+            return None
+        key = str(discord_id)
+        old = self.records.get(key)
+        if key not in self.dirty:
+            self.bases[key] = old
+        record = UserRecord(copy.deepcopy(dict(data)), old.version if old is not None else None)
+        self.records[key] = record
+        self.dirty.add(key)
+        self.notify(key, record)
+        if self.flusher_task is None:
+            self.flush_now()
+        return record
+
+    def delete(self, discord_id):
+        """Removes a user's entry (resident and stored), the listeners get record None."""
+        if self.foreign_thread():
+            self.loop.call_soon_threadsafe(self.delete, discord_id)
+            return
+        key = str(discord_id)
+        self.records.pop(key, None)
+        self.dirty.discard(key)
+        self.bases.pop(key, None)
+        self.delete_stored(key)
+        self.notify(key, None)
+
+    def delete_stored(self, key):
+        with open(os.path.join(self.directory, ".lock"), "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                os.remove(self.path(key))
+            except FileNotFoundError:
+                pass
+            self.append_changes({key: 0})  # followers re-read it and find it gone
+
+    def add_listener(self, callback):
+        """Calls callback(discord_id, record) whenever a record is put or (re)read from storage."""
+        self.listeners.append(callback)
+
+    def notify(self, key, record):
+        for callback in self.listeners:
+            try:
+                callback(key, record)
+            except Exception as e:
+                logger.error(f"❌ User store listener {callback} failed for {key}: {e}")
+
+    def exists(self, discord_id):
+        return self.lookup(str(discord_id)) is not None
+
+    def iter_users(self):
+        """Yields the resident records of all users, read-only (entries that didn't change since they were read are not parsed again)."""
+        versions = self.stored_versions()
+        for key in versions.keys() | self.dirty:
+            record = self.resident(key, versions.get(key), lambda: self.read(key))
+            if record is not None:
+                yield record
+
+    # scans
+
+    def invited_users(self):
+        """Records of the users that joined with an invite (used_code and inviter_id set)."""
+        return [user for user in self.iter_users() if user.get("invite", {}).get("used_code") and user.get("invite", {}).get("inviter_id")]
+
+    def current_version(self):
+        """Version mark for changed_since(): the end of the change log (0 if nothing was written yet)."""
+        try:
+            with open(self.change_log, "rb") as file:
+                return int(file.readline()) * self.CHANGE_LOG_SPAN + os.fstat(file.fileno()).st_size
+        except FileNotFoundError:
+            return 0
+
+    def changed_since(self, version):
+        """
+        Records written since `version` (a current_version() mark), also by the other process. Records put in this
+        process reached the listeners already. Reads the change log from the mark on; a mark of another generation
+        of the log (it started over, or the mark is from another backend) returns all records. The mark 0 (no log
+        yet) continues with generation 1.
+
+        :return: (records, mark for the next call). Records may repeat across calls.
+        """
+        generation, offset = divmod(version, self.CHANGE_LOG_SPAN)
+        try:
+            with open(self.change_log, "rb") as file:
+                header = file.readline()
+                current, size = int(header), os.fstat(file.fileno()).st_size
+                if version == 0 and current == 1:
+                    generation, offset = 1, len(header)
+                if current != generation or not len(header) <= offset <= size:
+                    return list(self.iter_users()), current * self.CHANGE_LOG_SPAN + size
+                file.seek(offset)
+                changes = file.read()
+        except FileNotFoundError:
+            return (list(self.iter_users()) if version != 0 else []), 0
+        changes = changes[:changes.rfind(b"\n") + 1]  # a line the other process is still appending is read next time
+        versions = {}
+        for line in changes.decode("utf-8").splitlines():
+            key, stored = line.split(" ")
+            versions[key] = int(stored)
+        records = []
+        for key, stored in versions.items():
+            record = self.resident(key, stored, lambda: self.read(key))
+            if record is not None:
+                records.append(record)
+            else:
+                self.notify(key, None)  # deleted
+        return records, current * self.CHANGE_LOG_SPAN + offset + len(changes)
+
+    # flushing
+
+    def take_dirty(self):
+        """Marks the dirty records clean and returns them as (discord_id, record, merge base)."""
+        keys = list(self.dirty)
+        self.dirty.difference_update(keys)
+        return [(key, self.records[key], self.bases.pop(key, None)) for key in keys if key in self.records]
+
+    def restore_dirty(self, batch):
+        """Marks the records of a failed write_batch() dirty again (with their merge base, unless put() set a newer one)."""
+        for key, _, base in batch:
+            if key not in self.dirty:
+                self.bases[key] = base
+                self.dirty.add(key)
+
+    def apply_versions(self, written):
+        """Takes the result of write_batch(): new versions, merged entries replace the records (unless put() again meanwhile)."""
+        versions, merged = written
+        for key, data in merged.items():
+            if key not in self.dirty:
+                record = self.records[key] = UserRecord(data)
+                self.notify(key, record)
+        for key, version in versions.items():
+            if key in self.records:
+                self.records[key].version = version
+        self.stats["flushes"] += 1
+        self.stats["records_flushed"] += len(versions)
+
+    def flush_now(self):
+        """Writes the dirty records synchronously (no event loop / flusher)."""
+        batch = self.take_dirty()
+        try:
+            self.apply_versions(self.write_batch(batch))
+        except Exception:
+            self.restore_dirty(batch)
+            raise
+
+    async def flush(self):
+        """Writes the dirty records in a thread."""
+        if not self.dirty:
+            return
+        batch = self.take_dirty()
+        try:
+            self.apply_versions(await asyncio.to_thread(self.write_batch, batch))
+        except Exception as e:
+            logger.error(f"❌ Writing {len(batch)} user records failed: {e}")
+            self.restore_dirty(batch)  # retried by the next flush
+        logger.debug(f"💾 Flushed {len(batch)} user records")
+
+    def follow(self):
+        """Re-reads the resident records the other process wrote since the last call (reads don't check the storage)."""
+        try:
+            _, self.followed_version = self.changed_since(self.followed_version)
+        except Exception as e:
+            logger.error(f"❌ Following the user store changes failed: {e}")
+
+    async def flusher(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+            self.follow()
+
+    def start(self):
+        """
+        Starts the background flusher and follower (in the running event loop), from now on put() only marks records
+        dirty and reads are served from the resident records.
+        """
+        if self.flusher_task is None:
+            self.loop, self.loop_thread = asyncio.get_running_loop(), threading.get_ident()
+            self.followed_version = self.current_version()
+            self.flusher_task = asyncio.create_task(self.flusher())
+            logger.info(f"✅ Started user store flusher ({self.flush_interval}s)")
+
+    async def close(self):
+        """Stops the flusher and writes the remaining dirty records."""
+        if self.flusher_task is not None:
+            self.flusher_task.cancel()
+            self.flusher_task = None
+        await self.flush()
+
+    def get_stats(self):
+        return {"backend": type(self).__name__, "resident": len(self.records), "dirty": len(self.dirty), **self.stats}
+
+
+class SqliteUserStore(UserStore):
+    """
+    UserStore backed by one SQLite database (WAL mode) in `directory` instead of one JSON file per user.
+
+    The entry is stored as JSON, the columns the scans need (played minutes, invites, creator code, inviter) are
+    indexed. Both bot processes open the same database: WAL lets them read while the other one writes, writers wait
+    for each other (busy timeout). `updated_at` (time.time_ns() of the write) is the version of a row, changed_since()
+    uses its index instead of a change log.
+    """
+    VERSION_OVERLAP_NS = 2_000_000_000  # changed_since() looks this far back (writes that were in progress during the last call)
+    def __init__(self, directory, flush_interval=USER_STORE_FLUSH_INTERVAL, filename=SQLITE_FILENAME):
+        super().__init__(directory, flush_interval)
+        self.db_path = os.path.join(directory, filename)
+        # One connection for reads (event loop) and one for the batch writes (flusher thread), each behind a lock
+        self.reader = self.connect()
+        self.writer = self.connect()
+        self.reader_lock = threading.Lock()
+        self.writer_lock = threading.Lock()
+        self.create_schema()
+        self.import_json_files()
+
+    def connect(self):
+        connection = sqlite3.connect(self.db_path, timeout=10, isolation_level=None, check_same_thread=False)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")  # with WAL: never corrupt, the last commits may be lost on power loss
+        return connection
+
+    def create_schema(self):
+        with self.writer_lock:
+            self.writer.executescript("""
+                CREATE TABLE IF NOT EXISTS users (
+                    discord_id TEXT PRIMARY KEY,
+                    data TEXT NOT NULL,
+                    discord_name TEXT,
+                    played_minutes INTEGER NOT NULL DEFAULT 0,
+                    total_invites INTEGER NOT NULL DEFAULT 0,
+                    creator_code INTEGER NOT NULL DEFAULT 0,
+                    inviter_id TEXT,
+                    used_code TEXT,
+                    updated_at INTEGER NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS users_played_minutes ON users (played_minutes);
+                CREATE INDEX IF NOT EXISTS users_total_invites ON users (total_invites);
+                CREATE INDEX IF NOT EXISTS users_creator_code ON users (creator_code);
+                CREATE INDEX IF NOT EXISTS users_inviter_id ON users (inviter_id);
+                DROP INDEX IF EXISTS users_chance;
+                CREATE INDEX IF NOT EXISTS users_updated_at ON users (updated_at);
+            """)
+
+    def import_json_files(self):
+        """Imports the user files of the JSON store once, so switching STORAGE_BACKEND keeps the users."""
+        if self.query("SELECT 1 FROM users LIMIT 1"):
+            return
+        batch = [(user["discord_id"], user, None) for user in UserStore(self.directory).iter_users()]
+        if batch:
+            self.write_batch(batch)
+            logger.info(f"✅ Imported {len(batch)} user files into {self.db_path}")
+
+    def query(self, sql, parameters=()):
+        with self.reader_lock:
+            return self.reader.execute(sql, parameters).fetchall()
+
+    def row_record(self, key, version, data):
+        """Record of a queried row: the resident one if it is dirty or at this version, otherwise the row's data."""
+        def loader():
+            self.stats["reads"] += 1
+            record = self.records[key] = UserRecord(json.loads(data), version)
+            self.notify(key, record)
+            return record
+        return self.resident(key, version, loader)
+
+    def load(self, key):
+        rows = self.query("SELECT data, updated_at FROM users WHERE discord_id = ?", (key,))
+        return (json.loads(rows[0][0]), rows[0][1]) if rows else None
+
+    def stored_version(self, key):
+        rows = self.query("SELECT updated_at FROM users WHERE discord_id = ?", (key,))
+        return rows[0][0] if rows else None
+
+    def stored_versions(self):
+        return dict(self.query("SELECT discord_id, updated_at FROM users"))
+
+    def iter_users(self):
+        """Like UserStore.iter_users(), but the changed rows are fetched in a few queries instead of one per user."""
+        versions = self.stored_versions()
+        changed = [key for key, version in versions.items() if key not in self.dirty and getattr(self.records.get(key), "version", None) != version]
+        for start in range(0, len(changed), 500):
+            chunk = changed[start:start + 500]
+            rows = self.query(f"SELECT discord_id, updated_at, data FROM users WHERE discord_id IN ({', '.join('?' * len(chunk))})", chunk)
+            for row in rows:
+                self.row_record(*row)
+        for key in versions.keys() | self.dirty:
+            if key in self.records:
+                yield self.records[key]
+
+    def encode(self, key, record):
+        invite = record.get("invite") or {}
+        return (str(key), json.dumps(record, separators=(",", ":")), record.get("discord_name"), record.get("played_minutes") or 0,
+                invite.get("total_invites") or 0, record.get("creator_code") or 0, invite.get("inviter_id"), invite.get("used_code"))
+
+    def locked_version(self, key):
+        rows = self.writer.execute("SELECT updated_at FROM users WHERE discord_id = ?", (key,)).fetchall()
+        return rows[0][0] if rows else None
+
+    def locked_load(self, key):
+        rows = self.writer.execute("SELECT data, updated_at FROM users WHERE discord_id = ?", (key,)).fetchall()
+        return (json.loads(rows[0][0]), rows[0][1]) if rows else None
+
+    def write_batch(self, batch):
+        with self.writer_lock:
+            self.writer.execute("BEGIN IMMEDIATE")  # the version checks of merge_batch() and the writes in one transaction
+            updated_at = time.time_ns()  # taken holding the write lock, so versions grow in commit order (changed_since())
+            try:
+                encoded, merged = self.merge_batch(batch)
+                self.writer.executemany("""
+                    INSERT INTO users (discord_id, data, discord_name, played_minutes, total_invites, creator_code, inviter_id, used_code, updated_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (discord_id) DO UPDATE SET data = excluded.data, discord_name = excluded.discord_name,
+                        played_minutes = excluded.played_minutes, total_invites = excluded.total_invites, creator_code = excluded.creator_code,
+                        inviter_id = excluded.inviter_id, used_code = excluded.used_code, updated_at = excluded.updated_at
+                """, [item + (updated_at,) for item in encoded])
+                self.writer.execute("COMMIT")
+            except Exception:
+                self.writer.execute("ROLLBACK")
+                raise
+        return {item[0]: updated_at for item in encoded}, merged
+
+    def invited_users(self):
+        rows = self.query("SELECT discord_id, updated_at, data FROM users WHERE inviter_id IS NOT NULL AND used_code IS NOT NULL")
+        return [self.row_record(*row) for row in rows]
+
+    def delete_stored(self, key):
+        with self.writer_lock:
+            self.writer.execute("DELETE FROM users WHERE discord_id = ?", (key,))
+
+    def current_version(self):
+        return time.time_ns()
+
+    def changed_since(self, version):
+        next_version = self.current_version()
+        rows = self.query("SELECT discord_id, updated_at, data FROM users WHERE updated_at >= ?", (version - self.VERSION_OVERLAP_NS,))
+        return [self.row_record(*row) for row in rows], next_version
+
+
+def create_user_store(directory, backend=STORAGE_BACKEND):
+    """Returns the user store of the configured backend ("json" = one file per user, "sqlite" = one database in WAL mode)."""
+    if backend == "sqlite":
+        logger.info(f"🗄️ Using SQLite user store in {directory}")
+        return SqliteUserStore(directory)
+    return UserStore(directory)
+
+# --- END OF USER STORE ---
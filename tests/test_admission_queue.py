@@ -0,0 +1,164 @@
+import os
+import sys
+import asyncio
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))  # src modules import each other by name
+
+from queues import AdmissionQueue, FairAdmissionQueue, RoundRobinBuffer, CpuIntensiveQueue, QueueOverflow
+
+
+def run(coroutine_function):
+    return asyncio.run(coroutine_function())
+
+
+def item(value, loop):
+    """(func, args, kwargs, future, journal_seq) like the items of the DB queues."""
+    return (abs, (value,), {}, loop.create_future(), None)
+
+
+async def drain(queue):
+    values = []
+    while queue.pending():
+        values.append((await queue.get())[1][0])
+        queue.task_done()
+    return values
+
+
+def test_unknown_overflow_policy():
+    with pytest.raises(ValueError):
+        AdmissionQueue("Test", 1, "drop-everything")
+
+
+def test_reject_policy(tmp_path):
+    async def main():
+        loop = asyncio.get_running_loop()
+        queue = AdmissionQueue("Test", 2, "reject", spill_dir=str(tmp_path))
+        queue.admit(item(1, loop))
+        queue.admit(item(2, loop))
+        with pytest.raises(QueueOverflow):
+            queue.admit(item(3, loop))
+        assert queue.get_stats()["rejected"] == 1
+        assert await drain(queue) == [1, 2]
+    run(main)
+
+
+def test_shed_oldest_policy(tmp_path):
+    async def main():
+        loop = asyncio.get_running_loop()
+        queue = AdmissionQueue("Test", 2, "shed-oldest", spill_dir=str(tmp_path))
+        first = item(1, loop)
+        queue.admit(first)
+        queue.admit(item(2, loop))
+        queue.admit(item(3, loop))
+        assert isinstance(first[3].exception(), QueueOverflow)  # its caller is told
+        assert await drain(queue) == [2, 3]
+        await asyncio.wait_for(queue.join(), 1)  # the shed item counts as done
+    run(main)
+
+
+def test_spill_policy_keeps_order_and_futures(tmp_path):
+    async def main():
+        loop = asyncio.get_running_loop()
+        queue = AdmissionQueue("Test", 2, "spill", spill_dir=str(tmp_path))
+        items = [item(value, loop) for value in range(1, 6)]
+        for queued in items:
+            queue.admit(queued)
+        assert (queue.qsize(), queue.pending(), queue.get_stats()["spilled"]) == (2, 5, 3)
+        assert queue.position_of(items[4][3]) == 5
+        received = []
+        while queue.pending():
+            got = await queue.get()
+            received.append(got)
+        assert [got[1][0] for got in received] == [1, 2, 3, 4, 5]
+        assert all(got[3] is queued[3] for got, queued in zip(received, items))  # spilled items get their future back
+        assert [name for name in os.listdir(queue.spill_dir) if name.endswith(".pickle")] == []
+    run(main)
+
+
+def test_spills_of_a_dead_process_are_recovered(tmp_path):
+    async def main():
+        loop = asyncio.get_running_loop()
+        dead = AdmissionQueue("DB Test", 1, "spill", spill_dir=str(tmp_path))
+        for value in range(1, 5):
+            dead.admit(item(value, loop))
+
+        live = AdmissionQueue("DB Test", 1, "spill", spill_dir=str(tmp_path))
+        assert live.orphaned_spills == []  # the lock is still held: not claimed
+
+        os.close(dead.spill_lock_fd)  # the process is gone
+        other_queue = AdmissionQueue("Other", 1, "spill", spill_dir=str(tmp_path))
+        assert other_queue.orphaned_spills == []
+        restarted = AdmissionQueue("DB Test", 1, "spill", spill_dir=str(tmp_path))
+        assert len(restarted.orphaned_spills) == 3
+        assert not os.path.exists(dead.spill_dir)
+
+        recovered = restarted.recover_spills(loop.create_future, keep=lambda recovered_item: recovered_item[1][0] != 3)
+        assert recovered == 2
+        assert await drain(restarted) == [2, 4]
+    run(main)
+
+
+def owned(owner, value, loop, enqueued=0.0):
+    """(func, args, kwargs, future, enqueued, owner) like the items of the CPU queue."""
+    return (abs, (value,), {}, loop.create_future(), enqueued, owner)
+
+
+def test_round_robin_serves_owners_in_turn():
+    buffer = RoundRobinBuffer(owner_index=0)
+    for entry in [("a", 1), ("a", 2), ("a", 3), ("b", 1), ("c", 1), ("b", 2)]:
+        buffer.append(entry)
+    order = [("a", 1), ("b", 1), ("c", 1), ("a", 2), ("b", 2), ("a", 3)]
+    assert list(buffer) == order
+    assert [buffer.popleft() for _ in range(len(buffer))] == order
+    assert len(buffer) == 0
+
+
+def test_round_robin_sheds_the_heaviest_owner():
+    buffer = RoundRobinBuffer(owner_index=0)
+    for entry in [("a", 1), ("b", 1), ("b", 2), ("b", 3)]:
+        buffer.append(entry)
+    assert buffer.pop_oldest() == ("b", 1)
+    assert buffer.remove_owner("b") == [("b", 2), ("b", 3)]
+    assert (len(buffer), buffer.queued("a"), buffer.queued("b")) == (1, 1, 0)
+
+
+def test_fair_queue_one_heavy_user_doesnt_starve_others(tmp_path):
+    async def main():
+        loop = asyncio.get_running_loop()
+        queue = FairAdmissionQueue("CPU", 0, "reject", spill_dir=str(tmp_path))
+        for value in range(5):
+            queue.admit(owned("heavy", value, loop))
+        queue.admit(owned("light", 100, loop))
+        assert queue.position_for("light") == 4  # heavy, light, heavy ... -> after its current item: 2nd round
+        assert queue.position_for("other") == 3
+        assert [(await queue.get())[1][0] for _ in range(3)] == [0, 100, 1]
+    run(main)
+
+
+def test_fair_queue_remove_owner_and_shedding(tmp_path):
+    async def main():
+        loop = asyncio.get_running_loop()
+        queue = FairAdmissionQueue("CPU", 3, "shed-oldest", spill_dir=str(tmp_path))
+        heavy = [owned("heavy", value, loop, enqueued=value) for value in range(2)]
+        for queued in heavy:
+            queue.admit(queued)
+        queue.admit(owned("light", 100, loop, enqueued=5))
+        queue.admit(owned("light", 101, loop, enqueued=6))  # full: the heaviest owner's oldest item is shed
+        assert isinstance(heavy[0][3].exception(), QueueOverflow)
+        assert queue.peek()[1][0] == 1  # oldest item in memory
+        assert [removed[1][0] for removed in queue.remove_owner("light")] == [100, 101]
+        assert (queue.qsize(), queue.owners()) == (1, 1)
+    run(main)
+
+
+def test_rejected_cpu_task_keeps_the_users_token():
+    async def main():
+        queue = CpuIntensiveQueue(max_workers=1, capacity=1)  # workers not started: tasks stay queued
+        asyncio.create_task(queue.add_task(abs, 1, user_id=1))
+        await asyncio.sleep(0)
+        with pytest.raises(QueueOverflow):
+            await queue.add_task(abs, 2, user_id=2)
+        assert 2 not in queue.user_buckets
+    run(main)
@@ -0,0 +1,40 @@
+import os
+import sys
+import asyncio
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))  # src modules import each other by name
+
+from aggregates import UserAggregates
+
+
+def user(discord_id, played_minutes):
+    return {"discord_id": str(discord_id), "played_minutes": played_minutes, "images": [], "invite": {"total_invites": 0}}
+
+
+def process(path, version, *users):
+    """The aggregates of one bot process, synced up to `version`."""
+    aggregates = UserAggregates(checkpoint_path=path)
+    for entry in users:
+        aggregates.update(entry["discord_id"], entry)
+    aggregates.synced_version = version
+    return aggregates
+
+
+def test_older_checkpoint_doesnt_replace_newer_one(tmp_path):
+    path = str(tmp_path / "aggregates.json")
+    newer, older = process(path, 20, user(1, 60), user(2, 30)), process(path, 10, user(1, 60))
+    asyncio.run(newer.checkpoint())
+    asyncio.run(older.checkpoint())
+    assert (newer.stats["checkpoints"], older.stats["checkpoints_skipped"]) == (1, 1)
+
+    restarted = UserAggregates(checkpoint_path=path)
+    assert (restarted.synced_version, restarted.totals["played_minutes"]) == (20, 90)
+
+
+def test_newer_checkpoint_replaces_older_one(tmp_path):
+    path = str(tmp_path / "aggregates.json")
+    asyncio.run(process(path, 10, user(1, 60)).checkpoint())
+    asyncio.run(process(path, 20, user(1, 120)).checkpoint())
+    restarted = UserAggregates(checkpoint_path=path)
+    assert (restarted.synced_version, restarted.totals["played_minutes"]) == (20, 120)
+    assert sorted(os.listdir(tmp_path)) == ["aggregates.json", "aggregates.json.lock"]  # no temp files left
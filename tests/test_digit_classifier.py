@@ -0,0 +1,72 @@
+import os
+import sys
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))  # src modules import each other by name
+
+from ai import DigitTemplateClassifier, DIGIT_TEMPLATES_PER_CHAR
+
+
+def field(text, font=cv2.FONT_HERSHEY_SIMPLEX, scale=1.2, spacing=28):
+    """Light glyphs on a dark background, like the fields of the proof popup (one putText per char, so they don't touch)."""
+    image = np.zeros((48, 20 + spacing * len(text)), np.uint8)
+    for i, char in enumerate(text):
+        cv2.putText(image, char, (10 + spacing * i, 38), font, scale, 255, 2, cv2.LINE_AA)
+    return image
+
+
+def trained(tmp_path, text="0123456789X"):
+    classifier = DigitTemplateClassifier(path=str(tmp_path / "templates.npz"))
+    assert classifier.learn(field(text), text)
+    classifier.save()
+    return classifier
+
+
+def test_reads_learned_digits(tmp_path):
+    classifier = trained(tmp_path)
+    assert classifier.read(field("2024")) == "2024"
+    assert classifier.read(field("13X7")) == "13X7"
+
+
+def test_without_templates_nothing_is_read(tmp_path):
+    classifier = DigitTemplateClassifier(path=str(tmp_path / "missing.npz"))
+    classifier.load()
+    assert classifier.classify(field("12")) is None
+    assert classifier.read(field("12")) is None
+
+
+def test_unknown_glyphs_are_not_read(tmp_path):
+    classifier = trained(tmp_path, "0123456789")
+    text, confidences = classifier.classify(field("5A5"))
+    assert len(text) == 3 and len(confidences) == 3
+    assert classifier.read(field("5A5")) is None  # the A matches no digit well enough
+
+
+def test_segmentation_mismatch_is_not_learned(tmp_path):
+    classifier = DigitTemplateClassifier(path=str(tmp_path / "templates.npz"))
+    assert not classifier.learn(field("12"), "123")
+    assert classifier.templates == {}
+
+
+def test_templates_per_char_are_capped(tmp_path):
+    classifier = DigitTemplateClassifier(path=str(tmp_path / "templates.npz"))
+    for scale in np.linspace(0.9, 1.5, DIGIT_TEMPLATES_PER_CHAR + 3):
+        classifier.learn(field("7", scale=scale), "7")
+    assert len(classifier.templates["7"]) == DIGIT_TEMPLATES_PER_CHAR
+    assert not classifier.learn(field("7"), "7")
+
+
+def test_save_merges_templates_of_other_workers(tmp_path):
+    path = str(tmp_path / "templates.npz")
+    first, second = DigitTemplateClassifier(path=path), DigitTemplateClassifier(path=path)
+    first.learn(field("12"), "12")
+    first.save()
+    second.learn(field("34"), "34")
+    second.save()  # merges the templates the first worker saved
+
+    reloaded = DigitTemplateClassifier(path=path)
+    reloaded.load()
+    assert sorted(reloaded.templates) == ["1", "2", "3", "4"]
+    assert reloaded.read(field("4321")) == "4321"
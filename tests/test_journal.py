@@ -0,0 +1,96 @@
+import os
+import sys
+import asyncio
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))  # src modules import each other by name
+
+from journal import Journal
+
+
+def run(coroutine_function):
+    return asyncio.run(coroutine_function())
+
+
+def segment_files(journal):
+    return sorted(filename for filename in os.listdir(journal.path) if filename.endswith(".seg"))
+
+
+async def write(directory, records, segment_bytes=64, ack=()):
+    """Appends the records one commit at a time, acks the given indexes and closes the journal (like a crash)."""
+    journal = Journal("test", directory=directory, segment_bytes=segment_bytes, commit_delay=0)
+    journal.open()
+    await journal.start()
+    seqs = [await journal.append(record) for record in records]
+    journal.ack([seqs[i] for i in ack])
+    journal.close()
+    return journal, seqs
+
+
+def reopen(directory):
+    journal = Journal("test", directory=directory, commit_delay=0)
+    return journal, journal.open()
+
+
+def test_acked_segments_are_deleted(tmp_path):
+    async def main():
+        journal, seqs = await write(str(tmp_path), [f"record {i}" for i in range(6)], ack=range(4))
+        assert seqs == list(range(6))
+        assert journal.get_stats()["commits"] == 6
+        assert len(segment_files(journal)) < 6  # every segment holds more than one record ...
+        assert all(segment.unacked for segment in journal.segments if segment is not journal.active)  # ... acked ones are gone
+    run(main)
+
+
+def test_unacked_records_are_replayed(tmp_path):
+    async def main():
+        written, _ = await write(str(tmp_path), [{"user": i} for i in range(6)], ack=[0, 1, 3])
+        # 40-byte records, 64-byte segments: two records per segment
+        kept = {seq for segment in written.segments for seq in range(segment.first_seq, segment.first_seq + 2)}
+        journal, replayed = reopen(str(tmp_path))
+        assert [seq for seq, _ in replayed] == sorted(kept)  # acks are per segment: acked records of a kept segment come again
+        assert {2, 4, 5} <= kept and not {0, 1} & kept
+        assert all(record == {"user": seq} for seq, record in replayed)
+        assert journal.next_seq == 6  # new records don't reuse sequence numbers
+
+        journal.ack([seq for seq, _ in replayed])
+        journal.close()
+        assert reopen(str(tmp_path))[1] == []
+    run(main)
+
+
+def test_truncated_tail_is_cut_off(tmp_path):
+    async def main():
+        journal, _ = await write(str(tmp_path), ["a", "b", "c"], segment_bytes=1 << 20)
+        path = journal.segments[0].path
+        with open(path, "r+b") as segment_file:
+            segment_file.truncate(os.path.getsize(path) - 3)  # crash in the middle of the last write
+
+        reopened, replayed = reopen(str(tmp_path))
+        assert replayed == [(0, "a"), (1, "b")]
+        assert reopened.stats["corrupt_tails"] == 1
+        assert os.path.getsize(path) == reopened.segments[0].size  # the torn record is gone from the file
+
+        await reopened.start()
+        assert await reopened.append("d") == 2
+        reopened.close()
+        assert reopen(str(tmp_path))[1] == [(0, "a"), (1, "b"), (2, "d")]
+    run(main)
+
+
+def test_corrupt_record_keeps_later_segments(tmp_path):
+    async def main():
+        journal, _ = await write(str(tmp_path), [f"record {i}" for i in range(6)])
+        first, second = journal.segments[0], journal.segments[1]
+        with open(first.path, "r+b") as segment_file:
+            segment_file.seek(-1, os.SEEK_END)
+            last_byte = segment_file.read(1)
+            segment_file.seek(-1, os.SEEK_END)
+            segment_file.write(bytes([last_byte[0] ^ 0xFF]))  # CRC mismatch in the last record of the first segment
+
+        reopened, replayed = reopen(str(tmp_path))
+        seqs = [seq for seq, _ in replayed]
+        assert reopened.stats["corrupt_tails"] == 1
+        assert max(first.unacked) not in seqs  # the corrupt record is dropped ...
+        assert set(second.unacked) <= set(seqs)  # ... the records after it are still valid
+        assert all(record == f"record {seq}" for seq, record in replayed)
+    run(main)
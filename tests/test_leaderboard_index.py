@@ -0,0 +1,83 @@
+import os
+import sys
+import random
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))  # src modules import each other by name
+
+from leaderboard_index import IndexableSkipList, LeaderboardIndex
+from user_store import UserStore
+
+
+def user(discord_id, played_minutes=0, invites=0, creator_code=0, name="user"):
+    return {"discord_id": str(discord_id), "discord_name": name, "played_minutes": played_minutes,
+            "invite": {"total_invites": invites}, "creator_code": creator_code}
+
+
+def test_skip_list_matches_sorted_list():
+    rng = random.Random(1)
+    skip_list, expected = IndexableSkipList(seed=2), []
+    for _ in range(2000):
+        key = rng.randrange(500)
+        if key in expected and rng.random() < 0.5:
+            assert skip_list.remove(key) == f"v{key}"
+            expected.remove(key)
+        elif key not in expected:
+            skip_list.insert(key, f"v{key}")
+            expected.append(key)
+            expected.sort()
+    assert len(skip_list) == len(expected)
+    assert [key for key, _ in skip_list.first(len(expected) + 10)] == expected
+    for position, key in enumerate(expected, 1):
+        assert skip_list.rank(key) == position
+    assert skip_list.rank(-1) is None
+
+
+def test_skip_list_first_k_and_missing_key():
+    skip_list = IndexableSkipList(seed=3)
+    for key in (5, 1, 3):
+        skip_list.insert(key, str(key))
+    assert skip_list.first(2) == [(1, "1"), (3, "3")]
+    try:
+        skip_list.remove(4)
+    except KeyError:
+        pass
+    else:
+        raise AssertionError("removing a missing key must raise KeyError")
+
+
+def test_rank_follows_score_changes():
+    index = LeaderboardIndex()
+    index.update("1", user(1, played_minutes=60))
+    index.update("2", user(2, played_minutes=120))
+    index.update("3", user(3, invites=5))
+    assert [entry["discord_id"] for entry in index.top(10)] == ["3", "2", "1"]
+    assert index.rank("1")[0] == 3
+
+    index.update("1", user(1, played_minutes=600))  # 11x now
+    assert index.rank("1") == (1, index.top(1)[0])
+    assert [entry["discord_id"] for entry in index.top(2)] == ["1", "3"]
+    assert len(index) == 3
+
+
+def test_ties_unnamed_and_removed_users():
+    index = LeaderboardIndex()
+    index.update("20", user(20, played_minutes=60))
+    index.update("10", user(10, played_minutes=60))
+    assert [entry["discord_id"] for entry in index.top(2)] == ["10", "20"]  # same chance: by discord_id
+    index.update("30", user(30, played_minutes=6000, name=None))
+    assert index.rank("30") is None  # not named: not ranked
+    index.update("10", None)
+    assert index.rank("10") is None
+    assert index.rank("20")[0] == 1
+
+
+def test_sync_applies_other_process_writes(tmp_path):
+    reader, writer = UserStore(str(tmp_path)), UserStore(str(tmp_path))
+    writer.put(1, user(1, played_minutes=60))
+    index = LeaderboardIndex()
+    reader.add_listener(index.update)
+    index.rebuild(reader)
+    writer.put(2, user(2, played_minutes=600))
+    writer.delete(1)
+    index.sync(reader)
+    assert [entry["discord_id"] for entry in index.top(10)] == ["2"]
@@ -0,0 +1,138 @@
+import os
+import sys
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))  # src modules import each other by name
+
+from restore import read_restore_mark, write_restore_mark, catch_up, delete_missing
+
+
+# Fake asyncpg connection: one table of rows with discord_id and updated_at
+
+class FakeTransaction:
+    def __init__(self, conn, options):
+        self.conn = conn
+        self.options = options
+
+    async def __aenter__(self):
+        self.conn.transactions.append(self.options)
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+
+class FakeCursor:
+    def __init__(self, rows):
+        self.rows = rows
+        self.fetches = 0
+
+    async def fetch(self, n):
+        rows, self.rows = self.rows[:n], self.rows[n:]
+        self.fetches += 1
+        return rows
+
+
+class FakeConnection:
+    def __init__(self, rows):
+        self.rows = rows
+        self.transactions = []
+        self.queries = []
+
+    def transaction(self, **options):
+        return FakeTransaction(self, options)
+
+    async def fetch(self, query):
+        self.queries.append((query, ()))
+        return [{"discord_id": row["discord_id"]} for row in self.rows]
+
+    async def fetchval(self, query):
+        return max((row["updated_at"] for row in self.rows), default=None)
+
+    async def cursor(self, query, *args):
+        self.queries.append((query, args))
+        rows = [row for row in self.rows if not args or row["updated_at"] >= args[0]]
+        self.cursor_ = FakeCursor(sorted(rows, key=lambda row: row["updated_at"], reverse=True))
+        return self.cursor_
+
+
+NOW = datetime(2026, 10, 1, 12, 0, tzinfo=timezone.utc)
+
+
+def make_rows(ages):
+    """Rows of users "0", "1", ... updated `age` seconds before NOW."""
+    return [{"discord_id": str(i), "updated_at": NOW - timedelta(seconds=age)} for i, age in enumerate(ages)]
+
+
+def run_catch_up(conn, mark, keep_local=lambda discord_id: False, **kwargs):
+    saved = []
+    result = asyncio.run(catch_up(conn, "users", mark, keep_local, lambda discord_id, row: saved.append(discord_id), **kwargs))
+    return result, saved
+
+
+def test_restore_mark_round_trip(tmp_path):
+    path = str(tmp_path / "restore_mark")
+    assert read_restore_mark(path, "users", "json") is None
+    write_restore_mark(path, "users", "json", NOW)
+    assert read_restore_mark(path, "users", "json") == NOW
+    assert read_restore_mark(path, "users_dev", "json") is None  # snapshot of another table
+    assert read_restore_mark(path, "users", "sqlite") is None  # ... or storage backend
+    write_restore_mark(path, "users", "json", None)
+    assert read_restore_mark(path, "users", "json") is None
+
+
+def test_full_restore_without_mark():
+    conn = FakeConnection(make_rows([30, 10, 20, 5000]))
+    (high_water, restored, skipped), saved = run_catch_up(conn, None, batch_size=3)
+    assert saved == ["1", "2", "0", "3"]  # most recently updated first
+    assert (high_water, restored, skipped) == (NOW - timedelta(seconds=10), 4, 0)
+    assert conn.queries[0][1] == ()
+    assert conn.cursor_.fetches == 3  # two batches and the empty fetch
+    assert conn.transactions == [{"isolation": "repeatable_read", "readonly": True}]
+
+
+def test_catch_up_since_mark_minus_overlap():
+    mark = NOW - timedelta(seconds=1000)
+    conn = FakeConnection(make_rows([10, 1100, 1500, 5000]))
+    (high_water, restored, skipped), saved = run_catch_up(conn, mark, overlap=300)
+    assert conn.queries[0][1] == (mark - timedelta(seconds=300),)
+    assert saved == ["0", "1"]  # changed after the mark, or within the overlap before it
+    assert (high_water, restored, skipped) == (NOW - timedelta(seconds=10), 2, 0)
+
+
+def test_catch_up_keeps_local_changes():
+    conn = FakeConnection(make_rows([1, 2, 3, 4]))
+    dirty, pending, loaded_on_demand = {"0"}, {"2"}, {"3"}
+    keep_local = lambda discord_id: discord_id in loaded_on_demand or discord_id in dirty or discord_id in pending
+    (high_water, restored, skipped), saved = run_catch_up(conn, NOW - timedelta(hours=1), keep_local)
+    assert saved == ["1"]
+    assert (restored, skipped) == (1, 3)
+
+
+def test_catch_up_of_empty_table_keeps_mark():
+    mark = NOW - timedelta(hours=1)
+    (high_water, restored, skipped), saved = run_catch_up(FakeConnection([]), mark)
+    assert (high_water, restored, skipped, saved) == (mark, 0, 0, [])
+
+
+def run_delete_missing(conn, local_ids, keep_local=lambda discord_id: False):
+    deleted = []
+    count = asyncio.run(delete_missing(conn, "users", local_ids, keep_local, deleted.append))
+    return count, sorted(deleted)
+
+
+def test_delete_missing_deletes_users_deleted_in_postgres():
+    conn = FakeConnection(make_rows([1, 2]))  # users "0" and "1"
+    pending = {"3"}  # created locally, its first write isn't in PostgreSQL yet
+    count, deleted = run_delete_missing(conn, {"0", "1", "2", "3"}, lambda discord_id: discord_id in pending)
+    assert (count, deleted) == (1, ["2"])
+
+
+def test_delete_missing_keeps_snapshot_if_table_is_empty():
+    assert run_delete_missing(FakeConnection([]), {"0", "1"}) == (0, [])
+
+
+def test_delete_missing_without_candidates_skips_query():
+    conn = FakeConnection(make_rows([1]))
+    assert run_delete_missing(conn, {"5"}, lambda discord_id: True) == (0, [])  # only users with local changes
+    assert conn.queries == []
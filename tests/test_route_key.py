@@ -0,0 +1,44 @@
+import os
+import sys
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))  # src modules import each other by name
+
+from queues import route_key
+
+
+# Stand-ins for the discord.py objects whose bound methods go through the RateLimitQueue
+
+class Bound(SimpleNamespace):
+    def send(self):
+        pass
+
+    def add_roles(self):
+        pass
+
+
+class Channel(Bound):
+    def permissions_for(self, member):
+        pass
+
+
+GUILD = SimpleNamespace(id=1)
+CHANNEL = Channel(id=10, guild=GUILD)
+
+
+def test_message_and_channel_methods_key_on_the_channel():
+    assert route_key(Bound(id=100, channel=CHANNEL).send) == ("send", 10)
+    assert route_key(CHANNEL.send) == ("send", 10)  # not its guild
+
+
+def test_interaction_response_keys_on_the_interaction():
+    assert route_key(Bound(_parent=SimpleNamespace(id=50)).send) == ("send", 50)
+
+
+def test_member_methods_key_on_the_guild():
+    first, second = Bound(id=200, guild=GUILD), Bound(id=201, guild=GUILD)
+    assert route_key(first.add_roles) == route_key(second.add_roles) == ("add_roles", 1)
+
+
+def test_other_objects_key_on_themselves():
+    assert route_key(Bound(id=300).send) == ("send", 300)
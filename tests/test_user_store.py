@@ -0,0 +1,67 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))  # src modules import each other by name
+
+from user_store import merge_entries, UserStore, SqliteUserStore
+
+
+BASE = {"discord_id": "1", "played_minutes": 60, "creator_code": 0, "images": ["a.png"],
+        "invite": {"total_invites": 1, "invited_users": ["2"]}}
+
+
+def changed(**fields):
+    return {**BASE, **fields}
+
+
+def test_fields_changed_by_one_side():
+    ours = changed(played_minutes=90)
+    theirs = changed(creator_code=7)
+    assert merge_entries(BASE, ours, theirs) == changed(played_minutes=90, creator_code=7)
+
+
+def test_conflicting_field_takes_ours():
+    assert merge_entries(BASE, changed(played_minutes=90), changed(played_minutes=75))["played_minutes"] == 90
+
+
+def test_nested_dicts_are_merged_by_field():
+    ours = changed(invite={"total_invites": 2, "invited_users": ["2"]})
+    theirs = changed(invite={"total_invites": 1, "invited_users": ["2"], "inviter": "9"})
+    assert merge_entries(BASE, ours, theirs)["invite"] == {"total_invites": 2, "invited_users": ["2"], "inviter": "9"}
+
+
+def test_lists_get_the_appends_of_both_sides():
+    ours = changed(images=["a.png", "b.png"], invite={"total_invites": 2, "invited_users": ["2", "3"]})
+    theirs = changed(images=["a.png", "c.png"], invite={"total_invites": 2, "invited_users": ["2", "3"]})
+    merged = merge_entries(BASE, ours, theirs)
+    assert merged["images"] == ["a.png", "c.png", "b.png"]
+    assert merged["invite"]["invited_users"] == ["2", "3"]  # appended by both: only once
+
+
+def test_rewritten_list_takes_ours():
+    assert merge_entries(BASE, changed(images=["b.png"]), changed(images=["a.png", "c.png"]))["images"] == ["b.png"]
+
+
+def test_without_base_ours_wins_where_different():
+    ours = {"discord_id": "1", "played_minutes": 30}
+    theirs = {"discord_id": "1", "played_minutes": 20, "creator_code": 5}
+    assert merge_entries(None, ours, theirs) == {"discord_id": "1", "played_minutes": 30, "creator_code": 5}
+
+
+@pytest.mark.parametrize("store_class", [UserStore, SqliteUserStore])
+def test_concurrent_writes_of_two_stores_are_merged(tmp_path, store_class):
+    first, second = store_class(str(tmp_path)), store_class(str(tmp_path))
+    first.put(1, BASE)
+    entry = first.get(1)
+    other = second.get(1)
+
+    other["creator_code"] = 7
+    second.put(1, other)  # written by the other process after this one read the entry
+    entry["played_minutes"] = 90
+    first.put(1, entry)
+
+    assert first.stats["merges"] == 1
+    assert first.get(1) == changed(played_minutes=90, creator_code=7)
+    assert store_class(str(tmp_path)).get(1) == changed(played_minutes=90, creator_code=7)
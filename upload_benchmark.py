@@ -0,0 +1,80 @@
+import os
+import sys
+import time
+import shutil
+import asyncio
+import argparse
+import tempfile
+import numpy as np
+
+# The benchmark runs offline against the filesystem-backed bucket, the modules in src import each other like in the bot.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "src"))
+os.environ.setdefault("SECRET_TIMETRACKER_KEY", "13456789012345679")
+
+from queues import ObjectStorageQueue
+from journal import Journal
+from object_storage import LocalBucketClient
+
+
+# OFFLINE UPLOAD BENCHMARK
+# Uploads random image-sized buffers through ObjectStorageQueue into a LocalBucketClient that simulates the latency
+# and failures of the real bucket, once per worker count.
+#
+#   python upload_benchmark.py --uploads 200 --size-kb 800 --latency 0.05 --failure-rate 0.05 --workers 1 4 8
+
+
+async def run_benchmark(args, workers, directory):
+    """Uploads `args.uploads` buffers with `workers` concurrent uploads and returns the metrics."""
+    client = LocalBucketClient(os.path.join(directory, f"bucket_{workers}"), latency=args.latency, failure_rate=args.failure_rate, seed=args.seed)
+
+    async def upload(data, name):
+        await asyncio.to_thread(client.upload_from_bytes, name, data)
+
+    journal = Journal(f"uploads_{workers}", directory=os.path.join(directory, "journal")) if args.journal else None
+    queue = ObjectStorageQueue(max_workers=workers, upload_func=upload, journal=journal, capacity=0, overflow="reject", backoff_base=args.backoff_base)
+    await queue.start_workers()
+
+    rng = np.random.default_rng(args.seed)
+    buffers = [rng.bytes(args.size_kb * 1024) for _ in range(args.uploads)]
+    start_time = time.perf_counter()
+    futures = [await queue.add_upload(f"{index}.png", data) for index, data in enumerate(buffers)]
+    results = await asyncio.gather(*futures, return_exceptions=True)
+    elapsed = time.perf_counter() - start_time
+    if journal is not None:
+        journal.close()
+
+    stats = queue.get_stats()
+    return {
+        "uploads_per_sec": args.uploads / elapsed,
+        "mb_per_sec": args.uploads * args.size_kb / 1024 / elapsed,
+        "p50": stats["upload_latency_p50"],
+        "p95": stats["upload_latency_p95"],
+        "retries": stats["retries"],
+        "failed": sum(isinstance(result, Exception) for result in results),
+        "stored": len(client.list())
+    }
+
+
+async def main(args):
+    directory = tempfile.mkdtemp(prefix="upload_benchmark_")
+    print(f"{'workers':>7} {'uploads/s':>10} {'MB/s':>8} {'p50 [s]':>8} {'p95 [s]':>8} {'retries':>8} {'failed':>7} {'stored':>7}")
+    try:
+        for workers in args.workers:
+            metrics = await run_benchmark(args, workers, directory)
+            print(f"{workers:>7} {metrics['uploads_per_sec']:>10.2f} {metrics['mb_per_sec']:>8.2f} {metrics['p50']:>8.3f} {metrics['p95']:>8.3f} "
+                  f"{metrics['retries']:>8} {metrics['failed']:>7} {metrics['stored']:>7}")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline object storage upload benchmark (filesystem-backed bucket).")
+    parser.add_argument("--uploads", type=int, default=200)
+    parser.add_argument("--size-kb", type=int, default=800, help="Size of one upload (a typical proof screenshot)")
+    parser.add_argument("--latency", type=float, default=0.05, help="Simulated seconds per upload request")
+    parser.add_argument("--failure-rate", type=float, default=0.05, help="Share of failing upload requests")
+    parser.add_argument("--backoff-base", type=float, default=0.05, help="Retry backoff base in seconds")
+    parser.add_argument("--journal", action="store_true", help="Journal every upload first (like the bot)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4, 8], help="Concurrent uploads to compare")
+    asyncio.run(main(parser.parse_args()))